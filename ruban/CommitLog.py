@@ -0,0 +1,432 @@
+from collections import namedtuple
+from enum import Enum, IntEnum
+from threading import Thread, Lock, Condition
+from time import perf_counter
+import pickle
+import struct
+import zlib
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# CommitLog is an append-only write-ahead log of a peer's offers.
+#
+# Every committed chain is recorded with its digest (Chain.digest()) and
+# pickled payload before the application is told about it, and aborted offers
+# with a tombstone. A restarted peer does not revive the offers it had in
+# flight (their leaders abort them or it catches up on them), so ruban.Trader
+# logs outcomes only; PENDING records are there for applications that track
+# offers across restarts themselves.
+#
+# The log is a directory of segment files named after their first sequence
+# number. A segment is rolled once it grows past <segment_size>.
+#
+#   00000000000000000001.log  00000000000000052113.log  ...
+#
+# record: <payload length u32><crc32 u32><seq u64><kind u8><digest 16B><payload>
+#         crc32 covers everything after itself
+#
+# Durability:
+#   OS     records are written to the OS on append; survives a crash of the
+#          process but not of the machine
+#   ASYNC  a background thread writes and fsyncs every <sync_interval>;
+#          append returns immediately
+#   GROUP  append returns once its record is fsynced. Concurrent appends share
+#          one write() and one fsync() (group commit): whoever finds no sync in
+#          progress writes everything buffered so far, the others wait for it.
+#
+# A torn record at the end of the last segment (crash mid-write) is truncated
+# when the log is opened.
+#
+# Snapshots (<seq>.snap, see ruban.Snapshot) hold the application state after
+# the commit at <seq>, with the pending offers and tombstones at that point.
+# Segments that only hold records up to the latest snapshot are deleted, so
+# recovery loads the snapshot and replays only the tail.
+
+HEADER = struct.Struct("!IIQB16s")
+PREFIX = struct.Struct("!II")     # length, crc32
+CHECKED = struct.Struct("!QB16s") # seq, kind, digest
+DIGEST_SIZE = 16
+NO_DIGEST = bytes(DIGEST_SIZE)
+
+Record = namedtuple("Record", "seq kind digest payload")
+# <history> only holds chains committed after snapshot <seq> (0 if none)
+Recovered = namedtuple("Recovered", "history pending tombstones state seq",
+                       defaults=(None, 0))
+
+def encode(seq, kind, digest, payload) -> bytes:
+    checked = CHECKED.pack(seq, kind, digest)
+    crc = zlib.crc32(payload, zlib.crc32(checked))
+    return PREFIX.pack(len(payload), crc) + checked + payload
+
+def decode(buffer, offset=0):
+    """
+    Records in <buffer> from <offset>; stops at the first torn or corrupt
+    record. Yields (end offset, Record) with <payload> a memoryview slice.
+    """
+    view = memoryview(buffer)
+    end = len(buffer)
+    while end - offset >= HEADER.size:
+        length, crc, seq, kind, digest = HEADER.unpack_from(buffer, offset)
+        record_end = offset + HEADER.size + length
+        if record_end > end or zlib.crc32(view[offset + PREFIX.size:record_end]) != crc:
+            return
+        yield record_end, Record(seq, kind, digest, view[offset + HEADER.size:record_end])
+        offset = record_end
+
+def segment_name(first_seq):
+    return f"{first_seq:020d}.log"
+
+def snapshot_name(seq):
+    return f"{seq:020d}.snap"
+
+
+class CommitLog:
+    class Durability(Enum):
+        OS    = 0
+        ASYNC = 1
+        GROUP = 2
+
+    class Kind(IntEnum):
+        COMMIT    = 1  # payload: pickled chain
+        PENDING   = 2  # payload: pickled chain
+        TOMBSTONE = 3  # digest only
+
+    SEGMENT_SIZE = 64 << 20  # bytes
+    SYNC_INTERVAL = 0.005    # seconds, for ASYNC
+
+    def __init__(self, path, durability=Durability.GROUP,
+                 segment_size=SEGMENT_SIZE, sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.durability = durability
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        os.makedirs(path, exist_ok=True)
+
+        self.lock = Lock()
+        self.synced = Condition(self.lock)
+        self.buffer = []       # encoded records not written yet
+        self.syncing = False   # a thread is writing and fsyncing
+        self.durable_seq = 0   # highest fsynced seq
+        self.closed = False
+
+        self.next_seq = self.__open_tail() + 1
+        self.durable_seq = self.next_seq - 1
+
+        # pending offers { digest --> pickled chain } and tombstones as of
+        # the last append, carried into snapshots
+        self.pending_offers = {}
+        self.tombstones = set()
+        snapshot = self.latest_snapshot()
+        if snapshot:
+            self.pending_offers.update(snapshot["pending"])
+            self.tombstones.update(snapshot["tombstones"])
+        for record in self.replay(snapshot["seq"] + 1 if snapshot else 1):
+            self.__mark(record.kind, record.digest, record.payload)
+
+        self.flusher = None
+        if durability == CommitLog.Durability.ASYNC:
+            self.flusher = Thread(target=self.__flush_loop, daemon=True)
+            self.flusher.start()
+
+    # =====================================
+    # writing
+    # -------------------------
+    def commit(self, chain, wait=True) -> int:
+        return self.append(CommitLog.Kind.COMMIT, chain.digest(), pickle.dumps(chain), wait)
+
+    def pending(self, chain, wait=True) -> int:
+        return self.append(CommitLog.Kind.PENDING, chain.digest(), pickle.dumps(chain), wait)
+
+    def tombstone(self, digest, wait=True) -> int:
+        return self.append(CommitLog.Kind.TOMBSTONE, digest, wait=wait)
+
+    def append(self, kind, digest=NO_DIGEST, payload=b"", wait=True) -> int:
+        """
+        Append a record and return its sequence number; blocks until it is
+        durable with Durability.GROUP, unless <wait> is False (call sync()
+        with the returned seq later)
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError("append to a closed CommitLog")
+            seq = self.next_seq
+            self.next_seq += 1
+            self.buffer.append(encode(seq, kind, digest, payload))
+            self.__mark(kind, digest, payload)
+            if self.durability == CommitLog.Durability.OS:
+                self.__write(self.__take())
+                return seq
+
+        if self.durability == CommitLog.Durability.GROUP and wait:
+            self.sync(seq)
+        return seq
+
+    def sync(self, seq=None):
+        """
+        Block until every record up to <seq> (default: all appended) is fsynced
+        """
+        with self.lock:
+            if seq is None:
+                seq = self.next_seq - 1
+            while self.durable_seq < seq:
+                if self.syncing:
+                    self.synced.wait()
+                    continue
+                # lead this group: write everything buffered so far
+                self.syncing = True
+                batch, upto = self.__take(), self.next_seq - 1
+                self.lock.release()
+                done = False
+                try:
+                    self.__write(batch)
+                    os.fsync(self.file.fileno())
+                    done = True
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                    if done:
+                        self.durable_seq = max(self.durable_seq, upto)
+                    self.synced.notify_all()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            # appends are refused from now on
+            self.closed = True
+            self.synced.notify_all()
+        self.sync()
+        if self.flusher:
+            self.flusher.join()
+        with self.lock:
+            while self.syncing:
+                self.synced.wait()
+            self.file.close()
+
+    def __mark(self, kind, digest, payload):
+        if kind == CommitLog.Kind.COMMIT:
+            self.pending_offers.pop(digest, None)
+        elif kind == CommitLog.Kind.PENDING:
+            self.tombstones.discard(digest)
+            self.pending_offers[digest] = bytes(payload)
+        elif kind == CommitLog.Kind.TOMBSTONE:
+            self.pending_offers.pop(digest, None)
+            self.tombstones.add(digest)
+
+    def __take(self):
+        batch, self.buffer = self.buffer, []
+        return batch
+
+    def __write(self, batch):
+        # only ever called by one thread at a time (under <lock> or as the
+        # group leader), so batches reach the file in sequence order
+        if not batch:
+            return
+        if self.file.tell() >= self.segment_size:
+            self.__roll(HEADER.unpack_from(batch[0])[2])
+        self.file.write(b"".join(batch))
+        self.file.flush()
+
+    def __roll(self, first_seq):
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = open(os.path.join(self.path, segment_name(first_seq)), "ab")
+        self.__sync_directory()
+
+    def __sync_directory(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __flush_loop(self):
+        while not self.closed:
+            self.sync()
+            with self.lock:
+                if not self.buffer and not self.closed:
+                    self.synced.wait(self.sync_interval)
+    # =====================================
+
+    # =====================================
+    # reading
+    # -------------------------
+    def segments(self):
+        """
+        Segment file names, oldest first
+        """
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".log"))
+
+    def replay(self, start=1):
+        """
+        Records with seq >= <start> in order. Payloads are not unpickled.
+        """
+        segments = self.segments()
+        for i, name in enumerate(segments):
+            # skip segments that end before <start>
+            if i + 1 < len(segments) and int(segments[i + 1][:-4]) <= start:
+                continue
+            with open(os.path.join(self.path, name), "rb") as segment:
+                data = segment.read()
+            for _, record in decode(data):
+                if record.seq >= start:
+                    yield record
+
+    def recover(self) -> Recovered:
+        """
+        Rebuild state from the latest snapshot and the log after it:
+          history    committed chains in commit order
+          pending    { digest --> chain } offers neither committed nor aborted
+          tombstones digests of aborted offers
+          state      application state of the snapshot
+          seq        seq of the snapshot
+        """
+        history = []
+        pending = {}
+        tombstones = set()
+        state, seq = None, 0
+        snapshot = self.latest_snapshot()
+        if snapshot:
+            state, seq = snapshot["state"], snapshot["seq"]
+            pending = { digest: pickle.loads(payload) for digest, payload in snapshot["pending"].items() }
+            tombstones = set(snapshot["tombstones"])
+
+        for record in self.replay(seq + 1):
+            if record.kind == CommitLog.Kind.COMMIT:
+                pending.pop(record.digest, None)
+                history.append(pickle.loads(record.payload))
+            elif record.kind == CommitLog.Kind.PENDING:
+                tombstones.discard(record.digest)
+                pending[record.digest] = pickle.loads(record.payload)
+            elif record.kind == CommitLog.Kind.TOMBSTONE:
+                pending.pop(record.digest, None)
+                tombstones.add(record.digest)
+        return Recovered(history, pending, tombstones, state, seq)
+    # =====================================
+
+    # =====================================
+    # snapshots
+    # -------------------------
+    def marks(self):
+        """
+        Copy of the pending offers and tombstones, for a snapshot
+        """
+        with self.lock:
+            return dict(self.pending_offers), set(self.tombstones)
+
+    def snapshot(self, seq, digest, state, pending, tombstones):
+        """
+        Persist <state> as of the commit at <seq> of the chain with <digest>,
+        then compact the log. May run on any thread.
+        """
+        data = pickle.dumps({
+            "seq": seq,
+            "digest": digest,
+            "state": state,
+            "pending": pending,
+            "tombstones": tombstones,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # written aside and renamed so a crash never leaves a partial snapshot
+        path = os.path.join(self.path, snapshot_name(seq))
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.__sync_directory()
+        log.info("snapshot at seq %s (%s bytes)", seq, len(data))
+
+        self.compact(seq)
+
+    def snapshots(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".snap"))
+
+    def latest_snapshot(self):
+        """
+        The most recent snapshot as a dict, None if there is none
+        """
+        for name in reversed(self.snapshots()):
+            try:
+                with open(os.path.join(self.path, name), "rb") as f:
+                    return pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                log.error("skipping unreadable snapshot %s: %s", name, e)
+        return None
+
+    def compact(self, seq):
+        """
+        Delete segments and snapshots made redundant by the snapshot at <seq>
+        """
+        segments = self.segments()
+        # a segment ends right before the next one starts; keep the last
+        for name, following in zip(segments, segments[1:]):
+            if int(following[:-4]) - 1 > seq:
+                break
+            os.remove(os.path.join(self.path, name))
+            log.debug("compacted %s", name)
+
+        for name in self.snapshots():
+            if int(name[:-5]) < seq:
+                os.remove(os.path.join(self.path, name))
+
+    def __open_tail(self):
+        """
+        Open the last segment for appending, truncating a torn tail;
+        returns the last seq in the log
+        """
+        segments = self.segments()
+        if not segments:
+            self.file = open(os.path.join(self.path, segment_name(1)), "ab")
+            self.__sync_directory()
+            return 0
+
+        last_seq = int(segments[-1][:-4]) - 1
+        path = os.path.join(self.path, segments[-1])
+        with open(path, "rb") as segment:
+            data = segment.read()
+        valid = 0
+        for valid, record in decode(data):
+            last_seq = record.seq
+        if valid < len(data):
+            log.warning("truncating torn tail of %s: %s bytes", path, len(data) - valid)
+            with open(path, "r+b") as segment:
+                segment.truncate(valid)
+                os.fsync(segment.fileno())
+
+        self.file = open(path, "ab")
+        return last_seq
+    # =====================================
+
+
+def main(entries=1_000_000):
+    """
+    Benchmark appending and replaying <entries> commit records
+    """
+    from tempfile import TemporaryDirectory
+    from ruban.Offer import Chain, Action
+
+    chain = Chain(0, [Action(0, "MOVE e2 e4")])
+    digest = chain.digest()
+    payload = pickle.dumps(chain)
+
+    with TemporaryDirectory() as path:
+        commit_log = CommitLog(path, CommitLog.Durability.ASYNC)
+        start = perf_counter()
+        for _ in range(entries):
+            commit_log.append(CommitLog.Kind.COMMIT, digest, payload)
+        commit_log.close()
+        elapsed = perf_counter() - start
+        print(f"append: {entries} records in {elapsed:.2f}s ({entries / elapsed:,.0f}/s)")
+
+        commit_log = CommitLog(path)
+        start = perf_counter()
+        count = sum(1 for _ in commit_log.replay())
+        elapsed = perf_counter() - start
+        print(f"replay: {count} records in {elapsed:.2f}s ({count / elapsed:,.0f}/s)")
+        commit_log.close()
+
+if __name__ == "__main__":
+    main()
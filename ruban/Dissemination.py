@@ -0,0 +1,98 @@
+from collections import deque
+
+# Tree dissemination of the leader's broadcasts (PROPOSE, COMMIT, ABORT).
+#
+# Instead of sending to all n - 1 cohorts, the leader sends to <fanout>
+# children and every cohort relays to its own children, so the leader's
+# fan-out is O(fanout) and a message reaches everyone in O(log n) hops.
+#
+# The tree is a k-ary heap over the sorted pids of the offer's epoch, rotated
+# so that the leader is the root. Every participant derives the same tree
+# from the pid list without extra messages:
+#
+#   pids [0 1 2 3 4 5 6], leader 2, fanout 2
+#
+#                2
+#             ┌──┴──┐
+#             3     4
+#            ┌┴┐   ┌┴┐
+#            5 6   0 1
+#
+# A failed interior node cuts off its subtree until the leader's response
+# deadline resolves the round.
+#
+# With aggregation, responses travel back up the same tree: each cohort waits
+# for its own decision and an AGGREGATE from every child, merges the OKs and
+# sends one AGGREGATE to its parent, so the leader handles O(fanout) messages
+# per round instead of O(n). COUNTERs still go straight to the leader. An
+# interior node that waits too long forwards the OKs it has, and anything
+# arriving afterwards is forwarded as it comes.
+
+def _position(participants, root, pid):
+    return (participants.index(pid) - participants.index(root)) % len(participants)
+
+def children(participants, root, pid, fanout) -> list:
+    """
+    pids <pid> relays to in the tree rooted at <root>
+    """
+    participants = sorted(participants)
+    if root not in participants or pid not in participants:
+        return []
+    n = len(participants)
+    first = fanout * _position(participants, root, pid) + 1
+    offset = participants.index(root)
+    return [participants[(offset + i) % n] for i in range(first, min(first + fanout, n))]
+
+def parent(participants, root, pid, fanout):
+    """
+    pid that relays to <pid> in the tree rooted at <root>, None for the root
+    """
+    participants = sorted(participants)
+    if root not in participants or pid not in participants or pid == root:
+        return None
+    position = _position(participants, root, pid)
+    offset = participants.index(root)
+    return participants[(offset + (position - 1) // fanout) % len(participants)]
+
+
+class Aggregate:
+    """
+    A cohort's view of the OKs of its subtree for one offer
+    """
+    def __init__(self, pending):
+        self.pending = set(pending) # children and self not heard from yet
+        self.oks = {}               # { pid --> signature }
+        self.flushed = False        # sent to the parent
+        self.timer = None
+
+
+class Seen:
+    """
+    Bounded set of recently relayed messages, so that a message arriving
+    twice (e.g. trees differing across a membership change) is handled once
+    """
+    CAPACITY = 4096
+
+    def __init__(self, capacity=CAPACITY):
+        self.keys = set()
+        self.order = deque()
+        self.capacity = capacity
+
+    def add(self, key) -> bool:
+        """
+        False if <key> was already seen
+        """
+        if key in self.keys:
+            return False
+        if len(self.order) >= self.capacity:
+            self.keys.discard(self.order.popleft())
+        self.keys.add(key)
+        self.order.append(key)
+        return True
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def discard(self, key):
+        # left in <order>; popping a missing key is harmless
+        self.keys.discard(key)
@@ -0,0 +1,62 @@
+from collections import deque
+from time import monotonic
+import logging
+
+# EventLog is a structured, lazily formatted log for the protocol hot path.
+#
+# An event is a name plus the raw objects involved (messages, chains, pids).
+# Recording an event only appends a tuple to a bounded ring buffer; nothing is
+# turned into a string unless the underlying logger is enabled for DEBUG or
+# the buffer is dumped post-mortem.
+#
+# Objects are kept by reference, so a dump shows their state at dump time.
+
+class EventLog:
+    DEFAULT_CAPACITY = 1024
+
+    def __init__(self, name, capacity=DEFAULT_CAPACITY):
+        self.log = logging.getLogger(name)
+        # capacity of 0 disables the ring buffer entirely
+        self.events = deque(maxlen=capacity) if capacity else None
+
+    def __call__(self, event, *args):
+        """
+        Record <event> with its raw arguments
+        """
+        if self.events is not None:
+            self.events.append((monotonic(), event, args))
+
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(EventLog.format(event, args))
+
+    def clear(self):
+        if self.events is not None:
+            self.events.clear()
+
+    def recent(self, n=None):
+        """
+        Return the last <n> recorded events as (timestamp, event, args)
+        """
+        if self.events is None:
+            return []
+        events = list(self.events)
+        return events if n is None else events[-n:]
+
+    def dump(self, n=None, level=logging.ERROR):
+        """
+        Format the last <n> events and write them to the logger.
+        Meant for post-mortem debugging, e.g. from an except block.
+        """
+        lines = [
+            f"{timestamp:.6f} " + EventLog.format(event, args)
+            for timestamp, event, args in self.recent(n)
+        ]
+        if lines:
+            self.log.log(level, "last %d events:\n%s", len(lines), "\n".join(lines))
+        return lines
+
+    @staticmethod
+    def format(event, args):
+        if not args:
+            return event
+        return event + ": " + " ".join(str(arg) for arg in args)
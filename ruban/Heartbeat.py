@@ -0,0 +1,179 @@
+from ruban.TimerWheel import TimerWheel
+from collections import deque
+from threading import Lock
+from time import monotonic
+import math
+import logging
+
+log = logging.getLogger(__name__)
+
+# Heartbeat periodically pings every connected pid and runs a phi accrual
+# failure detector per pid on the arrival of their pings.
+#
+# phi is the confidence that a pid has failed given how long it has been
+# silent compared to its usual heartbeat interval; phi = 8 means the chance
+# of a false suspicion is about 1e-8. Any traffic from a pid counts as a sign
+# of life, but only heartbeats are sampled so that bursts of protocol messages
+# do not shrink the expected interval.
+#
+# Round trip times measured from PING/PONG are smoothed per pid (RFC 6298) and
+# exported through rto(), so offer deadlines can follow measured latency.
+
+LOG10_E = math.log10(math.e)
+
+class PhiAccrual:
+    WINDOW = 100
+
+    def __init__(self, expected_interval, window=WINDOW):
+        self.intervals = deque([expected_interval], maxlen=window)
+        self.total = expected_interval
+        self.last_heartbeat = None
+        self.last_heard = None
+
+    def heard(self, now, heartbeat=False):
+        if heartbeat:
+            if self.last_heartbeat is not None:
+                if len(self.intervals) == self.intervals.maxlen:
+                    self.total -= self.intervals[0]
+                interval = now - self.last_heartbeat
+                self.intervals.append(interval)
+                self.total += interval
+            self.last_heartbeat = now
+        self.last_heard = now
+
+    def phi(self, now):
+        if self.last_heard is None:
+            return 0.0
+        mean = self.total / len(self.intervals)
+        # exponentially distributed inter-arrival times
+        return (now - self.last_heard) / mean * LOG10_E
+
+
+class RttEstimator:
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RttEstimator.BETA) * self.rttvar + RttEstimator.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RttEstimator.ALPHA) * self.srtt + RttEstimator.ALPHA * rtt
+
+    def rto(self):
+        """
+        Retransmission timeout; None until there is a sample
+        """
+        if self.srtt is None:
+            return None
+        return self.srtt + 4 * self.rttvar
+
+
+class Heartbeat:
+    INTERVAL = 1.0   # seconds between pings
+    THRESHOLD = 8.0  # phi above which a pid is suspected
+
+    def __init__(self, pids, send_ping, on_suspect, on_recover,
+                 interval=INTERVAL, threshold=THRESHOLD, timers=None):
+        """
+        pids(): pids currently connected
+        send_ping(pid): send a PING carrying monotonic() to be echoed back
+        on_suspect(pid), on_recover(pid): failure detector transitions
+        """
+        self.pids = pids
+        self.send_ping = send_ping
+        self.on_suspect = on_suspect
+        self.on_recover = on_recover
+        self.interval = interval
+        self.threshold = threshold
+        self.timers = timers or TimerWheel.shared()
+
+        self.detectors: dict[int, PhiAccrual] = {}
+        self.rtts: dict[int, RttEstimator] = {}
+        self.suspected = set()
+        self.lock = Lock()
+        self.timer = None
+
+    def start(self):
+        if self.timer is None:
+            self.timer = self.timers.schedule(self.interval, self.__tick)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def heard(self, pid, heartbeat=False):
+        """
+        Record traffic from <pid>; heartbeat=True for PINGs
+        """
+        now = monotonic()
+        detector = self.detectors.get(pid)
+        if detector is None:
+            with self.lock:
+                detector = self.detectors.setdefault(pid, PhiAccrual(self.interval))
+        detector.heard(now, heartbeat)
+
+        if pid in self.suspected:
+            with self.lock:
+                if pid not in self.suspected:
+                    return
+                self.suspected.discard(pid)
+            log.info("pid %s recovered", pid)
+            self.on_recover(pid)
+
+    def forget(self, pid):
+        """
+        Stop tracking <pid> while it is deliberately disconnected
+        """
+        with self.lock:
+            self.detectors.pop(pid, None)
+
+    def rtt_sample(self, pid, sent):
+        """
+        PONG from <pid> echoing our monotonic() timestamp <sent>
+        """
+        with self.lock:
+            estimator = self.rtts.setdefault(pid, RttEstimator())
+        estimator.sample(monotonic() - sent)
+
+    def rto(self, pid=None):
+        """
+        Smoothed RTO for <pid>, or the largest across all pids
+        """
+        if pid is not None:
+            estimator = self.rtts.get(pid)
+            return estimator.rto() if estimator else None
+        rtos = [rto for rto in (e.rto() for e in list(self.rtts.values())) if rto is not None]
+        return max(rtos) if rtos else None
+
+    def phi(self, pid):
+        detector = self.detectors.get(pid)
+        return detector.phi(monotonic()) if detector else 0.0
+
+    def suspect(self, pid):
+        """
+        Suspect <pid> immediately, e.g. when its connection dropped
+        """
+        with self.lock:
+            if pid in self.suspected:
+                return
+            self.suspected.add(pid)
+        log.info("suspecting pid %s", pid)
+        self.on_suspect(pid)
+
+    def __tick(self):
+        now = monotonic()
+        for pid in self.pids():
+            self.send_ping(pid)
+            detector = self.detectors.get(pid)
+            if detector and detector.phi(now) > self.threshold:
+                self.suspect(pid)
+
+        if self.timer is not None:
+            self.timer = self.timers.schedule(self.interval, self.__tick)
@@ -0,0 +1,341 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import RLock
+import mmap
+import pickle
+import struct
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# HistoryStore keeps the committed history of a session on disk for random
+# access by sequence number, chain digest or owner pid.
+#
+# Chains are appended to segment files (<first seq>.hist). Once a segment
+# grows past <segment_size> it is sealed: three sidecar indexes are written
+# next to it and it is never modified again.
+#
+#   .hist  records: <payload length u32><seq u64><owner i64><digest 16B><payload>
+#   .idx   u64 offset of every record, by seq - first seq
+#
+# All integers are little-endian.
+#   .dig   (digest 16B, seq u64) sorted by digest
+#   .own   (owner i64, seq u64) sorted by owner, then seq
+#
+# Sealed segments and their indexes are read through mmap: lookups binary
+# search the mapped index and payloads are returned as memoryview slices of
+# the mapped segment, so queries neither deserialize the history nor keep it
+# on the heap. Only the segment being appended to has in-memory indexes.
+#
+# The store is derived data: it is not fsynced until a segment is sealed, so
+# it may lose its last chains in a crash. recover() appends them again from
+# the history recovered from ruban.CommitLog. A torn record at the tail of
+# the active segment is dropped on open.
+
+RECORD = struct.Struct("<IQq16s")
+OFFSET_ENTRY = struct.Struct("<Q")
+DIGEST_ENTRY = struct.Struct("<16sQ")
+OWNER_ENTRY = struct.Struct("<qQ")
+
+class SortedIndex:
+    """
+    Read-only view of a sorted sidecar index; supports bisect on its keys
+    """
+    def __init__(self, buffer, entry):
+        self.buffer = buffer
+        self.entry = entry
+
+    def __len__(self):
+        return len(self.buffer) // self.entry.size
+
+    def __getitem__(self, i):
+        # the key of entry <i>
+        return self.entry.unpack_from(self.buffer, i * self.entry.size)[0]
+
+    def value(self, i):
+        return self.entry.unpack_from(self.buffer, i * self.entry.size)[1]
+
+
+def unmap(buffer):
+    if isinstance(buffer, mmap.mmap):
+        try:
+            buffer.close()
+        except BufferError:
+            # a payload slice is still referenced; unmapped once released
+            log.warning("history segment still in use on close")
+
+
+def map_file(path):
+    """
+    Read-only mapping of <path>; an empty bytes for an empty file
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Segment:
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.data = None
+        self.offsets = None
+        self.digests = None
+        self.owners = None
+
+    def file(self, extension):
+        return f"{self.path}{extension}"
+
+    def sealed(self):
+        return all(os.path.exists(self.file(extension)) for extension in (".idx", ".dig", ".own"))
+
+    def open(self):
+        # mapped on first use
+        if self.data is None:
+            self.data = map_file(self.file(".hist"))
+            self.offsets = SortedIndex(map_file(self.file(".idx")), OFFSET_ENTRY)
+            self.digests = SortedIndex(map_file(self.file(".dig")), DIGEST_ENTRY)
+            self.owners = SortedIndex(map_file(self.file(".own")), OWNER_ENTRY)
+        return self
+
+    def last_seq(self):
+        return self.first_seq + len(self.open().offsets) - 1
+
+    def payload(self, seq) -> memoryview:
+        offset = self.open().offsets[seq - self.first_seq]
+        length = struct.unpack_from("<I", self.data, offset)[0]
+        start = offset + RECORD.size
+        return memoryview(self.data)[start:start + length]
+
+    def find(self, digest):
+        i = bisect_left(self.open().digests, digest)
+        if i < len(self.digests) and self.digests[i] == digest:
+            return self.digests.value(i)
+        return None
+
+    def by_owner(self, owner):
+        self.open()
+        start = bisect_left(self.owners, owner)
+        end = bisect_right(self.owners, owner)
+        return [self.owners.value(i) for i in range(start, end)]
+
+    def close(self):
+        if self.data is not None:
+            for buffer in (self.data, self.offsets.buffer, self.digests.buffer, self.owners.buffer):
+                unmap(buffer)
+            self.data = None
+
+
+class ActiveSegment:
+    """
+    The segment being appended to, with in-memory indexes
+    """
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.offsets = array("Q")
+        self.digests = {}  # { digest --> seq }
+        self.owners = {}   # { owner --> [ seq ] }
+        self.data = b""    # mapping, refreshed as the file grows
+
+        self.size = self.__scan()
+        self.file = open(f"{path}.hist", "ab")
+
+    def last_seq(self):
+        return self.first_seq + len(self.offsets) - 1
+
+    def append(self, seq, owner, digest, payload):
+        self.__index(seq, owner, digest, self.size)
+        record = RECORD.pack(len(payload), seq, owner, digest) + payload
+        self.file.write(record)
+        self.size += len(record)
+
+    def payload(self, seq) -> memoryview:
+        offset = self.offsets[seq - self.first_seq]
+        self.__map(offset + RECORD.size)
+        length = struct.unpack_from("<I", self.data, offset)[0]
+        start = offset + RECORD.size
+        self.__map(start + length)
+        return memoryview(self.data)[start:start + length]
+
+    def find(self, digest):
+        return self.digests.get(digest)
+
+    def by_owner(self, owner):
+        return list(self.owners.get(owner, ()))
+
+    def seal(self) -> Segment:
+        """
+        Write the sidecar indexes; the segment is read-only afterwards
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        with open(f"{self.path}.idx", "wb") as f:
+            f.writelines(OFFSET_ENTRY.pack(offset) for offset in self.offsets)
+            os.fsync(f.fileno())
+        with open(f"{self.path}.dig", "wb") as f:
+            f.writelines(DIGEST_ENTRY.pack(digest, seq) for digest, seq in sorted(self.digests.items()))
+            os.fsync(f.fileno())
+        with open(f"{self.path}.own", "wb") as f:
+            f.writelines(OWNER_ENTRY.pack(owner, seq)
+                         for owner in sorted(self.owners) for seq in self.owners[owner])
+            os.fsync(f.fileno())
+        return Segment(self.path, self.first_seq)
+
+    def close(self):
+        self.file.close()
+        unmap(self.data)
+        self.data = b""
+
+    def __map(self, end):
+        # remap once reads go past what was appended when last mapped;
+        # slices handed out keep the old mapping alive
+        if end > len(self.data):
+            self.file.flush()
+            self.data = map_file(f"{self.path}.hist")
+
+    def __index(self, seq, owner, digest, offset):
+        self.offsets.append(offset)
+        self.digests.setdefault(digest, seq)
+        self.owners.setdefault(owner, []).append(seq)
+
+    def __scan(self):
+        """
+        Rebuild the indexes of an existing file; returns its valid size
+        """
+        path = f"{self.path}.hist"
+        if not os.path.exists(path):
+            return 0
+        data = map_file(path)
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            length, seq, owner, digest = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + length
+            if end > len(data) or seq != self.first_seq + len(self.offsets):
+                break
+            self.__index(seq, owner, digest, offset)
+            offset = end
+
+        if offset < len(data):
+            log.warning("dropping torn tail of %s: %s bytes", path, len(data) - offset)
+            del data
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return offset
+
+
+class HistoryStore:
+    SEGMENT_SIZE = 64 << 20  # bytes
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = RLock()
+        os.makedirs(path, exist_ok=True)
+
+        self.sealed: list[Segment] = []
+        firsts = sorted(int(name[:-5]) for name in os.listdir(path) if name.endswith(".hist"))
+        for i, first_seq in enumerate(firsts):
+            segment = Segment(self.__segment_path(first_seq), first_seq)
+            if segment.sealed():
+                self.sealed.append(segment)
+            elif i + 1 < len(firsts):
+                # crashed while sealing
+                self.sealed.append(ActiveSegment(segment.path, first_seq).seal())
+
+        first_seq = self.sealed[-1].last_seq() + 1 if self.sealed else 1
+        self.active = ActiveSegment(self.__segment_path(first_seq), first_seq)
+        # first seq of every sealed segment, for bisect
+        self.firsts = [segment.first_seq for segment in self.sealed]
+
+    def append(self, chain) -> int:
+        """
+        Store committed <chain>; returns its sequence number
+        """
+        return self.append_encoded(chain.owner, chain.digest(), pickle.dumps(chain))
+
+    def append_encoded(self, owner, digest, payload) -> int:
+        with self.lock:
+            seq = self.active.last_seq() + 1
+            self.active.append(seq, owner, digest, payload)
+            if self.active.size >= self.segment_size:
+                self.__seal()
+            return seq
+
+    def flush(self):
+        with self.lock:
+            self.active.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.active.close()
+            for segment in self.sealed:
+                segment.close()
+
+    def recover(self, chains) -> int:
+        """
+        Append what the store lost in a crash, given <chains>: the whole
+        committed history in commit order (e.g. recovered from
+        ruban.CommitLog). Returns how many chains were appended.
+        """
+        with self.lock:
+            stored = len(self)
+            if stored > len(chains):
+                log.warning("history store is ahead of the commit log: %s > %s chains",
+                            stored, len(chains))
+                return 0
+            for chain in chains[stored:]:
+                self.append(chain)
+            return len(chains) - stored
+
+    def __len__(self):
+        return self.active.last_seq()
+
+    def payload(self, seq) -> memoryview:
+        """
+        Pickled chain <seq> as a zero-copy slice of the mapped segment.
+        Release it (or let it go) before the store is closed.
+        """
+        if not 1 <= seq <= len(self):
+            raise IndexError(seq)
+        with self.lock:
+            if seq >= self.active.first_seq:
+                # may need to map what was appended since
+                return self.active.payload(seq)
+            segment = self.sealed[bisect_right(self.firsts, seq) - 1]
+        return segment.payload(seq)
+
+    def get(self, seq):
+        return pickle.loads(self.payload(seq))
+
+    def find(self, digest):
+        """
+        seq of the first chain committed with <digest>, None if there is none
+        """
+        for segment in self.sealed + [self.active]:
+            seq = segment.find(digest)
+            if seq is not None:
+                return seq
+        return None
+
+    def by_owner(self, owner) -> list[int]:
+        """
+        seqs of the chains proposed by <owner>, in commit order
+        """
+        seqs = []
+        for segment in self.sealed + [self.active]:
+            seqs.extend(segment.by_owner(owner))
+        return seqs
+
+    def __segment_path(self, first_seq):
+        return os.path.join(self.path, f"{first_seq:020d}")
+
+    def __seal(self):
+        self.sealed.append(self.active.seal())
+        self.firsts.append(self.active.first_seq)
+        first_seq = self.active.last_seq() + 1
+        self.active = ActiveSegment(self.__segment_path(first_seq), first_seq)
@@ -0,0 +1,110 @@
+from ruban.Offer import Message
+from collections import deque
+from threading import Condition
+
+# Priority lanes for protocol messages.
+#
+# COMMIT/ABORT (and coordination such as credit or resume messages) finish
+# rounds, OK/COUNTER/AGGREGATE let the leader finish them, and PROPOSE starts
+# new ones. Under load, messages queue per lane and the highest lane with
+# anything queued is served first, so rounds in flight finish ahead of new
+# proposals:
+#
+#   CONTROL   COMMIT ABORT SUMMARY BATCH, coordination dicts
+#   RESPONSE  OK COUNTER AGGREGATE
+#   PROPOSE   PROPOSE
+#
+# Starvation protection: a lane with messages waiting that was passed over
+# <starvation_limit> times in a row is served next regardless of priority.
+#
+# Lanes are used for outbound queues (see ruban.Session) and, with a tag on
+# the wire, for the receive side of backends (see SelectorPeer). A message is
+# tagged by prefixing its encoding with "<lane>:" (see tag()/untag()).
+
+CONTROL  = 0
+RESPONSE = 1
+PROPOSE  = 2
+LANES = 3
+
+LANE_OF = {
+    Message.Type.PROPOSE: PROPOSE,
+    Message.Type.OK: RESPONSE,
+    Message.Type.COUNTER: RESPONSE,
+    Message.Type.AGGREGATE: RESPONSE,
+}
+
+def lane_of(message) -> int:
+    return LANE_OF.get(getattr(message, "type", None), CONTROL)
+
+def tag(lane, data: str) -> str:
+    return f"{lane}:{data}"
+
+def untag(data):
+    """
+    (lane, data without the tag); CONTROL for untagged data. Works on str
+    and bytes.
+    """
+    if data[1:2] in (":", b":"):
+        return int(data[:1]), data[2:]
+    return CONTROL, data
+
+
+class Lanes:
+    STARVATION_LIMIT = 16
+
+    def __init__(self, starvation_limit=STARVATION_LIMIT):
+        self.queues = [deque() for _ in range(LANES)]
+        self.passed = [0] * LANES  # times passed over while not empty
+        self.starvation_limit = starvation_limit
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, lane, item):
+        self.queues[lane].append(item)
+        self.size += 1
+
+    def pop(self):
+        """
+        Next item to serve; raises IndexError if all lanes are empty
+        """
+        lanes = [lane for lane in range(LANES) if self.queues[lane]]
+        if not lanes:
+            raise IndexError("pop from empty Lanes")
+        # the most starved lane if any, else the highest priority
+        starved = [lane for lane in lanes if self.passed[lane] >= self.starvation_limit]
+        serve = max(starved, key=self.passed.__getitem__) if starved else lanes[0]
+        for lane in lanes:
+            self.passed[lane] = 0 if lane == serve else self.passed[lane] + 1
+        self.size -= 1
+        return self.queues[serve].popleft()
+
+    def shed(self):
+        """
+        Drop and return the oldest item of the lowest priority lane
+        """
+        for lane in reversed(range(LANES)):
+            if self.queues[lane]:
+                self.size -= 1
+                return self.queues[lane].popleft()
+        raise IndexError("shed from empty Lanes")
+
+
+class Inbox:
+    """
+    Thread-safe Lanes for a receive thread; get() blocks
+    """
+    def __init__(self, starvation_limit=Lanes.STARVATION_LIMIT):
+        self.lanes = Lanes(starvation_limit)
+        self.ready = Condition()
+
+    def put(self, lane, item):
+        with self.ready:
+            self.lanes.push(lane, item)
+            self.ready.notify()
+
+    def get(self):
+        with self.ready:
+            self.ready.wait_for(lambda: len(self.lanes))
+            return self.lanes.pop()
@@ -0,0 +1,76 @@
+from time import monotonic
+import logging
+
+log = logging.getLogger(__name__)
+
+# Flood protection for PROPOSE messages.
+#
+# A PROPOSE costs its receivers an Offer, a copy of the chain and a call to
+# respond(), so a peer proposing faster than anyone can answer would starve
+# everyone else. Every pid gets a token bucket of PROPOSEs: it refills at
+# <rate> per second up to <burst>, and a PROPOSE arriving to an empty bucket
+# is dropped. Buckets are per pid, so a flooding peer only exhausts its own
+# and honest peers keep their throughput.
+#
+# Drops are not silent: the sender is told which PROPOSE was dropped and its
+# leader aborts the offer, rather than waiting on a response that will not
+# come. The Trader likewise answers the PROPOSEs it refuses with a REJECT.
+#
+# Limits are enforced on the encoded message, before it is unpickled: the
+# lane tag says whether it is a PROPOSE (see ruban.Lanes) and oversized
+# messages are dropped by length alone. Checks that need the decoded chain
+# (number of actions, offers in flight per leader) are done by the Trader.
+#
+# With a relay tree (Trader.fanout) PROPOSEs of several leaders arrive from
+# the relaying parent, whose bucket should be sized for all of them.
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.last = clock()
+
+    def take(self, n=1) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+
+class Limiter:
+    RATE = 200.0         # PROPOSEs per second per pid
+    BURST = 400
+    MAX_SIZE = 1 << 22   # characters of an encoded PROPOSE
+
+    def __init__(self, rate=RATE, burst=BURST, max_size=MAX_SIZE, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.clock = clock
+        self.buckets = {}  # { pid --> TokenBucket }
+        self.dropped = {}  # { pid --> PROPOSEs dropped }
+
+    def admit(self, pid, size) -> bool:
+        """
+        Whether a PROPOSE of <size> from <pid> is processed
+        """
+        if size > self.max_size:
+            return self.__drop(pid, "oversized PROPOSE (%s)", size)
+        bucket = self.buckets.get(pid)
+        if bucket is None:
+            bucket = self.buckets[pid] = TokenBucket(self.rate, self.burst, self.clock)
+        if not bucket.take():
+            return self.__drop(pid, "PROPOSE rate exceeded")
+        return True
+
+    def __drop(self, pid, reason, *args):
+        self.dropped[pid] = self.dropped.get(pid, 0) + 1
+        if self.dropped[pid] == 1:
+            # once per pid; floods would flood the log too
+            log.warning("pid %s: dropping " + reason, pid, *args)
+        return False
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from queue import Queue
+from threading import Thread, RLock, Condition
+from ruban.Sync import rolling, DIGEST_SIZE
+import logging
+
+log = logging.getLogger(__name__)
+
+MISSING = object()
+
+# Materializer keeps the game state up to date as chains commit, so that
+# applications read the current state instead of re-scanning the history.
+#
+# The application provides a Reducer that applies one Action to a state.
+# Committed chains are applied incrementally on top of the previous state.
+#
+# States are memoized by (committed head, chain digest), where the head is
+# the rolling digest of the committed history (see ruban.Sync). Evaluating a
+# proposed chain speculatively therefore reuses the committed base, and its
+# result is picked up as is if the chain commits next. A counter only appends
+# actions to the chain it counters, so it is evaluated from that chain's
+# memoized state by applying just the appended actions.
+#
+# Memoized states are shared: Reducer.apply must return a new state and never
+# modify the one it is given.
+#
+# A Speculator evaluates chains received by a cohort on a background thread
+# while the leader collects responses. When the COMMIT arrives the state is
+# already memoized (or being computed, in which case the commit waits for it
+# rather than starting over) and is installed as the committed state under
+# the lock, in one step. Neither commits nor speculation hold the lock while
+# reducing.
+#
+# Every commit moves the head, so pending chains are evaluated again against
+# it; a chain still queued is evaluated against the head current when the
+# worker gets to it and is not queued twice.
+
+class Reducer(ABC):
+    @abstractmethod
+    def initial(self):
+        """
+        State before any chain is committed
+        """
+        pass
+
+    @abstractmethod
+    def apply(self, state, action):
+        """
+        State after <action>; must not modify <state>
+        """
+        pass
+
+    def reduce(self, state, actions):
+        for action in actions:
+            state = self.apply(state, action)
+        return state
+
+
+class Materializer:
+    CAPACITY = 1024  # memoized states
+
+    def __init__(self, reducer: Reducer, state=None, capacity=CAPACITY):
+        self.reducer = reducer
+        self.state = reducer.initial() if state is None else state
+        self.head = bytes(DIGEST_SIZE)
+        self.capacity = capacity
+        self.lock = RLock()
+        self.cache = OrderedDict()  # { (head, chain digest) --> state }
+        self.inflight = set()       # keys being reduced
+        self.reduced = Condition(self.lock)
+        self.stats = { "hits": 0, "misses": 0 }
+
+    def commit(self, chain):
+        """
+        Apply committed <chain>; returns the new state
+        """
+        while True:
+            head, state = self.__evaluate(chain)
+            with self.lock:
+                if self.head != head:
+                    # committed over while reducing; evaluate again on top
+                    continue
+                self.state = state
+                self.head = rolling(self.head, chain.digest())
+                return state
+
+    def extend(self, chains):
+        for chain in chains:
+            self.commit(chain)
+
+    def evaluate(self, chain, base=None):
+        """
+        State if <chain> committed next, without committing it. <base> is a
+        chain whose actions <chain> extends (the offer a counter counters);
+        its memoized state is reused if there is one.
+        """
+        return self.__evaluate(chain, base)[1]
+
+    def __evaluate(self, chain, base=None):
+        """
+        (head, state of <chain> on top of head)
+        """
+        with self.lock:
+            while True:
+                head = self.head
+                key = (head, chain.digest())
+                if key not in self.inflight:
+                    break
+                # someone else is reducing it
+                self.reduced.wait()
+            state = self.__lookup(key)
+            if state is not MISSING:
+                return head, state
+
+            start, state = 0, self.state
+            if base is not None and chain.actions[:len(base.actions)] == base.actions:
+                base_state = self.__lookup((head, base.digest()))
+                if base_state is not MISSING:
+                    start, state = len(base.actions), base_state
+            self.inflight.add(key)
+
+        # reducing may be slow; the lock is not held meanwhile
+        reduced = False
+        try:
+            state = self.reducer.reduce(state, chain.actions[start:])
+            reduced = True
+        finally:
+            with self.lock:
+                self.inflight.discard(key)
+                if reduced and self.head == head:
+                    self.__remember(key, state)
+                self.reduced.notify_all()
+        return head, state
+
+    def discard(self, chain):
+        """
+        Forget the speculative state of <chain> (aborted or superseded)
+        """
+        with self.lock:
+            self.cache.pop((self.head, chain.digest()), None)
+
+    def __lookup(self, key):
+        state = self.cache.get(key, MISSING)
+        if state is MISSING:
+            self.stats["misses"] += 1
+            return MISSING
+        self.stats["hits"] += 1
+        self.cache.move_to_end(key)
+        return state
+
+    def __remember(self, key, state):
+        self.cache[key] = state
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+
+class Speculator:
+    """
+    Evaluates chains on a background thread ahead of their COMMIT
+    """
+    def __init__(self, materializer: Materializer):
+        self.materializer = materializer
+        self.queue = Queue()
+        self.lock = RLock()
+        self.queued = set()  # digests submitted and not discarded
+        self.worker = Thread(target=self.__run, daemon=True)
+        self.worker.start()
+
+    def submit(self, chain, base=None):
+        with self.lock:
+            if chain.digest() in self.queued:
+                # not evaluated yet; it will be against the current head
+                return
+            self.queued.add(chain.digest())
+        self.queue.put((chain, base))
+
+    def discard(self, chain):
+        """
+        <chain> will not commit (aborted or superseded)
+        """
+        with self.lock:
+            self.queued.discard(chain.digest())
+        self.materializer.discard(chain)
+
+    def stop(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def __run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            chain, base = task
+            with self.lock:
+                if chain.digest() not in self.queued:
+                    continue
+                self.queued.discard(chain.digest())
+            try:
+                self.materializer.evaluate(chain, base)
+            except Exception as e:
+                # the commit evaluates it again and surfaces the error
+                log.error("speculative evaluation failed: %s", e)
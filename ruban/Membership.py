@@ -0,0 +1,58 @@
+from ruban.Offer import Chain, Action
+
+# Membership changes are chains committed through the Ruban offer mechanism,
+# so every participant consents to a join or leave the same way it consents
+# to any other chain. They are MembershipChains, a type of their own:
+# application chains are never taken for membership changes, whatever their
+# content. Their actions read:
+#
+#   "ruban/membership join <pid> <conn_info>"
+#   "ruban/membership leave <pid>"
+#
+# The proposer picks the pid for a join (the next free one in its view).
+# Cohorts only accept it if it is still the next free pid for them, so two
+# concurrent joins cannot both claim the same pid. A pid may only propose its
+# own leave, or the leave of a pid the cohort suspects as well.
+
+PREFIX = "ruban/membership "
+JOIN = "join"
+LEAVE = "leave"
+
+class MembershipChain(Chain):
+    def __hash__(self) -> int:
+        # never equal to an application chain with the same actions
+        return hash((MembershipChain, self.owner, tuple(self.actions)))
+
+def join_chain(owner, pid, conn_info) -> MembershipChain:
+    return MembershipChain(owner, [Action(owner, f"{PREFIX}{JOIN} {pid} {conn_info}")])
+
+def leave_chain(owner, pid) -> MembershipChain:
+    return MembershipChain(owner, [Action(owner, f"{PREFIX}{LEAVE} {pid}")])
+
+def is_membership(chain) -> bool:
+    return isinstance(chain, MembershipChain)
+
+def parse(chain):
+    """
+    List of (JOIN, pid, conn_info) and (LEAVE, pid, None) changes in
+    membership <chain>; raises ValueError if it is malformed
+    """
+    if not is_membership(chain) or not chain.actions:
+        raise ValueError("not a membership chain")
+
+    changes = []
+    for action in chain.actions:
+        content = str(action.content)
+        if not content.startswith(PREFIX):
+            raise ValueError(f"malformed membership change {content!r}")
+        op, *args = content[len(PREFIX):].split(" ")
+        if op == JOIN and len(args) == 2:
+            change = (JOIN, args[0], args[1])
+        elif op == LEAVE and len(args) == 1:
+            change = (LEAVE, args[0], None)
+        else:
+            raise ValueError(f"malformed membership change {content!r}")
+        if not change[1].isdigit():
+            raise ValueError(f"malformed pid in {content!r}")
+        changes.append((change[0], int(change[1]), change[2]))
+    return changes
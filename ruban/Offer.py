@@ -1,8 +1,8 @@
 from enum import Enum
 from copy import deepcopy
+from hashlib import blake2b
 import logging
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 class Message:
@@ -11,12 +11,22 @@ class Message:
         OK = 2
         COUNTER = 3
         COMMIT = 4
+        ABORT = 5
+        AGGREGATE = 6  # OKs of a subtree, signed holds { pid --> signature }
+        SUMMARY = 7    # committed history, signed holds [(length, rolling digest)]
+        BATCH = 8      # committed chains, signed holds (first seq, [chain], done)
+        REJECT = 9     # cohort refuses the offer; the leader aborts the round
     
-    def __init__(self, sender, type, chain, signature = None):
+    def __init__(self, sender, type, chain, signature = None, epoch = 0, round = None):
         self.sender = sender
         self.type: Message.Type = type
         self.chain: Chain = chain
         self.signed = signature
+        # membership epoch of the offer; see ruban.Dissemination
+        self.epoch = epoch
+        # id the leader gave the offer when proposing it; the same chain may
+        # be proposed again in a new round
+        self.round = round
     
     def sign(self, key):
         #TODO: actually make this signature instead of just key
@@ -26,11 +36,12 @@ class Message:
         return Message(sender, Message.Type.OK, self.chain, signature)
     
     def __str__(self):
-        string = f"Message by {self.sender}\n"
-        string += f"type: {self.type.name}\n"
-        string += str(self.chain)
-        string += str(self.signed)
-        return string 
+        return "".join((
+            f"Message by {self.sender}\n",
+            f"type: {self.type.name}\n",
+            str(self.chain),
+            str(self.signed),
+        ))
 
 class Offer:
     class State(Enum):
@@ -46,6 +57,7 @@ class Offer:
         OKED      = 7  # cohort OKed new offer; await leader
         COUNTERED = 8  # cohort countered offer; await leader
                        # old offer: ABORTED;
+        REJECTED  = 9  # cohort refused offer; await leader's ABORT
         # common
         COMMITTED = 10 # end result; both leader and cohort agree
         ABORTED   = 11 # end result; both leader and cohort agree
@@ -55,6 +67,13 @@ class Offer:
         self.state = Offer.State.INITIAL
         self.prev = None
         self.counters = {}
+        # membership epoch and round proposed in; response deadline timer
+        # and pids that missed it (leader), or expiry timer (cohort, see
+        # OFFER_TTL)
+        self.epoch = 0
+        self.round = None
+        self.deadline = None
+        self.missing = []
 
     def state(self):
         return self.state
@@ -108,6 +127,11 @@ class Offer:
         self.add_ok(own_pid, signature)
         return self
 
+    def reject(self):
+        assert self.state == Offer.State.RECEIVED
+        self.state = Offer.State.REJECTED
+        return self
+
     def make_counter(self, pid, counter):
         assert self.state == Offer.State.RECEIVED
         assert self.chain.is_counter(counter)
@@ -119,7 +143,7 @@ class Offer:
         return self
     
     def committed(self):
-        self.state == Offer.State.COMMITTED
+        self.state = Offer.State.COMMITTED
         return self
     
     def add_ok(self, pid, signature):
@@ -146,9 +170,13 @@ class Offer:
             m_type = Message.Type.OK
         elif self.state == Offer.State.COUNTERED:
             m_type = Message.Type.COUNTER
-            chain = self.counters[own_pid]
-        elif self.state == Offer.State.COMITTING:
+            chain = self.counters[own_pid].chain
+        elif self.state == Offer.State.REJECTED:
+            m_type = Message.Type.REJECT
+        elif self.state in (Offer.State.COMITTING, Offer.State.COMMITTED):
             m_type = Message.Type.COMMIT
+        elif self.state == Offer.State.ABORTED:
+            m_type = Message.Type.ABORT
         else:
             return None
 
@@ -156,24 +184,27 @@ class Offer:
             sender=own_pid,
             type=m_type,
             chain=chain,
+            epoch=self.epoch,
+            round=self.round,
         )
     
     def __hash__(self):
         return hash(self.chain)
     
     def __str__(self):
-        string = "\n======OFFER======\n"
-        string += f"state: {self.state.name}\n"
-        string += str(self.chain) + "\n"
-        string += "counters:\n"
+        lines = [
+            "\n======OFFER======",
+            f"state: {self.state.name}",
+            f"{self.chain}",
+            "counters:",
+        ]
         if not self.counters:
-            string += "None\n"
+            lines.append("None")
         else:
-            string += "\n"
-            for pid, counter in self.counters.items():
-                string += str(pid) + ":" + str(counter)  + "\n"
-        string += "=================\n"
-        return string
+            lines.append("")
+            lines.extend(f"{pid}:{counter}" for pid, counter in self.counters.items())
+        lines.append("=================\n")
+        return "\n".join(lines)
 
 
 class Chain:
@@ -207,28 +238,30 @@ class Chain:
     
     def __hash__(self) -> int:
         return hash((self.owner, tuple(self.actions)))
+
+    def digest(self) -> bytes:
+        """
+        16 byte digest of owner and actions that, unlike hash(), is stable
+        across processes; identifies the chain on disk (see ruban.CommitLog)
+        """
+        h = blake2b(repr(self.owner).encode(), digest_size=16)
+        for action in self.actions:
+            h.update(repr((action.owner, action.content)).encode())
+        return h.digest()
     
     def __str__(self):
-        string = f"----{hex(hash(self))}-----\n"
-        string += "owner: " + str(self.owner) + "\n"
-        string += "OKs:\n" + str(self.OKs) + "\n"
-        string += f"prev: {'None' if not self.prev else hex(self.prev)}\n"
-        string += "ACTIONS:\n"
-        for i, action in enumerate(self.actions):
-            string += f"\t{i}: " + str(action) + "\n"
-        string += "-------------\n"
-        return string
+        lines = [
+            f"----{hex(hash(self))}-----",
+            f"owner: {self.owner}",
+            f"OKs:\n{self.OKs}",
+            f"prev: {'None' if not self.prev else hex(self.prev)}",
+            "ACTIONS:",
+        ]
+        lines.extend(f"\t{i}: {action}" for i, action in enumerate(self.actions))
+        lines.append("-------------\n")
+        return "\n".join(lines)
 
-    def __repr__(self) -> str:
-        string = f"----{hex(hash(self))}-----\n"
-        string += "owner: " + str(self.owner) + "\n"
-        string += "OKs:\n" + str(self.OKs) + "\n"
-        string += f"prev: {'None' if not self.prev else hex(self.prev)}\n"
-        string += "ACTIONS:\n"
-        for i, action in enumerate(self.actions):
-            string += f"\t{i}: " + str(action) + "\n"
-        string += "-------------\n"
-        return string
+    __repr__ = __str__
 
 
 # action can be nested using hashes
@@ -243,6 +276,18 @@ class Action:
     
     def __hash__(self):
         return hash((self.owner, self.content))
+
+    def __eq__(self, other):
+        # by value, so that actions survive copies (see Chain.is_counter)
+        if not isinstance(other, Action):
+            return NotImplemented
+        return (self.owner, self.content) == (other.owner, other.content)
+
+    def digest(self) -> bytes:
+        """
+        16 byte digest of owner and content, stable across processes
+        """
+        return blake2b(repr((self.owner, self.content)).encode(), digest_size=16).digest()
     
     def __str__(self) -> str:
         return f"ACTION by {self.owner}: {self.content}"
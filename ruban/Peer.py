@@ -1,9 +1,14 @@
 from ruban.deCoordinated import deCoordinated
+from ruban.CommitLog import CommitLog
+from ruban.HistoryStore import HistoryStore
+from ruban.Snapshot import Snapshotter
+from ruban.Materializer import Materializer, Speculator
 from ruban.Offer import Chain, Offer
+from ruban import Sync
 from p2pnetwork.node import Node, NodeConnection
+import os
 import logging
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 # sample ports map to use for connection
@@ -28,7 +33,7 @@ class Peer(Node, deCoordinated):
     ADDRESS = "127.0.0.1"
     HOST_PORT = 33330
 
-    def __init__(self, pid):
+    def __init__(self, pid, log_dir=None, reducer=None, policies=None):
         port = ports_map[pid]
         is_host = pid == 0
 
@@ -38,6 +43,28 @@ class Peer(Node, deCoordinated):
 
         deCoordinated.__init__(self, is_host)
 
+        if log_dir:
+            # pick up the game where it was left before a restart
+            self.commit_log = CommitLog(os.path.join(log_dir, str(pid)))
+            recovered = self.commit_log.recover()
+            game.extend(recovered.state or ())
+            game.extend(recovered.history)
+            # indexed history; may have lost its tail in a crash
+            self.history = HistoryStore(os.path.join(log_dir, f"{pid}.history"))
+            self.history.recover(game)
+            # serves catch-up from the history store instead of the heap
+            self.ledger = Sync.Ledger(game, history=self.history)
+            self.snapshots = Snapshotter(self.commit_log, lambda: tuple(game))
+
+        # decides mechanical offers without prompting; see ruban.Policy
+        self.policies = policies
+
+        if reducer:
+            # current state of the game, kept up to date as chains commit
+            self.materializer = Materializer(reducer)
+            self.materializer.extend(game)
+            self.speculator = Speculator(self.materializer)
+
         self.setup(f"{Peer.ADDRESS}:{Peer.HOST_PORT}")
 
     def register_callback(self, callback):
@@ -51,10 +78,10 @@ class Peer(Node, deCoordinated):
         self.on_new_connection_callback(connected_node)
 
     def inbound_node_disconnected(self, connected_node):
-        pass
+        self.connection_lost(connected_node)
 
     def outbound_node_disconnected(self, connected_node):
-        pass
+        self.connection_lost(connected_node)
 
     def node_message(self, connected_node, data):
         # call Coordinated's on_receive
@@ -66,6 +93,11 @@ class Peer(Node, deCoordinated):
     def node_request_to_stop(self):
         pass
 
+    def stop(self):
+        if self.speculator is not None:
+            self.speculator.stop()
+        super().stop()
+
     def __get_connection__(self, conn_info):
         l = conn_info.split(":")
         return (l[0], int(l[1]))
@@ -96,6 +128,9 @@ class Peer(Node, deCoordinated):
 
     def send(self, recipient, message):
         self.send_to_node(recipient, message)
+
+    def disconnect(self, connection):
+        self.disconnect_with_node(connection)
     
     def committed(self, chain):
         game.append(chain)
@@ -117,7 +152,7 @@ class Peer(Node, deCoordinated):
                 self.reject(offer)
         elif offer.state == Offer.State.DECIDING:
             print("got counters:\n")
-            for pid, coffer in offer.counters.items:
+            for pid, coffer in offer.counters.items():
                 print(pid)
                 print(coffer)
 
@@ -0,0 +1,148 @@
+from collections import namedtuple
+from enum import Enum
+from time import perf_counter_ns
+from ruban.Offer import Offer
+import logging
+
+log = logging.getLogger(__name__)
+
+# Automatic responses to offers, so that mechanical decisions do not wait on
+# the application's respond() (e.g. a human at a prompt).
+#
+# A PolicyEngine holds an ordered list of policies. For every offer that
+# needs a response (a cohort's RECEIVED offer, or a leader DECIDING between
+# counters) the policies are asked in order; the first one that returns a
+# Verdict decides:
+#
+#   ACCEPT   OK the offer, or for a leader accept counter <counter> (a pid);
+#            deferred if the leader holds no counter from <counter>
+#   REJECT   reject the offer
+#   COUNTER  counter with the offer's actions followed by <suffix>
+#   DEFER    hand the offer to respond()
+#
+# Policies that do not apply return None. If none applies, the offer is
+# deferred. The time every policy takes is recorded, see metrics().
+
+class Decision(Enum):
+    ACCEPT  = 0
+    REJECT  = 1
+    COUNTER = 2
+    DEFER   = 3
+
+Verdict = namedtuple("Verdict", "decision suffix counter", defaults=((), None))
+
+
+class Policy:
+    """
+    Named decision rule; <decide> takes an Offer and returns a Verdict, or
+    None if the policy does not apply to it
+    """
+    def __init__(self, name, decide=None):
+        self.name = name
+        if decide is not None:
+            self.decide = decide
+
+    def decide(self, offer):
+        return None
+
+
+class AutoAccept(Policy):
+    """
+    Accept offers whose chain satisfies <when>; as a leader, accept the
+    counter of the lowest pid that does
+    """
+    def __init__(self, when=lambda chain: True, name="auto-accept"):
+        super().__init__(name)
+        self.when = when
+
+    def decide(self, offer):
+        if offer.state == Offer.State.RECEIVED:
+            return Verdict(Decision.ACCEPT) if self.when(offer.chain) else None
+        for pid in sorted(offer.counters):
+            if self.when(offer.counters[pid].chain):
+                return Verdict(Decision.ACCEPT, counter=pid)
+        return None
+
+
+class AutoCounter(Policy):
+    """
+    Counter received offers with the actions <suffix> generates for them;
+    <suffix> returns None when it has nothing to add
+    """
+    def __init__(self, suffix, name="auto-counter"):
+        super().__init__(name)
+        self.suffix = suffix
+
+    def decide(self, offer):
+        if offer.state != Offer.State.RECEIVED:
+            return None
+        suffix = self.suffix(offer)
+        return Verdict(Decision.COUNTER, suffix=suffix) if suffix else None
+
+
+class AutoReject(Policy):
+    def __init__(self, when, name="auto-reject"):
+        super().__init__(name)
+        self.when = when
+
+    def decide(self, offer):
+        return Verdict(Decision.REJECT) if self.when(offer.chain) else None
+
+
+class Defer(Policy):
+    """
+    Leave offers whose chain satisfies <when> to respond()
+    """
+    def __init__(self, when=lambda chain: True, name="defer"):
+        super().__init__(name)
+        self.when = when
+
+    def decide(self, offer):
+        return Verdict(Decision.DEFER) if self.when(offer.chain) else None
+
+
+class PolicyEngine:
+    DEFERRED = Verdict(Decision.DEFER)
+
+    def __init__(self, policies):
+        self.policies = list(policies)
+        names = [policy.name for policy in self.policies]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            # their metrics would be merged; pass name= to tell them apart
+            raise ValueError(f"duplicate policy names: {', '.join(duplicates)}")
+        # { policy name --> [evaluated, decided, total ns, max ns] }
+        self.stats = { policy.name: [0, 0, 0, 0] for policy in self.policies }
+
+    def decide(self, offer):
+        """
+        (name of the deciding policy, Verdict); (None, DEFERRED) if no
+        policy applies
+        """
+        for policy in self.policies:
+            start = perf_counter_ns()
+            verdict = policy.decide(offer)
+            elapsed = perf_counter_ns() - start
+
+            stats = self.stats[policy.name]
+            stats[0] += 1
+            stats[2] += elapsed
+            stats[3] = max(stats[3], elapsed)
+            if verdict is not None:
+                stats[1] += 1
+                return policy.name, verdict
+        return None, PolicyEngine.DEFERRED
+
+    def metrics(self):
+        """
+        { policy name --> { evaluated, decided, mean_us, max_us } }
+        """
+        return {
+            name: {
+                "evaluated": evaluated,
+                "decided": decided,
+                "mean_us": total / evaluated / 1000 if evaluated else 0.0,
+                "max_us": longest / 1000,
+            }
+            for name, (evaluated, decided, total, longest) in self.stats.items()
+        }
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+# Declarative validation of Action.content.
+#
+# A Rule is a regular expression the whole content must match, plus
+# constraints on its named groups and, optionally, on the action's owner:
+#
+#   RuleSet([
+#       Rule(r"MOVE (?P<square>\d+)", square=range(9)),
+#       Rule(r"SAY (?P<text>.+)", owners={0, 1}, text=lambda text: len(text) < 80),
+#       Rule(r"PASS"),
+#   ])
+#
+# A constraint is either a container the group value must be in, or a
+# callable taking the value and returning True if it is legal. Group values
+# are strings; for containers of ints (e.g. a range) they are converted to int
+# first.
+#
+# Rules are compiled once into predicates, and indexed by their leading
+# keyword (MOVE, SAY, PASS above) so that an action is only matched against
+# the rules that can apply to it. Results are cached by action digest.
+#
+# Validating a chain records it as valid; a counter of a valid chain only
+# appends actions (see Chain.is_counter), so only the appended suffix is
+# checked.
+
+KEYWORD = re.compile(r"(\w+)(?=\s|$)")
+
+class Rule:
+    def __init__(self, pattern, owners=None, **fields):
+        self.pattern = pattern
+        self.owners = owners
+        self.fields = fields
+
+    def keyword(self):
+        """
+        Literal first word every matching content starts with, None if there
+        is no such word
+        """
+        if "|" in self.pattern:
+            # alternatives may start differently
+            return None
+        match = KEYWORD.match(self.pattern)
+        return match[1] if match else None
+
+    def compile(self):
+        """
+        Predicate taking an Action, True if the rule allows it
+        """
+        regex = re.compile(self.pattern)
+        owners = frozenset(self.owners) if self.owners is not None else None
+        checks = []
+        for name, constraint in self.fields.items():
+            if name not in regex.groupindex:
+                raise ValueError(f"rule {self.pattern!r} has no group {name!r}")
+            if callable(constraint):
+                checks.append((name, str, constraint))
+            else:
+                ints = isinstance(constraint, range) or all(isinstance(v, int) for v in constraint)
+                checks.append((name, int if ints else str, constraint.__contains__))
+
+        def predicate(action):
+            if owners is not None and action.owner not in owners:
+                return False
+            match = regex.fullmatch(action.content)
+            if match is None:
+                return False
+            for name, convert, check in checks:
+                try:
+                    value = convert(match[name])
+                except ValueError:
+                    return False
+                if not check(value):
+                    return False
+            return True
+
+        return predicate
+
+
+class RuleSet:
+    CAPACITY = 1 << 16  # cached actions, and chains known valid
+
+    def __init__(self, rules, capacity=CAPACITY):
+        self.capacity = capacity
+        self.by_keyword = {}  # { keyword --> [predicate] }
+        self.anywhere = []    # predicates of rules without a keyword
+        for rule in rules:
+            keyword = rule.keyword()
+            if keyword is None:
+                self.anywhere.append(rule.compile())
+            else:
+                self.by_keyword.setdefault(keyword, []).append(rule.compile())
+
+        self.actions = OrderedDict()  # { action digest --> allowed }
+        self.chains = OrderedDict()   # { chain digest --> None } of valid chains
+        self.stats = { "hits": 0, "misses": 0 }
+
+    def allows(self, action) -> bool:
+        digest = action.digest()
+        allowed = self.actions.get(digest)
+        if allowed is not None:
+            self.stats["hits"] += 1
+            return allowed
+
+        self.stats["misses"] += 1
+        keyword = action.content.split(None, 1)[0] if action.content.strip() else ""
+        candidates = self.by_keyword.get(keyword, [])
+        allowed = any(predicate(action) for predicate in candidates) or \
+                  any(predicate(action) for predicate in self.anywhere)
+        self.__remember(self.actions, digest, allowed)
+        return allowed
+
+    def first_invalid(self, chain, base=None):
+        """
+        Index of the first action of <chain> no rule allows, None if all are
+        allowed. If <chain> extends <base> and <base> was found valid, only
+        the actions appended to it are checked.
+        """
+        start = 0
+        if (base is not None and base.digest() in self.chains and
+                chain.actions[:len(base.actions)] == base.actions):
+            start = len(base.actions)
+
+        for i in range(start, len(chain.actions)):
+            if not self.allows(chain.actions[i]):
+                return i
+        self.__remember(self.chains, chain.digest(), None)
+        return None
+
+    def validate(self, chain, base=None) -> bool:
+        return self.first_invalid(chain, base) is None
+
+    def __remember(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.capacity:
+            cache.popitem(last=False)
@@ -0,0 +1,384 @@
+from ruban.deCoordinated import deCoordinated
+from ruban import Lanes
+from ruban.Limits import Limiter
+from collections import deque
+from itertools import islice
+from threading import Thread
+from time import monotonic
+import selectors
+import socket
+import struct
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# SelectorPeer is a deCoordinated backend that multiplexes every connection
+# of a peer on a single I/O thread using selectors (epoll/kqueue if available)
+#
+#   ┌───────────┐ frames  ┌────────────┐ on_receive ┌───────────────┐
+#   │ I/O thread├────────►│ dispatcher ├───────────►│ deCoordinated │
+#   └─────▲─────┘         └────────────┘            └───────┬───────┘
+#         │             send(): append to write buffer      │
+#         └─────────────────────────────────────────────────┘
+#
+# Sockets are non-blocking. Each connection has its own write buffer which is
+# drained with a single sendmsg() (writev) per writable event, so frames
+# queued back to back go out in one syscall.
+#
+# Write coalescing: a connection with pending frames is flushed once per I/O
+# tick, or after <flush_deadline> seconds if one is configured. A burst such
+# as a COMMIT fan-out or several OKs to the same leader is therefore written
+# with one sendmsg() per connection and one wakeup of the I/O thread.
+# Since batching is done here, Nagle's algorithm is disabled (TCP_NODELAY).
+#
+# Received messages are handed to a dispatcher thread so that deCoordinated
+# and Trader callbacks (which may block, e.g. on input()) never stall I/O.
+# The dispatcher serves them by the priority lane they are tagged with (see
+# ruban.Lanes), so COMMITs and OKs waiting behind a burst of PROPOSEs are
+# handled first.
+#
+# wire format: <4 byte big-endian length><payload>
+# the first frame on every connection is the dialer's "host:port" so that the
+# accepting side can identify it by its listening address (see get_conn_info)
+#
+# A connection that declares a frame longer than MAX_FRAME, or whose
+# handshake is malformed, is closed before anything is buffered or dispatched.
+
+FRAME_HEADER = struct.Struct("!I")
+RECV_SIZE = 1 << 16
+# largest frame accepted; a BATCH of chains may exceed a single PROPOSE
+MAX_FRAME = 4 * Limiter.MAX_SIZE
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+def frame(payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+class Connection:
+    """
+    A non-blocking TCP connection owned by a SelectorPeer's I/O thread
+    """
+    def __init__(self, sock, host=None, port=None):
+        self.sock = sock
+        # listening address of the remote peer; port is None until handshake
+        self.host = host
+        self.port = port
+        self.inbuf = bytearray()
+        self.outbuf = deque()     # frames (or unsent tail of a frame) to write
+        self.scheduled = False    # flush already queued on the I/O thread
+        self.writing = False      # registered for EVENT_WRITE
+        self.closed = False
+        self.reported = False     # loss reported to deCoordinated
+
+    def handshaken(self):
+        return self.port is not None
+
+    def __str__(self):
+        return f"Connection {self.host}:{self.port}"
+
+    __repr__ = __str__
+
+
+class SelectorPeer(deCoordinated):
+    def __init__(self, host, port, is_host, flush_deadline=0.0, lazy=False, fanout=None,
+                 aggregate=False):
+        self.host = host
+        # seconds to hold queued frames before writing; 0 flushes every tick
+        self.flush_deadline = flush_deadline
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.server.setblocking(False)
+        # port 0 binds to any free port
+        self.port = self.server.getsockname()[1]
+
+        self.selector = selectors.DefaultSelector()
+        self.waker, self.wakee = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakee.setblocking(False)
+        self.selector.register(self.wakee, selectors.EVENT_READ)
+
+        # callables to run on the I/O thread
+        self.commands = deque()
+        self.woken = False
+        # (deadline, connection) in deadline order
+        self.flush_due = deque()
+        self.stats = { "frames": 0, "sendmsg": 0, "wakeups": 0 }
+        self.inbox = Lanes.Inbox()
+        self.connections_all = set()
+
+        self.running = False
+        self.stopped = False
+        self.io_thread = Thread(target=self.__io_loop, daemon=True)
+        self.dispatch_thread = Thread(target=self.__dispatch_loop, daemon=True)
+
+        deCoordinated.__init__(self, is_host, lazy, fanout, aggregate)
+
+    def __start(self):
+        if not self.running and not self.stopped:
+            self.running = True
+            self.io_thread.start()
+            self.dispatch_thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.stop_timers()
+        self.stopped = True
+        self.running = False
+        self.__wake()
+        self.io_thread.join()
+        self.inbox.put(Lanes.CONTROL, None)
+        self.dispatch_thread.join()
+
+# These functions are implemented for deCoordinated
+    def get_conn_info(self, connection):
+        return f"{connection.host}:{connection.port}"
+
+    def listen_for_connections(self, callback):
+        self.on_new_connection_callback = callback
+        self.__call_soon(lambda: self.selector.register(self.server, selectors.EVENT_READ))
+        self.__start()
+
+    def stop_listening_for_connections(self):
+        self.__call_soon(lambda: self.selector.unregister(self.server))
+
+    def connect(self, peer) -> Connection:
+        if self.stopped:
+            return None
+        host, port = peer.split(":")
+        port = int(port)
+        try:
+            sock = socket.create_connection((host, port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(frame(self.get_conn_info(self).encode()))
+        except OSError as e:
+            log.debug("could not connect to %s: %s", peer, e)
+            return None
+
+        sock.setblocking(False)
+        connection = Connection(sock, host, port)
+        self.__call_soon(lambda: self.__register(connection))
+        self.__start()
+        return connection
+
+    def disconnect(self, connection):
+        self.__call_soon(lambda: self.__close(connection))
+
+    def send(self, recipient, message):
+        if recipient.closed:
+            log.debug("sending on closed connection %s", recipient)
+            # closed before it was bound to a pid; report it now
+            if not recipient.reported and self.running:
+                recipient.reported = True
+                self.inbox.put(Lanes.CONTROL, (recipient, None))
+            return
+        recipient.outbuf.append(frame(message.encode()))
+        self.stats["frames"] += 1
+        self.__schedule_flush(recipient)
+
+    # =====================================
+    # I/O thread
+    # -------------------------
+    def __call_soon(self, command):
+        self.commands.append(command)
+        self.__wake()
+
+    def __wake(self):
+        # one wakeup covers every command queued before the I/O thread runs
+        if self.woken:
+            return
+        self.woken = True
+        self.stats["wakeups"] += 1
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            pass # already has a pending wakeup
+
+    def __schedule_flush(self, connection):
+        if connection.scheduled:
+            return
+        connection.scheduled = True
+        if self.flush_deadline:
+            deadline = monotonic() + self.flush_deadline
+            self.__call_soon(lambda: self.flush_due.append((deadline, connection)))
+        else:
+            self.__call_soon(lambda: self.__flush(connection))
+
+    def __flush_due(self):
+        now = monotonic()
+        while self.flush_due and self.flush_due[0][0] <= now:
+            _, connection = self.flush_due.popleft()
+            if not connection.closed:
+                self.__flush(connection)
+
+    def __select_timeout(self):
+        if not self.flush_due:
+            return None
+        return max(0, self.flush_due[0][0] - monotonic())
+
+    def __io_loop(self):
+        while self.running:
+            for key, mask in self.selector.select(self.__select_timeout()):
+                if key.fileobj is self.wakee:
+                    self.__drain_waker()
+                elif key.fileobj is self.server:
+                    self.__accept()
+                else:
+                    connection = key.data
+                    if mask & selectors.EVENT_READ:
+                        self.__read(connection)
+                    if mask & selectors.EVENT_WRITE and not connection.closed:
+                        self.__flush(connection)
+            self.__flush_due()
+
+        # stop accepting before closing, so nobody reconnects in between
+        self.server.close()
+        for connection in list(self.connections_all):
+            self.__close(connection)
+        self.selector.close()
+
+    def __drain_waker(self):
+        try:
+            while self.wakee.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.woken = False
+        while self.commands:
+            self.commands.popleft()()
+
+    def __register(self, connection):
+        self.connections_all.add(connection)
+        self.selector.register(connection.sock, selectors.EVENT_READ, connection)
+
+    def __accept(self):
+        try:
+            sock, address = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # port is filled in by the handshake frame
+        self.__register(Connection(sock, address[0]))
+
+    def __read(self, connection):
+        try:
+            data = connection.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            self.__close(connection)
+            return
+
+        buffer = connection.inbuf
+        buffer += data
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME:
+                log.warning("%s sent a frame of %s bytes; closing", connection, length)
+                self.__close(connection)
+                return
+            end = offset + FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            self.__on_frame(connection, bytes(buffer[offset + FRAME_HEADER.size:end]))
+            if connection.closed:
+                return
+            offset = end
+        del buffer[:offset]
+
+    def __on_frame(self, connection, payload):
+        if connection.handshaken():
+            lane, _ = Lanes.untag(payload[:2])
+            self.inbox.put(lane, (connection, payload))
+            return
+
+        try:
+            host, port = payload.decode().split(":")
+            port = int(port)
+            if not 0 < port < 1 << 16:
+                raise ValueError(f"port {port} out of range")
+        except ValueError as e: # includes UnicodeDecodeError
+            log.warning("bad handshake from %s: %s", connection, e)
+            self.__close(connection)
+            return
+        connection.host, connection.port = host, port
+        log.debug("inbound connection from %s", connection)
+        self.on_new_connection_callback(connection)
+
+    def __flush(self, connection):
+        connection.scheduled = False
+        outbuf = connection.outbuf
+        while outbuf:
+            buffers = list(islice(outbuf, IOV_MAX))
+            try:
+                sent = connection.sock.sendmsg(buffers)
+                self.stats["sendmsg"] += 1
+            except BlockingIOError:
+                sent = 0
+            except OSError as e:
+                log.error("write to %s failed: %s", connection, e)
+                self.__close(connection)
+                return
+
+            # drop written frames and keep the unwritten tail of a partial one
+            for buffer in buffers:
+                if sent < len(buffer):
+                    if sent:
+                        outbuf[0] = memoryview(buffer)[sent:]
+                    self.__want_write(connection, True)
+                    return
+                sent -= len(buffer)
+                outbuf.popleft()
+
+        self.__want_write(connection, False)
+
+    def __want_write(self, connection, writing):
+        if connection.writing != writing:
+            connection.writing = writing
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self.selector.modify(connection.sock, events, connection)
+
+    def __close(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        self.connections_all.discard(connection)
+        try:
+            self.selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        connection.sock.close()
+        if connection.handshaken() and self.running:
+            # None payload: report the loss from the dispatcher thread
+            connection.reported = getattr(connection, "pid", None) is not None
+            self.inbox.put(Lanes.CONTROL, (connection, None))
+    # =====================================
+
+    def __dispatch_loop(self):
+        # connection_lost() runs callbacks here too; see wait_for_capacity
+        self.receiving.active = True
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                return
+            connection, payload = item
+            try:
+                if payload is None:
+                    self.connection_lost(connection)
+                else:
+                    self.on_receive(connection, payload.decode())
+            except Exception:
+                log.exception("error handling message from %s", connection)
+                self.events.dump()
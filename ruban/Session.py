@@ -0,0 +1,161 @@
+from ruban.Lanes import Lanes, PROPOSE
+from collections import deque
+from threading import Lock
+import logging
+
+log = logging.getLogger(__name__)
+
+# Session holds the per-pid sequencing state that outlives a connection.
+#
+# Every protocol message sent to a pid gets the next sequence number and is
+# kept, already encoded, in a bounded retransmit buffer until the pid
+# acknowledges it. When a connection drops and is re-established, both sides
+# exchange the highest sequence number they received (resume handshake) and
+# replay only what the other side is missing.
+#
+#  unacked: [ (seq, data), ... ]   oldest first, at most <capacity> entries
+#  acked    highest seq the pid confirmed
+#  received highest seq delivered from the pid
+#
+# Flow control is credit based: at most <window> messages are sent and not
+# acknowledged yet. Further messages wait in <queued> until the pid grants
+# credit by acknowledging what it received, which it does every <window> / 2
+# messages (see grant()). A session whose queue reaches <queue_limit> is
+# congested, which throttles new offers (see deCoordinated.wait_for_capacity);
+# PROPOSEs that still arrive are refused, and their offers fail. Other lanes
+# settle offers already in flight and are always queued, except that a pid
+# which is suspected loses the oldest beyond <capacity> (it catches up with
+# what it missed, see ruban.Sync).
+#
+# Queued messages wait in priority lanes (see ruban.Lanes) and are only
+# sequenced when sent, so a COMMIT queued after a PROPOSE can go out first.
+# The receiver may also handle them out of order; messages received ahead of
+# a gap are remembered so that <received> stays cumulative for the resume
+# handshake.
+#
+#  queued:  Lanes of messages, not sequenced or sent yet
+#  sent     highest seq handed to the connection
+#  ahead    seqs received beyond received + 1
+
+class Session:
+    RETRANSMIT_BUFFER = 4096
+    WINDOW = 256
+    QUEUE_LIMIT = 1024
+    REORDER_LIMIT = 1024
+
+    def __init__(self, pid, capacity=RETRANSMIT_BUFFER, window=WINDOW, queue_limit=QUEUE_LIMIT):
+        self.pid = pid
+        self.next_seq = 0
+        self.acked = 0
+        self.received = 0
+        self.unacked = deque(maxlen=capacity)
+        self.window = window
+        self.queue_limit = queue_limit
+        self.queued = Lanes()
+        self.sent = 0
+        self.granted = 0 # highest <received> acknowledged to the pid
+        self.ack_scheduled = False # a delayed ack is pending, see deCoordinated
+        self.ahead = set()
+        # False while the connection is down or being resumed;
+        # messages are only buffered until the replay is done
+        self.live = True
+        self.lock = Lock()
+
+    def enqueue(self, lane, message) -> bool:
+        """
+        Queue <message> in <lane> until there is credit to send it; False if
+        it is a PROPOSE and the queue is congested, in which case it is not
+        queued. Must hold <lock>.
+        """
+        if lane == PROPOSE and self.congested():
+            return False
+        self.queued.push(lane, (lane, message))
+        return True
+
+    def shed(self):
+        """
+        Drop the oldest queued messages beyond <capacity>, lowest priority
+        first; for a pid that will catch up instead. Must hold <lock>.
+        """
+        while len(self.queued) > self.unacked.maxlen:
+            log.debug("send queue for pid %s is full; dropping %s",
+                      self.pid, self.queued.shed())
+
+    def sendable(self, encode):
+        """
+        Messages to send now given the credit left, by priority, encoded with
+        encode(lane, seq, message) and moved to the retransmit buffer.
+        Must hold <lock>.
+        """
+        batch = []
+        while self.queued and self.sent - self.acked < self.window:
+            lane, message = self.queued.pop()
+            self.next_seq += 1
+            data = encode(lane, self.next_seq, message)
+            self.record(self.next_seq, data)
+            batch.append(data)
+        return batch
+
+    def congested(self):
+        return len(self.queued) >= self.queue_limit
+
+    def grant(self, threshold=None) -> bool:
+        """
+        Whether to acknowledge what was received so far, returning credit
+        to the pid; by default once <window> / 2 messages are unacknowledged
+        """
+        if threshold is None:
+            threshold = max(self.window // 2, 1)
+        if self.received - self.granted < threshold:
+            return False
+        self.granted = self.received
+        return True
+
+    def record(self, seq, data):
+        """
+        Buffer sent message <data> carrying <seq>. Must hold <lock>.
+        """
+        if len(self.unacked) == self.unacked.maxlen:
+            log.warning("retransmit buffer for pid %s is full; dropping seq %s",
+                        self.pid, self.unacked[0][0])
+        self.unacked.append((seq, data))
+        self.sent = seq
+
+    def ack(self, seq):
+        """
+        <pid> received everything up to <seq>
+        """
+        with self.lock:
+            if seq <= self.acked:
+                return
+            self.acked = seq
+            while self.unacked and self.unacked[0][0] <= seq:
+                self.unacked.popleft()
+
+    def accept(self, seq) -> bool:
+        """
+        Whether message <seq> from <pid> should be delivered; drops duplicates
+        """
+        if seq <= self.received or seq in self.ahead:
+            return False
+        self.ahead.add(seq)
+        if len(self.ahead) > self.REORDER_LIMIT:
+            # the gap is not going to be filled
+            first = min(self.ahead)
+            log.warning("pid %s: messages %s..%s were lost",
+                        self.pid, self.received + 1, first - 1)
+            self.received = first - 1
+        while self.received + 1 in self.ahead:
+            self.received += 1
+            self.ahead.remove(self.received)
+        return True
+
+    def replay(self, received):
+        """
+        Encoded messages <pid> is missing given it received up to <received>.
+        Must hold <lock>.
+        """
+        if self.unacked and self.unacked[0][0] > received + 1:
+            log.warning("pid %s: cannot replay %s..%s, no longer buffered",
+                        self.pid, received + 1, self.unacked[0][0] - 1)
+        return [data for seq, data in self.unacked if seq > received]
@@ -0,0 +1,64 @@
+from threading import Thread, Lock
+import logging
+
+log = logging.getLogger(__name__)
+
+# Periodic snapshots of the committed game state, so that recovery costs
+# loading the latest snapshot plus replaying the log after it instead of
+# replaying the whole session (see CommitLog.recover()).
+#
+# Every <every> commits the state is captured right after the commit, i.e. at
+# a committed-chain boundary, and tagged with the digest of that chain.
+# Pickling, writing and compacting the log happen on a background thread, so
+# the Trader keeps processing messages meanwhile. At most one snapshot is in
+# flight; a snapshot that comes due while one is being written is skipped.
+
+class Snapshotter:
+    EVERY = 1000  # commits
+
+    def __init__(self, commit_log, capture, every=EVERY):
+        """
+        <capture> returns the state to snapshot. It is called on the thread
+        that committed and what it returns is pickled on another thread, so it
+        must not be mutated afterwards (return a copy or an immutable value).
+        """
+        self.commit_log = commit_log
+        self.capture = capture
+        self.every = every
+        self.commits = 0
+        self.lock = Lock()
+        self.worker = None
+
+    def committed(self, seq, chain):
+        """
+        Called once <chain> is logged at <seq> and applied to the state
+        """
+        self.commits += 1
+        if self.commits < self.every:
+            return
+        with self.lock:
+            if self.worker is not None and self.worker.is_alive():
+                return
+            self.commits = 0
+            state = self.capture()
+            pending, tombstones = self.commit_log.marks()
+            self.worker = Thread(target=self.__write,
+                                 args=(seq, chain.digest(), state, pending, tombstones),
+                                 daemon=True)
+            self.worker.start()
+
+    def wait(self):
+        """
+        Block until the snapshot in flight, if any, is written
+        """
+        with self.lock:
+            worker = self.worker
+        if worker is not None:
+            worker.join()
+
+    def __write(self, seq, digest, state, pending, tombstones):
+        try:
+            self.commit_log.snapshot(seq, digest, state, pending, tombstones)
+        except Exception as e:
+            # the log still has everything; the next snapshot will retry
+            log.error("snapshot at seq %s failed: %s", seq, e)
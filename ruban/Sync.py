@@ -0,0 +1,186 @@
+from hashlib import blake2b
+from collections import Counter
+import logging
+
+log = logging.getLogger(__name__)
+
+# Catch-up sync for peers that missed COMMITs (disconnected, suspected or
+# restarted).
+#
+# Every peer keeps a Ledger of the chains it committed, in commit order, with
+# a rolling digest after each one:
+#
+#   rolling[0] = 0^16
+#   rolling[n] = blake2b(rolling[n - 1] + chain_n.digest())
+#
+# Equal rolling digests at length n mean equal histories up to n, so a
+# summary of a few (length, rolling digest) checkpoints locates the common
+# prefix in one round trip:
+#
+#   lagging peer                      up-to-date peer
+#        ---- SUMMARY [(n, r_n), (n-1, ..), (n-2, ..), (n-4, ..) .. (0, ..)] -->
+#                                     finds the longest matching checkpoint k
+#        <-- BATCH (k + 1, chains, done=False) ----
+#        <-- BATCH (k + 1 + BATCH_SIZE, chains, done=True) ----
+#
+# Checkpoints back off exponentially, so a summary is O(log n) and, when the
+# histories only diverge near the end, at most twice the divergent suffix is
+# resent: catch-up cost follows the size of the gap, not of the history.
+#
+# Concurrent offers of different leaders may commit in different orders on
+# different peers; the receiver skips the chains it committed itself past the
+# common prefix (by digest, counting repeats: the same chain may be committed
+# more than once) and appends the others, so the committed chains converge
+# even when their orders do not.
+#
+# Every BATCH also carries the sender's rolling digest after its last chain.
+# The receiver only accepts batches that start at one of the checkpoints of
+# its own SUMMARY, follow each other without gaps, and whose chains fold from
+# that checkpoint into the claimed digest (see Verifier).
+#
+# The Ledger itself only keeps 32 bytes per chain. Chains are read back from
+# a HistoryStore for BATCHes when there is one; without one they are kept in
+# memory.
+
+DIGEST_SIZE = 16
+BATCH_SIZE = 256  # chains per BATCH message
+
+def rolling(previous, digest) -> bytes:
+    return blake2b(previous + digest, digest_size=DIGEST_SIZE).digest()
+
+
+class Ledger:
+    """
+    Rolling digests of the committed chains in commit order. The chains are
+    read back from <history> (a ruban.HistoryStore holding the same chains)
+    if given, kept in memory otherwise.
+    """
+    def __init__(self, chains=(), history=None):
+        self.history = history
+        self.chains = [] if history is None else None
+        self.length = 0
+        self.digests = bytearray(DIGEST_SIZE)  # rolling digests, from 0
+        self.chain_digests = bytearray()       # Chain.digest(), from seq 1
+        self.extend(chains)
+
+    def __len__(self):
+        return self.length
+
+    def digest(self, seq) -> bytes:
+        """
+        Chain.digest() of chain <seq>, from 1
+        """
+        return bytes(self.chain_digests[(seq - 1) * DIGEST_SIZE:seq * DIGEST_SIZE])
+
+    def rolling(self, length) -> bytes:
+        """
+        Rolling digest after the first <length> chains
+        """
+        return bytes(self.digests[length * DIGEST_SIZE:(length + 1) * DIGEST_SIZE])
+
+    def append(self, chain):
+        digest = chain.digest()
+        if self.chains is not None:
+            self.chains.append(chain)
+        self.chain_digests += digest
+        self.digests += rolling(self.rolling(self.length), digest)
+        self.length += 1
+
+    def extend(self, chains):
+        for chain in chains:
+            self.append(chain)
+
+    def summary(self) -> list:
+        """
+        [(length, rolling digest)] at n, n - 1, n - 2, n - 4, ... and 0
+        """
+        checkpoints = []
+        length, step = len(self), 1
+        while length > 0:
+            checkpoints.append((length, self.rolling(length)))
+            length -= step
+            step *= 2
+        checkpoints.append((0, self.rolling(0)))
+        return checkpoints
+
+    def common(self, summary) -> int:
+        """
+        Length of the longest prefix shared with the ledger <summary> was taken from
+        """
+        for length, digest in summary:
+            if length <= len(self) and self.rolling(length) == digest:
+                return length
+        return 0
+
+    def batches(self, start, size=BATCH_SIZE):
+        """
+        (first seq, chains, done, rolling digest after them) covering the
+        chains after <start>
+        """
+        if start == len(self):
+            yield start + 1, [], True, self.rolling(start)
+            return
+        for first in range(start, len(self), size):
+            end = min(first + size, len(self))
+            yield first + 1, self.__chains(first, end), end >= len(self), self.rolling(end)
+
+    def __chains(self, start, end):
+        if self.chains is not None:
+            return self.chains[start:end]
+        return [self.history.get(seq) for seq in range(start + 1, end + 1)]
+
+
+class Verifier:
+    """
+    Checks the BATCHes answering our SUMMARY <summary>
+    """
+    def __init__(self, summary):
+        self.checkpoints = dict(summary)
+        self.next = None     # first seq of the next batch
+        self.digest = None   # rolling digest before it
+        # { digest --> times we committed it past the common prefix }
+        self.ours = None
+
+    def start(self, ledger, first):
+        """
+        First batch verified; our chains past its start are not committed again
+        """
+        self.ours = Counter(ledger.digest(seq) for seq in range(first, len(ledger) + 1))
+
+    def committed(self, digest):
+        """
+        We committed <digest> through a round of our own meanwhile
+        """
+        if self.ours is not None:
+            self.ours[digest] += 1
+
+    def missing(self, chains) -> list:
+        """
+        <chains> of a batch that we did not commit ourselves
+        """
+        missing = []
+        for chain in chains:
+            digest = chain.digest()
+            if self.ours[digest]:
+                self.ours[digest] -= 1
+            else:
+                missing.append(chain)
+        return missing
+
+    def verify(self, first, chains, claimed) -> bool:
+        if self.next is None:
+            # must start from a prefix we have
+            digest = self.checkpoints.get(first - 1)
+            if digest is None:
+                return False
+        elif first == self.next:
+            digest = self.digest
+        else:
+            return False
+
+        for chain in chains:
+            digest = rolling(digest, chain.digest())
+        if digest != claimed:
+            return False
+        self.next, self.digest = first + len(chains), digest
+        return True
@@ -0,0 +1,108 @@
+from threading import Thread, Lock, Event, current_thread
+from time import monotonic
+import logging
+
+log = logging.getLogger(__name__)
+
+# TimerWheel is a hashed timing wheel driven by a single thread.
+#
+# Scheduling and cancelling are O(1) no matter how many timers are pending,
+# which matters since every proposed offer arms a deadline. Timers fire with a
+# resolution of one <tick>; callbacks run on the wheel's thread and should be
+# short.
+#
+#  slots: [ {timer, ...}, {timer, ...}, ... ]   (<size> slots of <tick> seconds)
+#            ▲
+#         cursor advances one slot per tick; a timer fires once the cursor
+#         reaches its slot with no rounds left
+
+class Timer:
+    def __init__(self, wheel, slot, rounds, callback, args):
+        self.wheel = wheel
+        self.slot = slot
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    TICK = 0.01  # seconds
+    SIZE = 512   # slots
+
+    __shared = None
+    __shared_lock = Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Process-wide wheel; the thread is only started once a timer is scheduled
+        """
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                cls.__shared = TimerWheel()
+            return cls.__shared
+
+    def __init__(self, tick=TICK, size=SIZE):
+        self.tick = tick
+        self.size = size
+        self.slots = [set() for _ in range(size)]
+        self.cursor = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    def schedule(self, delay, callback, *args) -> Timer:
+        """
+        Call callback(*args) after <delay> seconds
+        """
+        ticks = max(1, round(delay / self.tick))
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.__run, daemon=True)
+                self.thread.start()
+            slot = (self.cursor + ticks) % self.size
+            timer = Timer(self, slot, (ticks - 1) // self.size, callback, args)
+            self.slots[slot].add(timer)
+        return timer
+
+    def cancel(self, timer: Timer):
+        with self.lock:
+            timer.cancelled = True
+            self.slots[timer.slot].discard(timer)
+
+    def in_callback(self) -> bool:
+        """
+        Whether the caller runs on the wheel's thread, i.e. in a timer callback
+        """
+        return current_thread() is self.thread
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def __run(self):
+        next_tick = monotonic() + self.tick
+        while not self.stopped.wait(max(0, next_tick - monotonic())):
+            next_tick += self.tick
+            for timer in self.__advance():
+                if timer.cancelled:
+                    continue
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    log.exception("timer callback %s failed", timer.callback)
+
+    def __advance(self):
+        with self.lock:
+            self.cursor = (self.cursor + 1) % self.size
+            slot = self.slots[self.cursor]
+            expired = [timer for timer in slot if timer.rounds == 0]
+            for timer in slot:
+                timer.rounds -= 1
+            slot.difference_update(expired)
+        return expired
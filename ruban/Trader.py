@@ -1,18 +1,123 @@
 from ruban.Offer import Message, Chain, Offer, Action
+from ruban.EventLog import EventLog
+from ruban.TimerWheel import TimerWheel
+from ruban import Dissemination
+from ruban import Sync
+from ruban.Policy import Decision
+from ruban.CommitLog import CommitLog
 
 from abc import ABC, abstractmethod
-from threading import Thread
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, RLock
 from enum import Enum
+import secrets
 import logging
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+class OfferAborted(Exception):
+    """
+    Outcome of an offer that did not commit; see Trader.offer()
+    """
+    DEADLINE = "deadline"  # cohorts missed the response deadline
+    REJECTED = "rejected"  # the leader rejected the counters
+    REFUSED  = "refused"   # a cohort rejected the offer
+    BACKPRESSURE = "backpressure"  # a send queue was full, see Backpressure
+
+    def __init__(self, chain, reason):
+        super().__init__(f"offer aborted: {reason}")
+        self.chain = chain
+        self.reason = reason
+
+class Backpressure(Exception):
+    """
+    Raised by Trader.offer() while peers are not keeping up with what was
+    already sent; the offer was not proposed
+    """
+
 class Trader(ABC):
-    def __init__(self):
+    # what the leader does with cohorts that did not respond before the deadline
+    class Missing(Enum):
+        ABORT   = 0  # abort the offer and broadcast ABORT
+        COUNTER = 1  # treat as an implicit counter; respond() decides
+        EXCLUDE = 2  # decide using only the responses received
+
+    # seconds offer() waits for congested send queues to drain before raising
+    # Backpressure; None waits as long as it takes
+    BACKPRESSURE_TIMEOUT = 5.0
+
+    # flood protection, see ruban.Limits: PROPOSEs with longer chains, or
+    # from leaders with more offers awaiting an outcome here, are refused
+    MAX_CHAIN_ACTIONS = 1 << 16
+    MAX_IN_FLIGHT = 256
+    IN_FLIGHT = (Offer.State.RECEIVED, Offer.State.OKED, Offer.State.COUNTERED,
+                 Offer.State.REJECTED)
+    # seconds a cohort waits for the COMMIT or ABORT of an offer it answered,
+    # which may have been lost, before it gives up on the offer and tells the
+    # leader; None waits until they arrive. Offers the application has not
+    # answered yet never expire.
+    OFFER_TTL = 60.0
+
+    # leader broadcasts that are relayed down a tree when <fanout> is set
+    RELAYED = (Message.Type.PROPOSE, Message.Type.COMMIT, Message.Type.ABORT)
+
+    def __init__(self, response_timeout=None, on_missing=Missing.ABORT, fanout=None,
+                 aggregate=False, commit_log=None, history=None, snapshots=None):
         super().__init__()
         self.__offers: dict[int, Offer] = {}
-    
+        # { leader pid --> keys of its offers in flight here }; see MAX_IN_FLIGHT
+        self.__in_flight: dict[int, set[int]] = {}
+        # outcomes of our own offers, by chain hash
+        self.__futures: dict[int, Future] = {}
+        # ring buffer of protocol events; see ruban.EventLog
+        self.events = EventLog(__name__)
+
+        # seconds the leader waits for OK/COUNTER; None waits forever
+        self.response_timeout = response_timeout
+        self.on_missing = on_missing
+        self.timers = TimerWheel.shared()
+        # pids the failure detector suspects; not waited for by the leader
+        self.suspected = set()
+        # serializes message handling with deadline expiry
+        self.__lock = RLock()
+        # children per node of the broadcast tree; None sends to everyone
+        self.fanout = fanout
+        self.__seen = Dissemination.Seen()
+        # chains aborted before their PROPOSE arrived (see ruban.Lanes)
+        self.__ended = Dissemination.Seen()
+        # OKs are merged up the same tree instead of sent to the leader
+        self.aggregate = aggregate
+        self.__aggregates: dict[int, Dissemination.Aggregate] = {}
+        # write-ahead log of offers; see ruban.CommitLog
+        self.commit_log = commit_log
+        # highest record not fsynced yet with Durability.GROUP; synced once
+        # the lock is released, so that group commit is not serialized by it
+        self.__unsynced = 0
+        # (record seq, callable, args) run in order once the lock is released
+        # and the record is durable; see __later()
+        self.__outbox = deque()
+        self.__delivering = RLock()
+        # runs __deliver() for timer callbacks; see __hand_off()
+        self.__deliverer = None
+        self.__handed_off = False
+        # indexed committed history; see ruban.HistoryStore
+        self.history = history
+        # periodic snapshots of the committed state; see ruban.Snapshot
+        self.snapshots = snapshots
+        # committed chains with rolling digests, for catch-up; see ruban.Sync
+        self.ledger = Sync.Ledger(history=history)
+        # { pid --> Sync.Verifier } of the catch-ups we asked <pid> for
+        self.__catch_ups: dict[int, Sync.Verifier] = {}
+        # incrementally applied game state; see ruban.Materializer
+        self.materializer = None
+        # evaluates received chains ahead of COMMIT; see ruban.Materializer
+        self.speculator = None
+        # legal actions, checked before respond(); see ruban.Rules
+        self.rules = None
+        # automatic responses ahead of respond(); see ruban.Policy
+        self.policies = None
+
 
     # these must be implemented
     # must call accept() or reject() with offer
@@ -33,30 +138,131 @@ class Trader(ABC):
     # --------------
     @abstractmethod
     def send_to_pid(self, participant, message):
+        """
+        Returns False if <message> was refused because the send queue to
+        <participant> is full; an offer whose PROPOSE is refused is aborted
+        """
         pass
 
     @abstractmethod
-    def get_participants(self):
+    def get_participants(self, epoch=None):
         pass
     
     @abstractmethod
     def get_own_pid(self):
         pass
+
+    def get_epoch(self):
+        """
+        Incremented on every membership change
+        """
+        return 0
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Block until peers keep up with what was sent to them; False if they
+        still do not after <timeout> seconds
+        """
+        return True
+
+    # chains proposed by the library itself (e.g. membership changes) are
+    # handled by these hooks instead of respond()/committed()/aborted()
+    def is_internal(self, chain):
+        return False
+
+    def respond_internal(self, offer):
+        pass
+
+    def committed_internal(self, chain):
+        pass
+
+    def aborted_internal(self, chain):
+        pass
+
+    def response_deadline(self):
+        """
+        Seconds the leader waits for responses; may adapt to measured latency
+        """
+        return self.response_timeout
+
+    def suspect(self, pid):
+        """
+        Called by the failure detector: stop waiting for <pid> in pending rounds
+        """
+        with self.__lock:
+            self.suspected.add(pid)
+            self.events("suspect", pid)
+            for offer in list(self.__offers.values()):
+                if offer.state == Offer.State.PROPOSING:
+                    self.__check_responses(offer)
+        self.__deliver()
+
+    def unsuspect(self, pid):
+        with self.__lock:
+            was_suspected = pid in self.suspected
+            self.suspected.discard(pid)
+            self.events("unsuspect", pid)
+        if was_suspected:
+            # either side may have missed COMMITs while apart
+            self.catch_up(pid)
+
+    def catch_up(self, pid):
+        """
+        Ask <pid> for the committed chains we are missing
+        """
+        summary = self.ledger.summary()
+        with self.__lock:
+            # restarts any catch-up with <pid> that got lost
+            self.__catch_ups[pid] = Sync.Verifier(summary)
+        message = Message(self.get_own_pid(), Message.Type.SUMMARY, None, summary)
+        self.send_to_pid(pid, message)
     # ==========================
 
 # interface
 # offer(), accept(), reject(), counter()
 # ---------------------------------------
-    def offer(self, chain, prev=None):
+    def offer(self, chain, prev=None) -> Future:
         """
-        Create an Offer and propose to all participants
+        Create an Offer and propose to all participants. The returned Future
+        resolves to the committed chain or fails with OfferAborted. If a
+        counter is taken instead, the Future follows the counter.
+
+        Raises Backpressure if peers do not drain what was already sent to
+        them within BACKPRESSURE_TIMEOUT seconds, or right away when called
+        while handling a message (from respond(), committed(), ...).
         """
-        # create offer for tracking
-        offer = Offer().propose(chain, prev=prev)
-        self.__add_offer(offer)
+        # counters and membership changes settle work already in flight
+        if (prev is None and not self.is_internal(chain) and
+                not self.wait_for_capacity(self.BACKPRESSURE_TIMEOUT)):
+            raise Backpressure("send queues are full")
 
-        # send PROPOSE to everyone
-        self.__propose(offer)
+        with self.__lock:
+            # create offer for tracking
+            offer = Offer().propose(chain, prev=prev)
+            offer.epoch = self.get_epoch()
+            # tells this round apart from other rounds of an identical chain
+            offer.round = secrets.randbits(64)
+            future = self.__futures.pop(hash(prev), None) if prev is not None else None
+            future = future or Future()
+            self.__futures[hash(offer)] = future
+            self.__add_offer(offer)
+
+            # send PROPOSE to everyone
+            self.__propose(offer)
+        self.__deliver()
+        return future
+
+    async def offer_async(self, chain, prev=None):
+        """
+        offer() for asyncio: returns the committed chain, raises OfferAborted
+        """
+        # only paid for by asyncio applications; see tests/test_import.py
+        import asyncio
+        # offer() may block for up to BACKPRESSURE_TIMEOUT waiting for
+        # capacity, and on the lock and the commit log; not on the loop
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self.offer, chain, prev)
+        return await asyncio.wrap_future(future)
 
     def accept(self, offer: Offer):
         """
@@ -65,74 +271,334 @@ class Trader(ABC):
         2. accept a COUNTER and propose it to everyone
         """
 
-        # cohort received offer and accepting
-        if offer.state == Offer.State.RECEIVED:
-            if not self.__has_offer(offer):
-                log.error("Accepting uncrecognized offer")
-                return 
+        with self.__lock:
+            # cohort received offer and accepting
+            if offer.state == Offer.State.RECEIVED:
+                if not self.__has_offer(offer):
+                    log.error("Accepting uncrecognized offer")
+                    return 
 
-            self.__ok(offer)
+                self.__ok(offer)
 
-        # leader choosing counter offer
-        elif (offer.state == Offer.State.COUNTER and 
-              self.__has_offer(offer.chain.prev)):
-                orig_offer = self.__get_offer(offer.chain.prev)
-                if orig_offer.state == Offer.State.DECIDING:
-                    orig_offer.abort()
-                    # remove orig_offer with its counters
-                    self.__pop_offer(orig_offer)
+            # leader choosing counter offer
+            elif (offer.state == Offer.State.COUNTER and 
+                  self.__has_offer(offer.chain.prev)):
+                    orig_offer = self.__get_offer(offer.chain.prev)
+                    if orig_offer.state == Offer.State.DECIDING:
+                        orig_offer.abort()
+                        # remove orig_offer with its counters
+                        self.__pop_offer(orig_offer)
+                        if self.__logged(orig_offer.chain):
+                            self.__log(self.commit_log.tombstone(orig_offer.chain.digest(), wait=False))
                 
-                    # propose counter
-                    self.offer(offer.chain, prev=orig_offer.chain)
+                        # propose counter
+                        self.offer(offer.chain, prev=orig_offer.chain)
+        self.__deliver()
 
     def reject(self, original_chain, counter_chain=None):
         """
         Used for:
-        1. reject a proposed offer and send COUNTER
+        1. reject a proposed offer and send COUNTER, or REJECT without one
         2. reject a COUNTER but propose a new COUNTER
         """
-        # offers are just hashed by their chain so I think this should work...?
-        orig_offer = self.__get_offer(original_chain)
-        # cohort received a proposed offer
-        if orig_offer.state == Offer.State.RECEIVED:
-            if counter_chain:
-                counter_offer = orig_offer.counter(counter_chain)
-        # leader rejecting a counter offer
-        elif orig_offer.state == Offer.State.DECIDING:
-            pass
+        with self.__lock:
+            # offers are just hashed by their chain so I think this should work...?
+            orig_offer = self.__get_offer(original_chain)
+            # cohort received a proposed offer
+            if orig_offer.state == Offer.State.RECEIVED:
+                if self.__aggregating():
+                    # nothing to merge from us; the counter goes to the leader
+                    self.__aggregated(orig_offer, self.get_own_pid(), {})
+                if counter_chain:
+                    orig_offer.make_counter(self.get_own_pid(), counter_chain)
+                else:
+                    # the leader aborts the round rather than wait for us
+                    orig_offer.reject()
+                self.__arm_expiry(orig_offer)
+                message = orig_offer.get_message(self.get_own_pid())
+                message.sign(self.get_own_pid())
+                # counters and rejections go straight to the leader
+                self.send_to_pid(orig_offer.chain.owner, message)
+            # leader rejecting the counters (and possibly proposing a new one)
+            elif orig_offer.state == Offer.State.DECIDING:
+                # the Future follows a new counter
+                future = self.__futures.pop(hash(orig_offer), None) if counter_chain else None
+                self.__abort(orig_offer, OfferAborted.REJECTED)
+                if counter_chain:
+                    if future:
+                        self.__futures[hash(orig_offer)] = future
+                    self.offer(counter_chain, prev=orig_offer.chain)
+        self.__deliver()
 
 # internal
 # ---------------------------------------
     def __broadcast(self, message):
-        log.debug(f"broadcasting message: {str(message)}")
-        for p in self.get_participants():
-            if p != self.get_own_pid(): # do not send to self
-                self.send_to_pid(p, message)
+        self.events("broadcast", message)
+        if self.fanout and message.type in Trader.RELAYED:
+            # cohorts relay to the rest of the tree
+            return self.__relay(message)
+
+        # pids that refused the message
+        return [p for p in self.get_participants()
+                if p != self.get_own_pid() # do not send to self
+                and self.send_to_pid(p, message) is False]
+
+    def __relay(self, message):
+        # every participant derives the same tree from the offer's epoch
+        return [p for p in Dissemination.children(self.__tree(message.epoch), message.sender,
+                                                  self.get_own_pid(), self.fanout)
+                if self.send_to_pid(p, message) is False]
+
+    def __aggregating(self):
+        return bool(self.fanout and self.aggregate)
+
+    def __start_aggregate(self, offer: Offer):
+        """
+        Wait for our own response and our children's AGGREGATEs
+        """
+        children = Dissemination.children(self.__tree(offer.epoch), offer.chain.owner,
+                                          self.get_own_pid(), self.fanout)
+        aggregate = Dissemination.Aggregate(children + [self.get_own_pid()])
+        self.__aggregates[hash(offer)] = aggregate
+
+        # forward what we have rather than hold up the whole subtree
+        deadline = self.response_deadline()
+        if children and deadline is not None:
+            aggregate.timer = self.timers.schedule(
+                deadline / 2, self.__aggregate_expired, offer)
+
+    def __aggregated(self, offer: Offer, pid, oks):
+        """
+        <pid> (a child or us) responded with the OKs of its subtree
+        """
+        with self.__lock:
+            aggregate = self.__aggregates.get(hash(offer))
+            if aggregate is None:
+                return # round is over
+            aggregate.pending.discard(pid)
+            if aggregate.flushed:
+                # late; pass it on as is
+                if oks:
+                    self.__send_aggregate(offer, oks)
+                return
+            aggregate.oks.update(oks)
+            if not aggregate.pending:
+                self.__flush_aggregate(offer, aggregate)
+
+    def __aggregate_expired(self, offer: Offer):
+        with self.__lock:
+            aggregate = self.__aggregates.get(hash(offer))
+            if aggregate is None or aggregate.flushed:
+                return
+            aggregate.timer = None
+            self.events("aggregate deadline", aggregate.pending, offer)
+            self.__flush_aggregate(offer, aggregate)
+
+    def __flush_aggregate(self, offer: Offer, aggregate):
+        if aggregate.timer:
+            aggregate.timer.cancel()
+            aggregate.timer = None
+        aggregate.flushed = True
+        # sent even if empty so that the parent stops waiting for us
+        self.__send_aggregate(offer, aggregate.oks)
+
+    def __send_aggregate(self, offer: Offer, oks):
+        message = Message(self.get_own_pid(), Message.Type.AGGREGATE, offer.chain,
+                          signature=dict(oks), epoch=offer.epoch)
+        parent = Dissemination.parent(self.__tree(offer.epoch), offer.chain.owner,
+                                      self.get_own_pid(), self.fanout)
+        if parent is None:
+            parent = offer.chain.owner
+        self.send_to_pid(parent, message)
+
+    def __end_aggregate(self, lookup: Offer | Chain | int):
+        aggregate = self.__aggregates.pop(self.__key(lookup), None)
+        if aggregate and aggregate.timer:
+            aggregate.timer.cancel()
+
+    def __within_limits(self, message) -> bool:
+        """
+        Whether PROPOSE <message> is processed; checked before an Offer is
+        made for it
+        """
+        chain = message.chain
+        if len(chain.actions) > self.MAX_CHAIN_ACTIONS:
+            return self.__refuse(message, "chain too long")
+        if self.__countered(chain) is None:
+            # a counter replaces the offer it counters
+            if len(self.__in_flight.get(chain.owner, ())) >= self.MAX_IN_FLIGHT:
+                return self.__refuse(message, "too many offers in flight")
+        return True
+
+    def __countered(self, chain: Chain):
+        """
+        Offer <chain> counters, if we hold it; only a leader's own offers
+        can be countered by its PROPOSEs
+        """
+        offer = self.__offers.get(chain.prev) if chain.prev else None
+        if offer is None or offer.chain.owner != chain.owner:
+            return None
+        return offer
+
+    def __refuse(self, message, reason) -> bool:
+        """
+        Drop PROPOSE <message> and tell its leader, who aborts the offer
+        instead of waiting on us
+        """
+        self.events("dropped", message, reason)
+        reject = Message(self.get_own_pid(), Message.Type.REJECT, message.chain)
+        reject.sign(self.get_own_pid())
+        self.send_to_pid(message.chain.owner, reject)
+        return False
+
+    def __tree(self, epoch):
+        return self.get_participants(epoch) or self.get_participants()
+
+    def __first_time(self, message) -> bool:
+        """
+        Drop broadcasts relayed to us more than once
+        """
+        return self.__seen.add((message.type, self.__round_of(message)))
+
+    @staticmethod
+    def __round_of(message):
+        # identical chains may be proposed again, in rounds of their own
+        return message.round if message.round is not None else hash(message.chain)
 
     def __propose(self, offer: Offer):
         """
         send PROPOSE message to all participant
         """
-        log.debug(f"Proposing offer {str(offer)}")
+        self.events("propose", offer)
+        message = offer.get_message(self.get_own_pid())
+        message.sign(self.get_own_pid())
+
+        # armed first; with synchronous delivery the round may resolve
+        # (and disarm it) before the broadcast returns
+        self.__arm_deadline(offer)
+        if self.__broadcast(message) and offer.state == Offer.State.PROPOSING:
+            # some cohorts would never see it
+            return self.__abort(offer, OfferAborted.BACKPRESSURE)
+
+        # do not wait on cohorts that are already suspected
+        if self.suspected and offer.state == Offer.State.PROPOSING:
+            self.__check_responses(offer)
+
+    def __arm_deadline(self, offer: Offer):
+        deadline = self.response_deadline()
+        if deadline is None:
+            return
+        offer.deadline = self.timers.schedule(
+            deadline, self.__deadline_expired, offer)
+
+    def __disarm_deadline(self, offer: Offer):
+        if offer.deadline:
+            offer.deadline.cancel()
+            offer.deadline = None
+
+    def __deadline_expired(self, offer: Offer):
+        """
+        Leader did not hear from every cohort in time. Resolve the round
+        according to <on_missing> instead of waiting forever.
+        """
+        with self.__lock:
+            # already resolved or superseded
+            if (offer.state != Offer.State.PROPOSING or
+                not self.__has_offer(offer) or
+                self.__get_offer(offer) is not offer):
+                return
+
+            offer.deadline = None
+            self.events("deadline", offer)
+            self.__resolve_missing(offer, self.__pending(offer))
+        self.__deliver()
+
+    def __arm_expiry(self, offer: Offer):
+        """
+        Cohort answered <offer>; give up on it if its outcome never arrives
+        """
+        if self.OFFER_TTL is not None:
+            offer.deadline = self.timers.schedule(
+                self.OFFER_TTL, self.__offer_expired, offer)
+
+    def __offer_expired(self, offer: Offer):
+        """
+        Cohort did not hear the outcome of <offer> within OFFER_TTL of
+        answering it. Forget it, so that it stops counting as in flight, and
+        REJECT it so that a leader still collecting responses aborts it. If
+        the leader committed it already, catching up commits it here too.
+        """
+        with self.__lock:
+            if (self.__offers.get(hash(offer)) is not offer or
+                offer.state not in Trader.IN_FLIGHT):
+                return
+            offer.deadline = None
+            self.events("expired", offer)
+            self.__end_aggregate(offer)
+            self.__pop_offer(offer)
+            offer.abort()
+            reject = Message(self.get_own_pid(), Message.Type.REJECT, offer.chain)
+            reject.sign(self.get_own_pid())
+            self.send_to_pid(offer.chain.owner, reject)
+            self.__aborted(offer.chain)
+        self.__deliver()
+        self.catch_up(offer.chain.owner)
+
+    def __resolve_missing(self, offer: Offer, missing):
+        self.__disarm_deadline(offer)
+        offer.missing = missing
+        self.events("missing", missing, offer)
+
+        if self.on_missing == Trader.Missing.ABORT:
+            self.__abort(offer, OfferAborted.DEADLINE)
+        elif self.on_missing == Trader.Missing.COUNTER:
+            offer.state = Offer.State.DECIDING
+            self.__respond(offer)
+        else: # Trader.Missing.EXCLUDE
+            self.__responses_received(offer)
+
+    def __abort(self, offer: Offer, reason):
+        self.events("abort", reason, offer)
+        self.__disarm_deadline(offer)
+        offer.abort()
         message = offer.get_message(self.get_own_pid())
         message.sign(self.get_own_pid())
 
         self.__broadcast(message)
-    
+
+        self.__pop_offer(offer)
+        self.__aborted(offer.chain)
+        future = self.__futures.pop(hash(offer), None)
+        if future:
+            self.__later(future.set_exception, OfferAborted(offer.chain, reason))
+
     def __commit(self, offer: Offer):
-        log.debug("Committing offer %s", str(offer))
+        self.events("commit", offer)
         offer.commit()
+        seq = None
+        if self.__logged(offer.chain):
+            seq = self.commit_log.commit(offer.chain, wait=False)
         message = offer.get_message(self.get_own_pid())
         message.sign(self.get_own_pid())
 
-        self.__broadcast(message)
+        if seq is not None and self.__log(seq):
+            # the decision is durable before any peer applies it
+            self.__later(self.__broadcast, message, after=seq)
+        else:
+            self.__broadcast(message)
 
         offer.committed()
 
-        self.committed(offer.chain)
+        self.__committed(offer.chain, seq)
 
     def __ok(self, offer:Offer):
         offer.ok(self.get_own_pid(), self.get_own_pid())
+        self.__arm_expiry(offer)
+        if self.__aggregating():
+            # merged with our subtree's OKs on the way to the leader
+            return self.__aggregated(offer, self.get_own_pid(),
+                                     { self.get_own_pid(): self.get_own_pid() })
+
         message = offer.get_message(self.get_own_pid())
         message.sign(self.get_own_pid())
 
@@ -144,16 +610,214 @@ class Trader(ABC):
         pass
 
     def __responses_received(self, offer: Offer):
+        self.__disarm_deadline(offer)
         if len(offer.counters) == 0:
             self.__commit(offer)
         
         else:
             offer.state = Offer.State.DECIDING
-            self.respond(offer)
+            self.__respond(offer)
     
-    def __all_responded(self, offer: Offer):
-        return (set(offer.respondants() + [self.get_own_pid()]) ==
-                set(self.get_participants()))
+    def __pending(self, offer: Offer):
+        # participants of the epoch the offer was proposed in that are still
+        # participating and have not responded
+        responded = set(offer.respondants() + [self.get_own_pid()])
+        current = set(self.get_participants())
+        return [p for p in self.get_participants(offer.epoch)
+                if p in current and p not in responded]
+
+    def __respond(self, offer: Offer, base: Chain = None):
+        if self.is_internal(offer.chain):
+            self.respond_internal(offer)
+        elif (self.rules is not None and offer.state == Offer.State.RECEIVED and
+              not self.rules.validate(offer.chain, base)):
+            # illegal actions never reach the application
+            self.events("invalid", offer)
+            self.reject(offer.chain)
+        elif self.policies is None or not self.__apply_policy(offer):
+            self.__later(self.respond, offer)
+
+    def __apply_policy(self, offer: Offer) -> bool:
+        """
+        Respond as the first applicable policy decides; False if deferred
+        """
+        name, verdict = self.policies.decide(offer)
+        self.events("policy", name, verdict.decision, offer)
+        if verdict.decision == Decision.ACCEPT:
+            if offer.state == Offer.State.RECEIVED:
+                self.accept(offer)
+            elif verdict.counter in offer.counters:
+                self.accept(offer.counters[verdict.counter])
+            else:
+                # a leader accepts one of the counters, named by pid
+                log.warning("policy %s accepted no counter of %s (counter=%s); deferred",
+                            name, offer, verdict.counter)
+                return False
+        elif verdict.decision == Decision.REJECT:
+            self.reject(offer.chain)
+        elif verdict.decision == Decision.COUNTER:
+            self.reject(offer.chain, offer.chain.counter(list(verdict.suffix)))
+        else:
+            return False
+        return True
+
+    def __committed(self, chain: Chain, seq=None, synced=False):
+        """
+        <seq>: CommitLog record of <chain> if the caller logged it already
+        <synced>: learnt through catch-up rather than a round
+        """
+        durable = 0
+        if self.is_internal(chain):
+            self.committed_internal(chain)
+        else:
+            if self.commit_log is not None and seq is None:
+                seq = self.commit_log.commit(chain, wait=False)
+            if seq is not None:
+                # durable before the application acts on it
+                durable = self.__log(seq)
+            if self.history is not None:
+                self.history.append(chain)
+            self.ledger.append(chain)
+            if not synced:
+                # not to be committed again when a catch-up batch has it
+                for verifier in self.__catch_ups.values():
+                    verifier.committed(chain.digest())
+            if self.materializer is not None:
+                self.materializer.commit(chain)
+            self.__later(self.committed, chain, after=durable)
+            if self.snapshots is not None and seq is not None:
+                # of the state committed() left
+                self.__later(self.snapshots.committed, seq, chain, after=durable)
+            if self.speculator is not None:
+                # speculation was against the previous state; chains not
+                # evaluated yet are not queued again (see Speculator.submit)
+                for offer in self.__offers.values():
+                    if (offer.state in (Offer.State.RECEIVED, Offer.State.OKED)
+                            and not self.is_internal(offer.chain)):
+                        self.speculator.submit(offer.chain)
+
+        future = self.__futures.pop(hash(chain), None)
+        if future:
+            self.__later(future.set_result, chain, after=durable)
+
+    def __aborted(self, chain: Chain):
+        if not self.is_internal(chain):
+            if self.commit_log is not None:
+                self.__log(self.commit_log.tombstone(chain.digest(), wait=False))
+            if self.speculator is not None:
+                self.speculator.discard(chain)
+            self.__later(self.aborted, chain)
+        else:
+            self.aborted_internal(chain)
+
+    def __synced(self, chain: Chain):
+        """
+        Commit <chain> learnt from a peer instead of through our own round
+        """
+        offer = self.__offers.get(hash(chain))
+        if offer is not None and offer.state in Trader.IN_FLIGHT:
+            # we missed its COMMIT; one still on its way is stale
+            self.__end_aggregate(chain)
+            self.__pop_offer(chain)
+            self.__ended.add(offer.round)
+        self.__committed(chain, synced=True)
+
+    def __log(self, seq) -> int:
+        """
+        CommitLog record <seq> was appended without waiting; with
+        Durability.GROUP it is fsynced by __deliver(). Returns the seq that
+        effects of the record wait for, 0 if none
+        """
+        if self.commit_log.durability != CommitLog.Durability.GROUP:
+            return 0
+        self.__unsynced = max(self.__unsynced, seq)
+        return seq
+
+    def __later(self, effect, *args, after=0):
+        """
+        Run <effect> once the lock is released and CommitLog record <after>
+        is durable, in the order queued. Application callbacks go through
+        here, so that they neither run under the lock nor overtake each other
+        """
+        self.__outbox.append((after, effect, args))
+
+    def __deliver(self):
+        """
+        Called after releasing the lock: fsync the records logged under it,
+        then run the effects waiting for them
+        """
+        if self.timers.in_callback():
+            return self.__hand_off()
+        with self.__lock:
+            seq, self.__unsynced = self.__unsynced, 0
+        if seq:
+            self.commit_log.sync(seq)
+        # a thread already delivering runs ours as well; waiting for it could
+        # deadlock, as an outer frame of ours may hold the lock it needs
+        while self.__delivering.acquire(blocking=False):
+            try:
+                while True:
+                    ready = self.__next_ready()
+                    if ready is None:
+                        break
+                    effect, args = ready
+                    effect(*args)
+            finally:
+                self.__delivering.release()
+            # queued while we were finishing up
+            with self.__lock:
+                if not self.__ready():
+                    return
+
+    def __hand_off(self):
+        """
+        __deliver() on a worker instead of the shared timer thread, which
+        deadlines, expiry and the failure detector run on: application
+        callbacks may block (Peer.respond() waits for input), and so may the
+        fsync, holding up every timer
+        """
+        with self.__lock:
+            self.__handed_off = True
+            if self.__deliverer is not None:
+                return # picked up by its next pass
+            self.__deliverer = Thread(target=self.__deliver_handed_off, daemon=True)
+            self.__deliverer.start()
+
+    def __deliver_handed_off(self):
+        while True:
+            with self.__lock:
+                if not self.__handed_off:
+                    self.__deliverer = None
+                    return
+                self.__handed_off = False
+            self.__deliver()
+
+    def __next_ready(self):
+        with self.__lock:
+            if not self.__ready():
+                return None
+            _, effect, args = self.__outbox.popleft()
+            return effect, args
+
+    def __ready(self) -> bool:
+        # the thread that logged a record not durable yet runs its effects
+        # once it synced it
+        durable = self.commit_log.durable_seq if self.commit_log is not None else 0
+        return bool(self.__outbox) and self.__outbox[0][0] <= durable
+
+    def __logged(self, chain: Chain):
+        # membership and other internal chains are not logged
+        return self.commit_log is not None and not self.is_internal(chain)
+
+    def __check_responses(self, offer: Offer):
+        """
+        Resolve the round once every participant that is not suspected responded
+        """
+        pending = self.__pending(offer)
+        if not pending:
+            self.__responses_received(offer)
+        elif self.suspected.issuperset(pending):
+            self.__resolve_missing(offer, pending)
     
     def __recv(self, message: Message):
         """
@@ -177,56 +841,208 @@ class Trader(ABC):
         2. if COMMIT:
             2.1. confirm OKs and validate signatures
                 (if good, commit, else reject)
+
+        3. if ABORT:
+            3.1. drop offer and notify with aborted()
         
         """
+        with self.__lock:
+            self.__handle(message)
+        self.__deliver()
+
+    def __handle(self, message: Message):
+        self.events("recv", message)
+
+        if self.fanout and message.type in Trader.RELAYED:
+            if not self.__first_time(message):
+                return
+            # PROPOSE is relayed once we are ready to aggregate responses
+            if message.type != Message.Type.PROPOSE:
+                self.__relay(message)
+
         # leader
         # -------------------------------------
         if message.type == Message.Type.OK:
-            offer = self.__get_offer(message.chain)
+            offer = self.__get_proposing(message.chain)
+            if not offer:
+                return
             offer.add_ok(message.sender, message.signed)
-            if self.__all_responded(offer):
-                self.__responses_received(offer)
+            self.__check_responses(offer)
 
         elif message.type == Message.Type.COUNTER:
-            offer = self.__get_offer(message.chain.prev)
+            offer = self.__get_proposing(message.chain.prev)
+            if not offer:
+                return
             offer.add_counter(message.sender, message.chain)
-            if self.__all_responded(offer):
-                self.__responses_received(offer)
+            self.__check_responses(offer)
+
+        elif message.type == Message.Type.REJECT:
+            offer = self.__get_proposing(message.chain)
+            if not offer:
+                return
+            self.events("refused", message.sender, offer)
+            self.__abort(offer, OfferAborted.REFUSED)
+
+        elif message.type == Message.Type.AGGREGATE:
+            if message.chain.owner != self.get_own_pid():
+                # from a child; merge and pass up
+                offer = self.__offers.get(hash(message.chain))
+                if offer:
+                    self.__aggregated(offer, message.sender, message.signed)
+                return
+
+            offer = self.__get_proposing(message.chain)
+            if not offer:
+                return
+            for pid, signature in message.signed.items():
+                offer.add_ok(pid, signature)
+            self.__check_responses(offer)
         # -------------------------------------
 
         # cohort
         # -------------------------------------
         elif message.type == Message.Type.PROPOSE:
+            # COMMIT and ABORT overtake PROPOSE under load; drop a PROPOSE
+            # whose round already ended. The leader decided it already, so
+            # it is not waiting on us
+            if self.__round_of(message) in self.__ended:
+                self.__ended.discard(self.__round_of(message))
+                return
+            if not self.__within_limits(message):
+                return
+
             # if prev in offers (leader accepted counter)
-            if message.chain.prev and self.__has_offer(message.chain.prev):
+            superseded = None
+            if self.__countered(message.chain) is not None:
                 # remove
-                self.__pop_offer(message.chain.prev)
+                superseded = self.__pop_offer(message.chain.prev)
+                self.__end_aggregate(message.chain.prev)
+                if self.__logged(superseded.chain):
+                    self.__log(self.commit_log.tombstone(superseded.chain.digest(), wait=False))
 
             offer = Offer().receive(message.chain)
+            offer.epoch = message.epoch
+            offer.round = message.round
             self.__add_offer(offer)
-            self.respond(offer)
+            self.__in_flight.setdefault(offer.chain.owner, set()).add(hash(offer))
+            if self.speculator is not None and not self.is_internal(offer.chain):
+                # a counter only appends to the chain it supersedes, whose
+                # state is the base it is evaluated from
+                self.speculator.submit(offer.chain, superseded and superseded.chain)
+            if self.__aggregating():
+                self.__start_aggregate(offer)
+            if self.fanout:
+                # relay before responding, which may wait on the application
+                self.__relay(message)
+            self.__respond(offer, superseded and superseded.chain)
         
         elif message.type == Message.Type.COMMIT:
-            # TODO: validate signatures
-            offer = self.__get_offer(message.chain)
+            offer = self.__offers.get(hash(message.chain))
+            if (offer is None or offer.state not in Trader.IN_FLIGHT or
+                    offer.round != message.round):
+                round = self.__round_of(message)
+                if round in self.__ended or message.chain.owner == self.get_own_pid():
+                    # already caught up with it
+                    return
+                # missed the PROPOSE: nothing we agreed to vouches for the
+                # chain, so it is only learnt from its leader's ledger
+                self.__ended.add(round)
+                if message.chain.owner not in self.__catch_ups:
+                    self.catch_up(message.chain.owner)
+                return
+            self.__end_aggregate(offer)
+            self.__disarm_deadline(offer)
+            self.__settled(offer)
             offer.committed()
-            self.committed(offer.chain)
+            self.__committed(offer.chain)
+
+        elif message.type == Message.Type.ABORT:
+            self.__end_aggregate(message.chain)
+            offer = self.__offers.get(hash(message.chain))
+            if (offer is not None and offer.state in Trader.IN_FLIGHT and
+                    offer.round == message.round):
+                self.__pop_offer(offer)
+                offer.abort()
+                self.__aborted(offer.chain)
+            elif message.chain.owner != self.get_own_pid():
+                self.__ended.add(self.__round_of(message))
+        # -------------------------------------
+
+        # catch-up
+        # -------------------------------------
+        elif message.type == Message.Type.SUMMARY:
+            start = self.ledger.common(message.signed)
+            for batch in self.ledger.batches(start):
+                batch = Message(self.get_own_pid(), Message.Type.BATCH, None, batch)
+                self.send_to_pid(message.sender, batch)
+            if message.signed[0][0] > len(self.ledger):
+                # the sender is ahead of us
+                self.catch_up(message.sender)
+
+        elif message.type == Message.Type.BATCH:
+            verifier = self.__catch_ups.get(message.sender)
+            if verifier is None:
+                # not an answer to any SUMMARY of ours
+                return
+            first, chains, done, digest = message.signed
+            starting = verifier.next is None
+            if not verifier.verify(first, chains, digest):
+                log.warning("pid %s: BATCH at %s does not extend our SUMMARY; catch-up dropped",
+                            message.sender, first)
+                del self.__catch_ups[message.sender]
+                return
+            if starting:
+                verifier.start(self.ledger, first)
+            for chain in verifier.missing(chains):
+                self.__synced(chain)
+            if done:
+                del self.__catch_ups[message.sender]
+                self.events("synced", message.sender, len(self.ledger))
         # -------------------------------------
 
     # ===============================
     # mechanisms to lookup using offers and chains
     # ----------------
-    def __has_offer(self, lookup: Offer | Chain) -> bool:
-        return hash(lookup) in self.__offers
+    def __key(self, lookup: Offer | Chain | int) -> int:
+        # chains refer to the chain they counter by its hash (Chain.prev);
+        # hash() of a large int is not the int itself
+        return lookup if isinstance(lookup, int) else hash(lookup)
+
+    def __has_offer(self, lookup: Offer | Chain | int) -> bool:
+        return self.__key(lookup) in self.__offers
 
     def __add_offer(self, offer: Offer):
         self.__offers[hash(offer)] = offer
     
-    def __get_offer(self, lookup: Offer | Chain):
-        return self.__offers[hash(lookup)]
+    def __get_offer(self, lookup: Offer | Chain | int):
+        return self.__offers[self.__key(lookup)]
     
-    def __pop_offer(self, lookup: Offer | Chain):
-        return self.__offers.pop(hash(lookup))
+    def __pop_offer(self, lookup: Offer | Chain | int):
+        offer = self.__offers.pop(self.__key(lookup))
+        self.__disarm_deadline(offer)
+        self.__settled(offer)
+        return offer
+
+    def __settled(self, offer: Offer):
+        """
+        <offer> no longer counts as in flight for its leader
+        """
+        keys = self.__in_flight.get(offer.chain.owner)
+        if keys is not None:
+            keys.discard(hash(offer))
+            if not keys:
+                del self.__in_flight[offer.chain.owner]
+
+    def __get_proposing(self, lookup: Offer | Chain | int):
+        """
+        Leader's offer still awaiting responses, None for late responses
+        (e.g. after the deadline resolved the round)
+        """
+        offer = self.__offers.get(self.__key(lookup))
+        if offer is None or offer.state != Offer.State.PROPOSING:
+            self.events("late response", lookup)
+            return None
+        return offer
     # ===============================
     
 
@@ -1,5 +1,26 @@
 # exports for module
+#
+# The protocol core (Offer, Trader, deCoordinated) only depends on the
+# standard library and is imported eagerly. Network backends pull in their
+# transport dependencies and are imported lazily on first attribute access,
+# e.g. `ruban.Peer` imports p2pnetwork only when it is used.
+import importlib
+
 import ruban.Offer
-import ruban.deCoordinated
+import ruban.EventLog
 import ruban.Trader
-import ruban.Peer
+import ruban.deCoordinated
+
+# backend name --> module implementing it
+BACKENDS = {
+    "Peer": "ruban.Peer",
+    "SelectorPeer": "ruban.SelectorPeer",
+}
+
+def __getattr__(name):
+    if name in BACKENDS:
+        return importlib.import_module(BACKENDS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(BACKENDS))
@@ -1,12 +1,17 @@
 from ruban.Trader import Trader
+from ruban.Offer import Offer, Message as ProtocolMessage
+from ruban.Heartbeat import Heartbeat
+from ruban.Session import Session
+from ruban import Lanes
+from ruban.Limits import Limiter
+from ruban import Membership
 from abc import ABC, abstractmethod
-from threading import Thread, Event, Lock
-from time import sleep
+from threading import Thread, Event, Lock, Condition, local
+from time import sleep, monotonic
 import pickle
 import logging
 from enum import Enum
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 # ┌────────┐    ┌────────┐
@@ -44,6 +49,7 @@ class deCoordinated(Trader, ABC):
         AWAITING_CONNECTIONS = 6    # guests waiting for lower PIDs to connect to them
         CONNECTING = 7              # all lower PIDs connected, connecting to higer PIDs
         READY = 8                   # connected to all guests and have open channels
+        GOSSIPING = 9               # hostless: learning peers and connecting to them
 
     # constants
     HOST_PID = 0
@@ -54,6 +60,41 @@ class deCoordinated(Trader, ABC):
         RES_PARTICIPANTS = "Response Participants"
         ACK_PARTICIPANTS = "Received Participants"
         BEGIN_CONNECT_SEQ = "Begin Connection Sequence"
+        PING = "Ping"
+        PONG = "Pong"
+        RESUME = "Resume Session"
+        RESUME_ACK = "Resumed Session"
+        JOIN_REQUEST = "Request Join"
+        WELCOME = "Welcome"
+        GOSSIP = "Gossip Peers"
+        CREDIT = "Credit"
+        DROPPED = "Dropped"
+        JOIN_REFUSED = "Join Refused"
+
+    # seconds between heartbeats once READY; None disables the failure detector
+    HEARTBEAT_INTERVAL = Heartbeat.INTERVAL
+    # a dropped pid is suspected if not reconnected within this many seconds
+    RECONNECT_GRACE = 1.0
+    # reconnect backoff after a dropped connection, in seconds
+    RECONNECT_INTERVAL = 0.05
+    RECONNECT_MAX_INTERVAL = 2.0
+    RECONNECT_TIMEOUT = 60.0
+    # participant sets of past epochs kept for get_participants(epoch)
+    EPOCH_HISTORY = 16
+    # lazy connections: seconds without protocol traffic before closing one
+    IDLE_TIMEOUT = 30.0
+    # flow control per pid: messages in flight, and queued before new offers
+    # are throttled; see ruban.Session
+    SEND_WINDOW = Session.WINDOW
+    SEND_QUEUE_LIMIT = Session.QUEUE_LIMIT
+    # seconds before acknowledging messages that did not fill half a window;
+    # acks also ride on PING/PONG, but must not depend on the heartbeat
+    ACK_DELAY = 0.2
+    # flood protection per pid, see ruban.Limits: PROPOSEs per second, burst,
+    # and largest encoded PROPOSE
+    PROPOSE_RATE = Limiter.RATE
+    PROPOSE_BURST = Limiter.BURST
+    MAX_PROPOSE_SIZE = Limiter.MAX_SIZE
 
     # ----------------------------------------
     # must implement these methods
@@ -76,25 +117,656 @@ class deCoordinated(Trader, ABC):
     @abstractmethod
     def send(recipient, message):
         pass
+
+    # optional: close a connection to a participant that left
+    def disconnect(self, connection):
+        pass
     # ----------------------------------------
 
     # ========================
     # for Trader
     # -----------------
     def send_to_pid(self, pid, message):
-        log.debug(f"sending message to {pid}")
-        participant = self.participants[pid]
-        self.__send__(participant, message)
+        log.debug("sending message to %s", pid)
+        # coordinated messages are not sequenced
+        if isinstance(message, dict):
+            connection = self.__route__(pid)
+            if connection is None:
+                if not self.lazy:
+                    log.error("Trying to send message to pid with no open connection: %s", pid)
+                return
+            self.send(connection, pickle.dumps(message).hex())
+            return
+
+        # protocol messages are sequenced and buffered until acked, so they
+        # can be replayed if the connection drops (see ruban.Session)
+        session = self.__session__(pid)
+        with session.lock:
+            if not session.enqueue(Lanes.lane_of(message), message):
+                if pid in self.suspected:
+                    # it catches up once back; see ruban.Sync
+                    return None
+                log.warning("send queue for pid %s is full; refusing %s", pid, message)
+                return False
+            if pid in self.suspected:
+                session.shed()
+
+            connection = self.__route__(pid)
+            if session.live and connection is not None:
+                for data in session.sendable(self.__encode__):
+                    self.send(connection, data)
+
+        if self.lazy:
+            self.last_used[pid] = monotonic()
+            if connection is None and self.is_ready():
+                # replayed by the resume handshake once connected
+                self.__open__(pid)
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Block until no send queue to a pid that is not suspected is congested.
+        Does not block while handling a message (e.g. offer() from
+        committed() or respond()): the credit it would wait for is handled
+        by the same thread.
+        """
+        if getattr(self.receiving, "active", False):
+            return self.__uncongested__()
+        with self.drained:
+            return self.drained.wait_for(self.__uncongested__, timeout)
+
+    def __uncongested__(self):
+        return not any(session.congested() for pid, session in list(self.sessions.items())
+                       if pid not in self.suspected)
+
+    def __drain__(self, pid):
+        """
+        Send what the credit granted by <pid> allows
+        """
+        session = self.__session__(pid)
+        with session.lock:
+            connection = self.__route__(pid)
+            if session.live and connection is not None:
+                for data in session.sendable(self.__encode__):
+                    self.send(connection, data)
+        with self.drained:
+            self.drained.notify_all()
+
+    @staticmethod
+    def __encode__(lane, seq, message):
+        # lane and seq are readable before decoding, so that backends can
+        # prioritize and the receiver can drop a message it will not process
+        return Lanes.tag(lane, f"{seq}:{pickle.dumps(message).hex()}")
+
+    def get_participants(self, epoch=None):
+        if epoch is None or epoch == self.epoch:
+            return list(self.pids.values())
+        return list(self.epochs.get(epoch, ()))
+
+    def get_epoch(self):
+        return self.epoch
+
+    def is_internal(self, chain):
+        return Membership.is_membership(chain)
+
+    def respond_internal(self, offer):
+        """
+        Accept membership changes that are consistent with our view
+        """
+        if offer.state == Offer.State.DECIDING:
+            # countered or missing responses; try again later
+            self.reject(offer.chain)
+            return
+
+        try:
+            changes = Membership.parse(offer.chain)
+        except ValueError as e:
+            log.warning("refusing membership change from pid %s: %s", offer.chain.owner, e)
+            self.reject(offer.chain)
+            return
+
+        next_pid = len(self.participants)
+        for op, pid, conn_info in changes:
+            if op == Membership.JOIN:
+                if pid != next_pid or conn_info in self.pids:
+                    log.info("refusing join of %s as pid %s", conn_info, pid)
+                    self.reject(offer.chain)
+                    return
+                next_pid += 1
+            elif pid not in self.get_participants():
+                log.info("refusing leave of unknown pid %s", pid)
+                self.reject(offer.chain)
+                return
+            elif pid != offer.chain.owner and pid not in self.suspected:
+                # only a pid itself, or peers that agree it failed, remove it
+                log.info("refusing leave of pid %s proposed by pid %s", pid, offer.chain.owner)
+                self.reject(offer.chain)
+                return
+        self.accept(offer)
 
-    def get_participants(self):
-        return list(self.pids.values())
+    def committed_internal(self, chain):
+        try:
+            changes = Membership.parse(chain)
+        except ValueError as e:
+            log.error("ignoring committed membership change: %s", e)
+            return
+        for op, pid, conn_info in changes:
+            if op == Membership.JOIN:
+                self.__apply_join__(pid, conn_info, sponsor=chain.owner)
+            else:
+                self.__apply_leave__(pid)
+
+    def aborted_internal(self, chain):
+        if chain.owner != self.own_pid:
+            return
+        try:
+            changes = Membership.parse(chain)
+        except ValueError:
+            return
+        # tell the peers we sponsored that they were refused
+        for op, pid, conn_info in changes:
+            if op != Membership.JOIN:
+                continue
+            with self.connections_lock:
+                connection = self.joining.pop(conn_info, None)
+            if connection is not None:
+                log.info("join of %s as pid %s was refused", conn_info, pid)
+                self.send(connection, pickle.dumps({
+                    deCoordinated.Message.TYPE_KEY: deCoordinated.Message.JOIN_REFUSED,
+                }).hex())
 
     def get_own_pid(self):
         return self.own_pid
+
+    def response_deadline(self):
+        # leave room for the slowest measured round trip
+        deadline = super().response_deadline()
+        rto = self.rto()
+        if deadline is None or rto is None:
+            return deadline
+        return deadline + rto
     # ========================
 
+    def rto(self, pid=None):
+        """
+        Measured retransmission timeout to <pid>, or the largest over all pids
+        """
+        return self.heartbeat.rto(pid)
+
+    def connection_lost(self, connection):
+        """
+        To be called by implementations when a connection drops
+        """
+        pid = getattr(connection, "pid", None)
+        log.info("lost connection to pid %s: %s", pid, connection)
+        if pid is None:
+            return
+
+        with self.connections_lock:
+            if self.__route__(pid) is not connection:
+                return # already replaced by a new connection
+            routes = list(self.routes)
+            routes[pid] = None
+            self.routes = routes
+            self.__session__(pid).live = False
+
+        if not self.is_ready():
+            self.heartbeat.suspect(pid)
+            return
+
+        if self.lazy:
+            # idle connections are closed on purpose (see __evict_idle__);
+            # only dial again if something was not acknowledged yet
+            self.heartbeat.forget(pid)
+            if self.__session__(pid).unacked:
+                self.timers.schedule(self.RECONNECT_GRACE, self.__check_reconnected__, pid)
+                self.__open__(pid)
+            return
+
+        # the side that dialed originally dials again; only suspect the pid
+        # if the session is not resumed in time
+        self.timers.schedule(self.RECONNECT_GRACE, self.__check_reconnected__, pid)
+        if self.__dials__(pid):
+            Thread(target=self.__reconnect__, args=(pid,), daemon=True).start()
+
+    def __check_reconnected__(self, pid):
+        if self.__route__(pid) is None:
+            self.heartbeat.suspect(pid)
+
+    def __route__(self, pid):
+        # lock-free: <routes> is only ever replaced, never mutated
+        try:
+            return self.routes[pid]
+        except IndexError:
+            return None
+
+    def __session__(self, pid) -> Session:
+        session = self.sessions.get(pid)
+        if session is None:
+            session = self.sessions.setdefault(pid, Session(
+                pid, window=self.SEND_WINDOW, queue_limit=self.SEND_QUEUE_LIMIT))
+        return session
+
+    def __dials__(self, pid):
+        if self.hostless:
+            return self.own_pid < pid
+        # guests dial the host and guests with higher pids
+        if self.own_pid == deCoordinated.HOST_PID:
+            return False
+        return pid == deCoordinated.HOST_PID or self.own_pid < pid
+
+    def __reconnect__(self, pid):
+        conn_info = self.participants[pid]
+        interval = deCoordinated.RECONNECT_INTERVAL
+        deadline = monotonic() + deCoordinated.RECONNECT_TIMEOUT
+        while monotonic() < deadline:
+            if self.__route__(pid) is not None:
+                return
+            connection = self.connect(conn_info)
+            if connection:
+                self.__add_connection__(conn_info, connection)
+                log.info("reconnected to pid %s", pid)
+                self.send_to_pid(pid, {
+                    deCoordinated.Message.TYPE_KEY: deCoordinated.Message.RESUME,
+                    "received": self.__session__(pid).received,
+                })
+                return
+            sleep(interval)
+            interval = min(interval * 2, deCoordinated.RECONNECT_MAX_INTERVAL)
+        log.error("could not reconnect to pid %s", pid)
+
+    def __open__(self, pid):
+        """
+        Lazy connections: connect to <pid> in the background
+        """
+        with self.connections_lock:
+            if pid in self.opening:
+                return
+            self.opening.add(pid)
+        Thread(target=self.__open_connection__, args=(pid,), daemon=True).start()
+
+    def __open_connection__(self, pid):
+        try:
+            # a first connection resumes an empty session
+            self.__reconnect__(pid)
+        finally:
+            with self.connections_lock:
+                self.opening.discard(pid)
+
+    def __evict_idle__(self):
+        """
+        Lazy connections: close connections idle for IDLE_TIMEOUT seconds
+        """
+        now = monotonic()
+        for pid in self.__connected_pids__():
+            last_used = self.last_used.setdefault(pid, now)
+            if now - last_used < self.IDLE_TIMEOUT:
+                continue
+            with self.connections_lock:
+                connection = self.__route__(pid)
+                if connection is None:
+                    continue
+                routes = list(self.routes)
+                routes[pid] = None
+                self.routes = routes
+            self.last_used.pop(pid, None)
+            self.heartbeat.forget(pid)
+            log.debug("closing idle connection to pid %s", pid)
+            self.disconnect(connection)
+
+        if self.evictor is not None:
+            self.evictor = self.timers.schedule(self.IDLE_TIMEOUT / 2, self.__evict_idle__)
+
+    def stop_timers(self):
+        """
+        To be called by implementations when they stop
+        """
+        self.heartbeat.stop()
+        if self.evictor is not None:
+            self.evictor.cancel()
+            self.evictor = None
+
+    def __resume__(self, pid, received, reply):
+        """
+        Resume handshake: <pid> received everything up to <received>;
+        replay the rest on the new connection
+        """
+        session = self.__session__(pid)
+        session.ack(received)
+        if reply:
+            self.send_to_pid(pid, {
+                deCoordinated.Message.TYPE_KEY: deCoordinated.Message.RESUME_ACK,
+                "received": session.received,
+            })
+
+        with session.lock:
+            connection = self.__route__(pid)
+            if connection is None:
+                return
+            replay = session.replay(received)
+            for data in replay:
+                self.send(connection, data)
+            session.live = True
+        self.__drain__(pid)
+        log.info("resumed session with pid %s, replayed %s messages", pid, len(replay))
+
+    # =====================================
+    # membership
+    # -------------------------
+    def join(self, sponsor_conn_info):
+        """
+        Join a running session through any of its participants
+        """
+        self.deCoord_thread = Thread(target=self.__setup_joiner__, args=(sponsor_conn_info,))
+        self.deCoord_thread.start()
+
+    def leave(self):
+        """
+        Propose our own removal from the session
+        """
+        return self.offer(Membership.leave_chain(self.own_pid, self.own_pid))
+
+    def remove(self, pid):
+        """
+        Propose removing <pid> after it is suspected to have failed; only
+        participants that suspect it as well accept. Returns the offer's Future.
+        """
+        return self.offer(Membership.leave_chain(self.own_pid, pid))
+
+    def __new_epoch__(self):
+        # must hold connections_lock
+        self.epochs[self.epoch] = tuple(self.pids.values())
+        self.epochs.pop(self.epoch - deCoordinated.EPOCH_HISTORY, None)
+        self.epoch += 1
+
+    def __apply_join__(self, pid, conn_info, sponsor):
+        with self.connections_lock:
+            if conn_info in self.pids:
+                return
+            self.__new_epoch__()
+            self.pids[conn_info] = pid
+            self.participants.extend([None] * (pid + 1 - len(self.participants)))
+            self.participants[pid] = conn_info
+            connection = self.joining.pop(conn_info, None)
+        log.info("pid %s joined (epoch %s): %s", pid, self.epoch, conn_info)
+
+        if connection is not None:
+            self.__add_connection__(conn_info, connection)
+
+        if sponsor == self.own_pid:
+            with self.connections_lock:
+                message = {
+                    deCoordinated.Message.TYPE_KEY: deCoordinated.Message.WELCOME,
+                    "own_pid": pid,
+                    "participants": self.participants,
+                    "pids": self.pids,
+                    "epoch": self.epoch,
+                }
+            self.send_to_pid(pid, message)
+
+    def __apply_leave__(self, pid):
+        with self.connections_lock:
+            conn_info = self.participants[pid]
+            if conn_info not in self.pids:
+                return
+            self.__new_epoch__()
+            del self.pids[conn_info]
+            self.participants[pid] = None
+            connection = self.connections.pop(conn_info, None)
+            if self.__route__(pid) is not None:
+                routes = list(self.routes)
+                routes[pid] = None
+                self.routes = routes
+        log.info("pid %s left (epoch %s)", pid, self.epoch)
+
+        if pid == self.own_pid:
+            # others close their connections to us
+            self.stop_timers()
+            self.__update_state__(deCoordinated.State.NOT_CONFIGURED)
+        elif connection is not None:
+            self.disconnect(connection)
+
+    def __on_member_connection__(self, connected_node):
+        participant = self.get_conn_info(connected_node)
+        with self.connections_lock:
+            known = participant in self.pids
+            if not known:
+                # may be joining; bound once its join commits
+                self.joining[participant] = connected_node
+        if known:
+            self.__add_connection__(participant, connected_node)
+
+    def __on_unbound_message__(self, sender, message):
+        """
+        Message on a connection that is not bound to a participant
+        """
+        if not isinstance(message, dict):
+            log.error("could not find pid of sender %s", sender)
+            return
+
+        message_type = message.get(deCoordinated.Message.TYPE_KEY)
+        if message_type == deCoordinated.Message.JOIN_REQUEST and self.is_ready():
+            conn_info = message["conn_info"]
+            with self.connections_lock:
+                self.joining[conn_info] = sender
+                pid = len(self.participants)
+            log.info("sponsoring join of %s as pid %s", conn_info, pid)
+            self.offer(Membership.join_chain(self.own_pid, pid, conn_info))
+
+        elif message_type == deCoordinated.Message.WELCOME:
+            with self.connections_lock:
+                self.own_pid = message["own_pid"]
+                self.participants = message["participants"]
+                self.pids = message["pids"]
+                self.epoch = message["epoch"]
+                for participant, connection in self.connections.items():
+                    self.__bind__(self.pids[participant], connection)
+            self.participants_filled.set()
+
+        elif message_type == deCoordinated.Message.JOIN_REFUSED:
+            self.join_refused = True
+            self.participants_filled.set()
+
+        elif message_type == deCoordinated.Message.GOSSIP and not self.is_ready():
+            self.__learn__(message["known"], sender)
+
+    def __setup_joiner__(self, sponsor_conn_info):
+        self.participants_filled = Event()
+        self.join_refused = False
+        self.listen_for_connections(self.__on_member_connection__)
+
+        log.info("Connecting to sponsor")
+        while True:
+            sponsor = self.connect(sponsor_conn_info)
+            if sponsor:
+                break
+            sleep(2)
+            log.info("Trying again...")
+
+        with self.connections_lock:
+            self.connections[sponsor_conn_info] = sponsor
+        self.send(sponsor, pickle.dumps({
+            deCoordinated.Message.TYPE_KEY: deCoordinated.Message.JOIN_REQUEST,
+            "conn_info": self.own_conn_info,
+        }).hex())
+
+        self.participants_filled.wait()
+        if self.join_refused:
+            log.error("Join was refused by the participants")
+            return
+        log.info("Joined as pid %s in epoch %s", self.own_pid, self.epoch)
+
+        # only connections to the new member are set up
+        for pid, conn_info in enumerate(self.participants):
+            if conn_info in (None, self.own_conn_info, sponsor_conn_info):
+                continue
+            while True:
+                connection = self.connect(conn_info)
+                if connection:
+                    self.__add_connection__(conn_info, connection)
+                    break
+                sleep(2)
+
+        self.__update_state__(deCoordinated.State.READY)
+        log.info("Connected to all participants!")
+    # =====================================
+
+    # =====================================
+    # hostless bootstrap
+    # -------------------------
+    # Instead of every guest going through a host, each peer starts from a
+    # few seeds and exchanges the set of peers it knows on every connection
+    # (full set when the connection opens, only new entries afterwards).
+    # Connections are opened as soon as a peer is learned, concurrently, with
+    # the lower conn_info dialing. pids are the position in the sorted set of
+    # conn_infos, so every peer derives the same pids without a coordinator.
+    def setup_gossip(self, seeds, expected_participants):
+        """
+        Bootstrap without a host from <seeds> (conn_infos of some peers);
+        ready once connected to <expected_participants> - 1 peers
+        """
+        self.hostless = True
+        self.expected_participants = expected_participants
+        self.known = {self.own_conn_info, *seeds}
+        self.dialing = set()
+        # protocol messages from peers that are ready before us
+        self.early = []
+        self.all_connected = Event()
+
+        self.deCoord_thread = Thread(target=self.__setup_gossip__, args=(list(seeds),))
+        self.deCoord_thread.start()
+
+    def __setup_gossip__(self, seeds):
+        self.__update_state__(deCoordinated.State.GOSSIPING)
+        self.listen_for_connections(self.__gossip_on_new_connection__)
+
+        with self.connections_lock:
+            seeds = [seed for seed in seeds if seed != self.own_conn_info]
+            self.dialing.update(seeds)
+        for seed in seeds:
+            Thread(target=self.__gossip_dial__, args=(seed,), daemon=True).start()
+        self.__check_gossip_complete__()
+
+        self.all_connected.wait()
+
+        with self.connections_lock:
+            self.participants = sorted(self.known)
+            self.pids = { conn_info: pid for pid, conn_info in enumerate(self.participants) }
+            self.own_pid = self.pids[self.own_conn_info]
+            for participant, connection in self.connections.items():
+                self.__bind__(self.pids[participant], connection)
+        log.info("Connected to %s peers without a host, own pid %s",
+                 len(self.participants) - 1, self.own_pid)
+
+        self.__update_state__(deCoordinated.State.READY)
+
+        # deliver what arrived before our pids were bound, in order;
+        # messages keep being queued until the backlog is empty
+        while True:
+            with self.connections_lock:
+                early = self.early
+                self.early = [] if early else None
+            if not early:
+                break
+            for sender, message in early:
+                pid = getattr(sender, "pid", None)
+                if pid is None:
+                    pid = self.pids[self.get_conn_info(sender)]
+                self.__deliver__(pid, message)
+
+    def __gossip_dial__(self, conn_info):
+        # seeds may not be listening yet
+        interval = deCoordinated.RECONNECT_INTERVAL
+        deadline = monotonic() + deCoordinated.RECONNECT_TIMEOUT
+        while True:
+            connection = self.connect(conn_info)
+            if connection:
+                break
+            if monotonic() > deadline:
+                log.error("could not connect to %s", conn_info)
+                return
+            sleep(interval)
+            interval = min(interval * 2, deCoordinated.RECONNECT_MAX_INTERVAL)
+
+        with self.connections_lock:
+            self.dialing.discard(conn_info)
+            # an inbound connection from the same peer may have won the race
+            self.connections.setdefault(conn_info, connection)
+            known = list(self.known)
+        self.__gossip__([connection], known)
+        self.__check_gossip_complete__()
+
+    def __gossip_on_new_connection__(self, connected_node):
+        participant = self.get_conn_info(connected_node)
+        if self.is_ready():
+            pid = self.pids.get(participant)
+            if pid is not None and self.__route__(pid) is not None:
+                # both sides dialed while bootstrapping; keep the bound one
+                return
+            return self.__on_member_connection__(connected_node)
+
+        with self.connections_lock:
+            self.connections.setdefault(participant, connected_node)
+            known = list(self.known)
+        self.__gossip__([connected_node], known)
+        self.__learn__([participant], connected_node)
+
+    def __gossip__(self, connections, conn_infos):
+        data = pickle.dumps({
+            deCoordinated.Message.TYPE_KEY: deCoordinated.Message.GOSSIP,
+            "known": conn_infos,
+        }).hex()
+        for connection in connections:
+            self.send(connection, data)
+
+    def __learn__(self, conn_infos, source):
+        """
+        Add peers heard of from <source>, pass them on and dial them
+        """
+        with self.connections_lock:
+            new = [conn_info for conn_info in conn_infos if conn_info not in self.known]
+            self.known.update(new)
+            others = [connection for connection in self.connections.values()
+                      if connection is not source]
+            dial = [conn_info for conn_info in new
+                    if conn_info > self.own_conn_info
+                    and conn_info not in self.connections
+                    and conn_info not in self.dialing]
+            self.dialing.update(dial)
+
+        if new:
+            log.debug("learned of peers %s", new)
+            self.__gossip__(others, new)
+        for conn_info in dial:
+            Thread(target=self.__gossip_dial__, args=(conn_info,), daemon=True).start()
+        self.__check_gossip_complete__()
+
+    def __check_gossip_complete__(self):
+        with self.connections_lock:
+            if len(self.known) < self.expected_participants:
+                return
+            if all(conn_info in self.connections for conn_info in self.known
+                   if conn_info != self.own_conn_info):
+                self.all_connected.set()
+    # =====================================
+
+    def __connected_pids__(self):
+        return [pid for pid, connection in enumerate(self.routes)
+                if connection is not None and pid != self.own_pid]
+
+    def __ping__(self, pid):
+        self.send_to_pid(pid, {
+            deCoordinated.Message.TYPE_KEY: deCoordinated.Message.PING,
+            "sent": monotonic(),
+            "ack": self.__session__(pid).received,
+        })
+
     def __update_state__(self, state):
         self.state = state
+        if state == deCoordinated.State.READY:
+            if self.HEARTBEAT_INTERVAL:
+                self.heartbeat.start()
+            if self.lazy and self.evictor is None:
+                self.evictor = self.timers.schedule(self.IDLE_TIMEOUT / 2, self.__evict_idle__)
 
     # These methods are already implemented. You should not override
     def __add_participant__(self, connection):
@@ -102,7 +774,7 @@ class deCoordinated(Trader, ABC):
         participant = self.get_conn_info(connection)
         with self.connections_lock:
             pid = len(self.participants)
-            self.pids[participant] = pid 
+            self.pids[participant] = pid
             self.participants.append(participant)
             log.info("Added new participant %s: %s", str(pid), str(participant))
         return participant
@@ -110,6 +782,24 @@ class deCoordinated(Trader, ABC):
     def __add_connection__(self, participant, connection):
         with self.connections_lock:
             self.connections[participant] = connection
+            if participant in self.pids:
+                self.__bind__(self.pids[participant], connection)
+
+    def __bind__(self, pid, connection):
+        """
+        Bind <connection> to <pid> once so that sending and receiving do not
+        need to look up connection info. Must hold connections_lock.
+        """
+        connection.pid = pid
+        # copy-on-write so readers never need the lock
+        routes = list(self.routes)
+        if len(routes) <= pid:
+            routes.extend([None] * (pid + 1 - len(routes)))
+        elif routes[pid] is not connection and pid in self.sessions:
+            # reconnected: hold back new messages until the resume handshake
+            self.sessions[pid].live = False
+        routes[pid] = connection
+        self.routes = routes
 
     def __send__(self, participant, message):
         with self.connections_lock:
@@ -153,7 +843,8 @@ class deCoordinated(Trader, ABC):
         self.all_participants_joined.wait()
 
         self.accepting_new_connections = False
-        self.stop_listening_for_connections()
+        # still listening: dropped participants reconnect to resume their
+        # sessions, and peers join later; unknown peers are refused
 
         self.__update_state__(deCoordinated.State.SENDING_PARTICIPANTS)
 
@@ -223,7 +914,7 @@ class deCoordinated(Trader, ABC):
 
         log.info("Received Personal ID from host: %s", str(self.own_pid))
         log.info("Received list of %s participants from host", str(len(self.participants)))
-        log.debug("participants: %s", str(self.participants))
+        log.debug("participants: %s", self.participants)
 
     def setup(self, host_conn_info = None):
         if self.is_host:
@@ -236,24 +927,67 @@ class deCoordinated(Trader, ABC):
 
         self.deCoord_thread.start()
 
-    def __init__(self, is_host):
-        super().__init__()
+    def __init__(self, is_host, lazy=False, fanout=None, aggregate=False):
+        """
+        lazy: open connections on the first message to a pid and close them
+              once idle, instead of connecting every pair of participants
+        fanout: relay PROPOSE/COMMIT/ABORT down a tree with this many
+                children per node instead of the leader sending to everyone
+        aggregate: with fanout, merge OKs up the tree instead of every
+                   cohort sending its OK to the leader
+        """
+        super().__init__(fanout=fanout, aggregate=aggregate)
         log.debug("initializing coordinated %s", "host" if is_host else "guest")
         self.is_host = is_host
+        self.lazy = lazy
         self.state = deCoordinated.State.NOT_CONFIGURED
         self.own_conn_info = self.get_conn_info(self)
 
         # connections are unique to each node and not sent by host
         self.connections = {} # no connection to self
         self.connections_lock = Lock()
+        # <routes>: [ connection ] indexed by pid, None if not connected
+        self.routes = []
+        self.pids = {}
+        # <sessions>: { pid --> Session }, survive reconnects
+        self.sessions = {}
+        # notified whenever send queues drain
+        self.drained = Condition()
+        # <receiving.active> on threads handling received messages
+        self.receiving = local()
+        self.limiter = Limiter(self.PROPOSE_RATE, self.PROPOSE_BURST, self.MAX_PROPOSE_SIZE)
+
+        # membership; see ruban.Membership
+        self.epoch = 0
+        self.epochs = {} # { epoch --> (pids) } for past epochs
+        self.joining = {} # { conn_info --> connection } not yet committed
+
+        # hostless bootstrap; see setup_gossip
+        self.hostless = False
+        self.early = None
+
+        # lazy connections
+        self.last_used = {} # { pid --> monotonic() of last protocol message }
+        self.opening = set() # pids being connected to
+        self.evictor = None
+
+        self.heartbeat = Heartbeat(
+            pids=self.__connected_pids__,
+            send_ping=self.__ping__,
+            on_suspect=self.suspect,
+            on_recover=self.unsuspect,
+            interval=self.HEARTBEAT_INTERVAL or Heartbeat.INTERVAL,
+        )
 
     def __del__(self):
         # TODO: signal coord thread to stop
-        self.deCoord_thread.join()
+        # setup() may never have been called
+        if getattr(self, "deCoord_thread", None):
+            self.deCoord_thread.join()
 
 
     def __host_on_new_connection__(self, connected_node):
-        log.debug("Host received new connection request: %s", str(connected_node))
+        log.debug("Host received new connection request: %s", connected_node)
         if self.accepting_new_connections:
             if connected_node in self.pids:
                 log.error("Connection Info Already used by another participant. Pick different parameters")
@@ -262,15 +996,21 @@ class deCoordinated(Trader, ABC):
                 self.__add_connection__(participant, connected_node)
                 self.__send__(participant, {deCoordinated.Message.TYPE_KEY: deCoordinated.Message.JOINED})
 
+        elif self.is_ready():
+            # participant reconnecting or peer joining
+            self.__on_member_connection__(connected_node)
+
         else:
             log.debug("Connection Request Refused: No Longer Accepting Connections.")
 
 
     def __guest_on_new_connection__(self, connected_node):
+        if self.is_ready():
+            return self.__on_member_connection__(connected_node)
         participant = self.get_conn_info(connected_node)
         with self.connections_lock:
             assert participant in self.participants
-        log.debug("Guest received new connection: %s", str(connected_node))
+        log.debug("Guest received new connection: %s", connected_node)
         self.__add_connection__(participant, connected_node)
 
     # =====================================
@@ -290,6 +1030,8 @@ class deCoordinated(Trader, ABC):
             self.own_pid = message["own_pid"]
             self.participants = message["participants"]
             self.pids = message["pids"]
+            for participant, connection in self.connections.items():
+                self.__bind__(self.pids[participant], connection)
 
         self.__send__(self.participants[deCoordinated.HOST_PID], {
             deCoordinated.Message.TYPE_KEY: deCoordinated.Message.ACK_PARTICIPANTS,
@@ -298,6 +1040,12 @@ class deCoordinated(Trader, ABC):
         self.participants_filled.set() # notify waiting threads to proceed
 
     def ___sequence_connect__(self):
+        if self.lazy:
+            # connections are opened on first use instead of a full mesh
+            self.__update_state__(deCoordinated.State.READY)
+            log.info("Ready; connecting to guests on demand")
+            return
+
         log.debug("beginning connection sequence to %s", self.participants)
 
         # wait until all guests with lower pid connect
@@ -312,8 +1060,7 @@ class deCoordinated(Trader, ABC):
 
         with self.connections_lock:
             self.accepting_new_connections = False
-
-        self.stop_listening_for_connections()
+        # still listening, see __setup_host__
 
         # connect to all guests with higher pid
         for pid, conn_info in enumerate(self.participants[self.participants.index(self.own_conn_info) + 1:]):
@@ -332,7 +1079,29 @@ class deCoordinated(Trader, ABC):
     def __handle_coordinated_message__(self, pid, message):
         try:
             message_type = message[deCoordinated.Message.TYPE_KEY]
-            if pid == deCoordinated.HOST_PID: # sent from host
+            if message_type == deCoordinated.Message.PING:
+                self.heartbeat.heard(pid, heartbeat=True)
+                self.__session__(pid).ack(message["ack"])
+                self.__drain__(pid)
+                self.send_to_pid(pid, {
+                    deCoordinated.Message.TYPE_KEY: deCoordinated.Message.PONG,
+                    "sent": message["sent"],
+                    "ack": self.__session__(pid).received,
+                })
+            elif message_type == deCoordinated.Message.PONG:
+                self.heartbeat.rtt_sample(pid, message["sent"])
+                self.__session__(pid).ack(message["ack"])
+                self.__drain__(pid)
+            elif message_type == deCoordinated.Message.CREDIT:
+                self.__session__(pid).ack(message["ack"])
+                self.__drain__(pid)
+            elif message_type == deCoordinated.Message.DROPPED:
+                self.__dropped__(pid, message["seq"])
+            elif message_type in (deCoordinated.Message.RESUME,
+                                  deCoordinated.Message.RESUME_ACK):
+                self.__resume__(pid, message["received"],
+                                reply=message_type == deCoordinated.Message.RESUME)
+            elif pid == deCoordinated.HOST_PID: # sent from host
                 if  message_type == deCoordinated.Message.RES_PARTICIPANTS:
                     self.__fill_participants__(message)
                 elif message_type == deCoordinated.Message.BEGIN_CONNECT_SEQ:
@@ -345,7 +1114,7 @@ class deCoordinated(Trader, ABC):
 
         except KeyError as e:
             print(repr(e))
-            log.debug("received ill-formatted message: %s", str(message))
+            log.debug("received ill-formatted message: %s", message)
             return False
 
     def register_coord_callback(self, callback):
@@ -354,16 +1123,117 @@ class deCoordinated(Trader, ABC):
     # connection
     # message is a string
     def on_receive(self, sender, message):
+        # callbacks run from here must not wait for credit; see wait_for_capacity
+        nested = getattr(self.receiving, "active", False)
+        self.receiving.active = True
+        try:
+            return self.__receive__(sender, message)
+        finally:
+            self.receiving.active = nested
+
+    def __receive__(self, sender, message):
+        lane, message = Lanes.untag(message)
+        seq, _, message = message.rpartition(":")
+
+        if lane == Lanes.PROPOSE and seq:
+            pid = self.__pid_of__(sender)
+            if pid is not None and not self.limiter.admit(pid, len(message)):
+                # dropped unread; the sender refuses the offer on our behalf.
+                # Told before the seq is acked, while it still has the PROPOSE
+                self.send_to_pid(pid, {
+                    deCoordinated.Message.TYPE_KEY: deCoordinated.Message.DROPPED,
+                    "seq": int(seq),
+                })
+                # still received, so that it is not resent
+                self.heartbeat.heard(pid)
+                self.__accept__(pid, int(seq))
+                return
+
         message = pickle.loads(bytes.fromhex(message))
+        if seq:
+            message = (int(seq), message)
 
         log.debug("received message: %s", message)
 
-        try:
-            pid = self.pids[self.get_conn_info(sender)]
-        except KeyError as e:
-            print(repr(e))
-            log.erro("could not find pid of sender...")
-            return 
+        if self.early is not None and not isinstance(message, dict):
+            # hostless bootstrap: a peer that became ready before us
+            with self.connections_lock:
+                if self.early is not None:
+                    self.early.append((sender, message))
+                    return
+
+        pid = self.__pid_of__(sender)
+        if pid is None:
+            return self.__on_unbound_message__(sender, message)
+
+        return self.__deliver__(pid, message)
+
+    def __pid_of__(self, connection):
+        # connections are bound to a pid once known (see __bind__)
+        pid = getattr(connection, "pid", None)
+        if pid is None:
+            pid = self.pids.get(self.get_conn_info(connection))
+        return pid
+
+    def __accept__(self, pid, seq) -> bool:
+        """
+        Account for sequenced message <seq> from <pid>; False for a duplicate
+        """
+        session = self.__session__(pid)
+        if not session.accept(seq):
+            return False
+        if session.grant():
+            self.__credit__(pid)
+        elif not session.ack_scheduled:
+            session.ack_scheduled = True
+            self.timers.schedule(self.ACK_DELAY, self.__delayed_ack__, pid)
+        if self.lazy:
+            self.last_used[pid] = monotonic()
+        return True
+
+    def __delayed_ack__(self, pid):
+        session = self.__session__(pid)
+        session.ack_scheduled = False
+        if session.grant(threshold=1):
+            self.__credit__(pid)
+
+    def __dropped__(self, pid, seq):
+        """
+        <pid> dropped our PROPOSE <seq> unread (see ruban.Limits); its offer
+        is refused as if <pid> had rejected it
+        """
+        session = self.__session__(pid)
+        with session.lock:
+            data = next((data for sent, data in session.unacked if sent == seq), None)
+        if data is None:
+            log.warning("pid %s dropped seq %s, which is no longer buffered", pid, seq)
+            return
+        _, data = Lanes.untag(data)
+        message = pickle.loads(bytes.fromhex(data.partition(":")[2]))
+        if message.type != ProtocolMessage.Type.PROPOSE:
+            return
+        if message.chain.owner == self.get_own_pid():
+            self._Trader__recv(ProtocolMessage(pid, ProtocolMessage.Type.REJECT, message.chain))
+        else:
+            # relayed; the leader learns it from us
+            self.send_to_pid(message.chain.owner, ProtocolMessage(
+                self.get_own_pid(), ProtocolMessage.Type.REJECT, message.chain))
+
+    def __credit__(self, pid):
+        self.send_to_pid(pid, {
+            deCoordinated.Message.TYPE_KEY: deCoordinated.Message.CREDIT,
+            "ack": self.__session__(pid).received,
+        })
+
+    def __deliver__(self, pid, message):
+        # any traffic is a sign of life for the failure detector
+        self.heartbeat.heard(pid)
+
+        # sequenced protocol message; drop duplicates from a replay
+        if isinstance(message, tuple):
+            seq, message = message
+            if not self.__accept__(pid, seq):
+                return
 
         if isinstance(message, dict):
             if deCoordinated.Message.TYPE_KEY in message:
@@ -371,7 +1241,7 @@ class deCoordinated(Trader, ABC):
                     return self.__handle_coordinated_message__(pid, message)
                 except KeyError as e:
                     print(repr(e))
-                    log.debug("received message from unknown participant %s\nMessage: %s", str(sender), str(message))
+                    log.debug("received message from unknown participant %s\nMessage: %s", pid, message)
                     return False
 
         else: # not a coordinated setup message
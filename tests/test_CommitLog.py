@@ -0,0 +1,108 @@
+import unittest
+import os
+from tempfile import TemporaryDirectory
+from threading import Thread
+from ruban.CommitLog import CommitLog
+from ruban.Snapshot import Snapshotter
+from tests.util import make_chain
+
+class TestCommitLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_recover_after_restart(self):
+        committed = make_chain(0, "MOVE 1")
+        aborted = make_chain(1, "MOVE 2")
+        pending = make_chain(2, "MOVE 3")
+
+        commit_log = CommitLog(self.path)
+        for chain in (committed, aborted, pending):
+            commit_log.pending(chain)
+        commit_log.commit(committed)
+        commit_log.tombstone(aborted.digest())
+        commit_log.close()
+
+        commit_log = CommitLog(self.path)
+        recovered = commit_log.recover()
+        self.assertEqual([chain.digest() for chain in recovered.history], [committed.digest()])
+        self.assertEqual(list(recovered.pending), [pending.digest()])
+        self.assertEqual(recovered.tombstones, {aborted.digest()})
+        self.assertEqual(commit_log.append(CommitLog.Kind.COMMIT), 6)
+        commit_log.close()
+
+    def test_torn_tail_truncated(self):
+        commit_log = CommitLog(self.path, CommitLog.Durability.OS)
+        commit_log.commit(make_chain(0, "MOVE 1"))
+        commit_log.commit(make_chain(0, "MOVE 2"))
+        commit_log.close()
+
+        segment = os.path.join(self.path, commit_log.segments()[-1])
+        with open(segment, "r+b") as f:
+            f.truncate(os.path.getsize(segment) - 3)
+
+        commit_log = CommitLog(self.path)
+        self.assertEqual([record.seq for record in commit_log.replay()], [1])
+        commit_log.commit(make_chain(0, "MOVE 3"))
+        self.assertEqual(len(commit_log.recover().history), 2)
+        commit_log.close()
+
+    def test_group_commit(self):
+        commit_log = CommitLog(self.path, segment_size=4096)
+        seqs = []
+        def append(owner):
+            for i in range(50):
+                seqs.append(commit_log.commit(make_chain(owner, f"MOVE {i}")))
+
+        threads = [Thread(target=append, args=(owner,)) for owner in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(seqs), list(range(1, 401)))
+        self.assertEqual(commit_log.durable_seq, 400)
+        self.assertGreater(len(commit_log.segments()), 1)
+        self.assertEqual([record.seq for record in commit_log.replay(start=350)],
+                         list(range(350, 401)))
+        commit_log.close()
+
+    def test_snapshot_compacts_and_recovers(self):
+        commit_log = CommitLog(self.path, CommitLog.Durability.OS, segment_size=1024)
+        game = []
+        snapshots = Snapshotter(commit_log, lambda: tuple(game), every=100)
+        pending = make_chain(1, "MOVE X")
+        commit_log.pending(pending)
+        for i in range(250):
+            chain = make_chain(0, f"MOVE {i}")
+            seq = commit_log.commit(chain)
+            game.append(chain)
+            snapshots.committed(seq, chain)
+            snapshots.wait()
+        commit_log.close()
+
+        self.assertEqual(len(commit_log.snapshots()), 1)
+        # segments wholly before the snapshot are gone
+        self.assertLessEqual(int(commit_log.segments()[0][:-4]), 202)
+        self.assertGreater(int(commit_log.segments()[0][:-4]), 100)
+
+        commit_log = CommitLog(self.path)
+        recovered = commit_log.recover()
+        self.assertEqual(recovered.seq, 201)
+        self.assertEqual(len(recovered.state), 200)
+        self.assertEqual([chain.actions[0].content for chain in recovered.state + tuple(recovered.history)],
+                         [f"MOVE {i}" for i in range(250)])
+        self.assertEqual(list(recovered.pending), [pending.digest()])
+        commit_log.close()
+
+    def test_digest_is_stable(self):
+        self.assertEqual(make_chain(0, "MOVE 1").digest(), make_chain(0, "MOVE 1").digest())
+        self.assertNotEqual(make_chain(0, "MOVE 1").digest(), make_chain(1, "MOVE 1").digest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from ruban.Heartbeat import Heartbeat, PhiAccrual, RttEstimator
+
+class TestPhiAccrual(unittest.TestCase):
+
+    def test_phi_grows_with_silence(self):
+        detector = PhiAccrual(1.0)
+        for t in range(10):
+            detector.heard(float(t), heartbeat=True)
+        self.assertLess(detector.phi(9.5), 1.0)
+        self.assertGreater(detector.phi(9 + 20.0), Heartbeat.THRESHOLD)
+
+    def test_traffic_does_not_shrink_interval(self):
+        detector = PhiAccrual(1.0)
+        detector.heard(0.0, heartbeat=True)
+        for i in range(1000):
+            detector.heard(i / 1000)
+        # a normal heartbeat gap after a burst of traffic is not suspicious
+        self.assertLess(detector.phi(2.0), Heartbeat.THRESHOLD)
+
+class TestRttEstimator(unittest.TestCase):
+
+    def test_rto(self):
+        estimator = RttEstimator()
+        self.assertIsNone(estimator.rto())
+        estimator.sample(0.1)
+        self.assertAlmostEqual(estimator.rto(), 0.1 + 4 * 0.05)
+        for _ in range(50):
+            estimator.sample(0.1)
+        self.assertAlmostEqual(estimator.srtt, 0.1)
+        self.assertLess(estimator.rto(), 0.11)
+
+class TestHeartbeat(unittest.TestCase):
+
+    def test_suspect_and_recover(self):
+        events = []
+        heartbeat = Heartbeat(
+            pids=lambda: [],
+            send_ping=lambda pid: None,
+            on_suspect=lambda pid: events.append(("suspect", pid)),
+            on_recover=lambda pid: events.append(("recover", pid)),
+        )
+        heartbeat.suspect(1)
+        heartbeat.suspect(1)
+        heartbeat.heard(1)
+        self.assertEqual(events, [("suspect", 1), ("recover", 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+from tempfile import TemporaryDirectory
+from ruban.HistoryStore import HistoryStore
+from tests.util import make_chain
+
+NUM_CHAINS = 300
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = self.directory.name
+        self.chains = [make_chain(i % 4, f"MOVE {i}") for i in range(NUM_CHAINS)]
+        store = HistoryStore(self.path, segment_size=4096)
+        for chain in self.chains:
+            store.append(chain)
+        store.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertHistory(self, store):
+        self.assertEqual(len(store), NUM_CHAINS)
+        for seq in (1, 2, 150, NUM_CHAINS):
+            self.assertEqual(store.get(seq).actions[0].content, f"MOVE {seq - 1}")
+        self.assertEqual(store.find(self.chains[200].digest()), 201)
+        self.assertIsNone(store.find(make_chain(9, "MOVE 0").digest()))
+        self.assertEqual(store.by_owner(3), list(range(4, NUM_CHAINS + 1, 4)))
+
+    def test_queries_across_segments(self):
+        store = HistoryStore(self.path, segment_size=4096)
+        self.assertGreater(len(store.sealed), 1)
+        self.assertHistory(store)
+        # payloads are slices of the mapped segment
+        self.assertIsInstance(store.payload(1), memoryview)
+        store.close()
+
+    def test_append_after_reopen(self):
+        store = HistoryStore(self.path, segment_size=4096)
+        self.assertEqual(store.append(make_chain(1, "MOVE X")), NUM_CHAINS + 1)
+        self.assertEqual(store.get(NUM_CHAINS + 1).actions[0].content, "MOVE X")
+        store.close()
+
+    def test_lost_tail_recovered(self):
+        store = HistoryStore(self.path, segment_size=4096)
+        tail = f"{store.active.path}.hist"
+        store.close()
+        os.remove(tail)
+
+        store = HistoryStore(self.path, segment_size=4096)
+        lost = NUM_CHAINS - len(store)
+        self.assertGreater(lost, 0)
+        self.assertEqual(store.recover(self.chains), lost)
+        self.assertHistory(store)
+        self.assertEqual(store.recover(self.chains), 0)
+        store.close()
+
+    def test_torn_tail_dropped(self):
+        store = HistoryStore(self.path, segment_size=4096)
+        tail = f"{store.active.path}.hist"
+        store.close()
+        with open(tail, "ab") as f:
+            f.write(b"\x20\0\0\0garbage")
+
+        store = HistoryStore(self.path, segment_size=4096)
+        self.assertHistory(store)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
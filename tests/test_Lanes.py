@@ -0,0 +1,89 @@
+import unittest
+from ruban import Lanes
+from ruban.Offer import Message
+from ruban.Session import Session
+from tests.util import make_chain
+
+
+def message(type):
+    return Message(0, type, make_chain(0, "MOVE 1"))
+
+
+class TestLanes(unittest.TestCase):
+
+    def test_higher_lanes_served_first(self):
+        lanes = Lanes.Lanes()
+        for i in range(3):
+            lanes.push(Lanes.PROPOSE, ("propose", i))
+        lanes.push(Lanes.RESPONSE, ("ok", 0))
+        lanes.push(Lanes.CONTROL, ("commit", 0))
+
+        served = [lanes.pop() for _ in range(len(lanes))]
+        self.assertEqual(served, [("commit", 0), ("ok", 0),
+                                  ("propose", 0), ("propose", 1), ("propose", 2)])
+
+    def test_starved_lane_served(self):
+        lanes = Lanes.Lanes(starvation_limit=4)
+        lanes.push(Lanes.PROPOSE, "propose")
+        for i in range(10):
+            lanes.push(Lanes.CONTROL, i)
+
+        served = [lanes.pop() for _ in range(5)]
+        self.assertEqual(served, [0, 1, 2, 3, "propose"])
+
+    def test_tags(self):
+        self.assertEqual(Lanes.lane_of(message(Message.Type.COMMIT)), Lanes.CONTROL)
+        self.assertEqual(Lanes.lane_of(message(Message.Type.OK)), Lanes.RESPONSE)
+        self.assertEqual(Lanes.lane_of(message(Message.Type.PROPOSE)), Lanes.PROPOSE)
+        self.assertEqual(Lanes.lane_of({"type": "Ping"}), Lanes.CONTROL)
+
+        self.assertEqual(Lanes.untag(Lanes.tag(Lanes.PROPOSE, "abcd")), (Lanes.PROPOSE, "abcd"))
+        self.assertEqual(Lanes.untag(b"1:abcd"), (Lanes.RESPONSE, b"abcd"))
+        self.assertEqual(Lanes.untag("abcd"), (Lanes.CONTROL, "abcd"))
+
+
+class TestSession(unittest.TestCase):
+
+    def test_sequenced_by_priority_when_sent(self):
+        session = Session(1, window=2)
+        session.enqueue(Lanes.PROPOSE, "propose")
+        session.enqueue(Lanes.PROPOSE, "propose again")
+        session.enqueue(Lanes.CONTROL, "commit")
+
+        encode = lambda lane, seq, message: (seq, message)
+        self.assertEqual(session.sendable(encode), [(1, "commit"), (2, "propose")])
+        self.assertEqual(session.sendable(encode), [])
+
+        session.ack(2)
+        self.assertEqual(session.sendable(encode), [(3, "propose again")])
+
+    def test_propose_refused_when_congested(self):
+        session = Session(1, capacity=4, window=0, queue_limit=2)
+        self.assertTrue(session.enqueue(Lanes.PROPOSE, "propose"))
+        self.assertTrue(session.enqueue(Lanes.PROPOSE, "propose again"))
+        self.assertFalse(session.enqueue(Lanes.PROPOSE, "refused"))
+        # settles what is in flight
+        for i in range(4):
+            self.assertTrue(session.enqueue(Lanes.CONTROL, f"commit {i}"))
+        self.assertEqual(len(session.queued), 6)
+
+        session.shed()
+        self.assertEqual(len(session.queued), 4)
+        encode = lambda lane, seq, message: message
+        session.window = 8
+        self.assertEqual(session.sendable(encode), [f"commit {i}" for i in range(4)])
+
+    def test_accept_tolerates_reordering(self):
+        session = Session(1)
+        self.assertTrue(session.accept(1))
+        self.assertTrue(session.accept(3))
+        self.assertEqual(session.received, 1)
+        self.assertFalse(session.accept(3))
+
+        self.assertTrue(session.accept(2))
+        self.assertEqual(session.received, 3)
+        self.assertFalse(session.accept(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from ruban.Limits import TokenBucket, Limiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_bucket_refills_up_to_burst(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+        self.clock.now = 1.0
+        self.assertEqual([bucket.take() for _ in range(3)], [True, True, False])
+
+        self.clock.now = 100.0
+        self.assertEqual(sum(bucket.take() for _ in range(10)), 3)
+
+    def test_flooding_pid_does_not_affect_others(self):
+        limiter = Limiter(rate=1, burst=5, clock=self.clock)
+        admitted = sum(limiter.admit(1, 100) for _ in range(1000))
+        self.assertEqual(admitted, 5)
+        self.assertEqual(limiter.dropped, { 1: 995 })
+
+        self.assertTrue(all(limiter.admit(2, 100) for _ in range(5)))
+
+    def test_oversized_dropped(self):
+        limiter = Limiter(max_size=1000, clock=self.clock)
+        self.assertFalse(limiter.admit(1, 1001))
+        self.assertTrue(limiter.admit(1, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()
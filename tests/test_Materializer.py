@@ -0,0 +1,157 @@
+import unittest
+from threading import Event, Thread
+from ruban.Materializer import Materializer, Reducer, Speculator
+from ruban.Offer import Action, Offer
+from tests.util import make_network, make_chain, wait_for
+
+class Score(Reducer):
+    """
+    { owner --> sum of the numbers in its actions }
+    """
+    def __init__(self):
+        self.applied = 0
+
+    def initial(self):
+        return {}
+
+    def apply(self, state, action):
+        self.applied += 1
+        state = dict(state)
+        state[action.owner] = state.get(action.owner, 0) + int(action.content)
+        return state
+
+class TestMaterializer(unittest.TestCase):
+
+    def setUp(self):
+        self.reducer = Score()
+        self.materializer = Materializer(self.reducer)
+
+    def test_commits_applied_incrementally(self):
+        self.materializer.commit(make_chain(0, "1", "2"))
+        self.materializer.commit(make_chain(1, "5"))
+        self.assertEqual(self.materializer.state, {0: 3, 1: 5})
+        self.assertEqual(self.reducer.applied, 3)
+
+    def test_speculative_state_reused_on_commit(self):
+        self.materializer.commit(make_chain(0, "1"))
+        chain = make_chain(1, "2", "3")
+        self.assertEqual(self.materializer.evaluate(chain), {0: 1, 1: 5})
+        self.assertEqual(self.materializer.state, {0: 1})
+
+        applied = self.reducer.applied
+        self.materializer.commit(chain)
+        self.assertEqual(self.reducer.applied, applied)
+        self.assertEqual(self.materializer.state, {0: 1, 1: 5})
+
+    def test_counter_applies_only_suffix(self):
+        chain = make_chain(0, "1", "2", "3")
+        self.materializer.evaluate(chain)
+        counter = chain.counter([Action(1, "4")])
+
+        applied = self.reducer.applied
+        self.assertEqual(self.materializer.evaluate(counter, base=chain), {0: 6, 1: 4})
+        self.assertEqual(self.reducer.applied, applied + 1)
+
+    def test_trader_materializes_commits(self):
+        network = make_network(3)
+        for trader in network:
+            trader.materializer = Materializer(Score())
+        network[0].offer(make_chain(0, "4"))
+        network[2].offer(make_chain(2, "7"))
+        for trader in network:
+            self.assertEqual(trader.materializer.state, {0: 4, 2: 7})
+
+    def test_commit_does_not_hold_lock_while_reducing(self):
+        reducer = GatedScore()
+        materializer = Materializer(reducer)
+        committing = Thread(target=materializer.commit, args=(make_chain(0, "1"),))
+        committing.start()
+        wait_for(lambda: materializer.inflight)
+        self.assertTrue(materializer.lock.acquire(blocking=False))
+        materializer.lock.release()
+
+        reducer.gate.set()
+        committing.join()
+        self.assertEqual(materializer.state, {0: 1})
+
+    def test_queued_chain_not_submitted_twice(self):
+        reducer = GatedScore()
+        speculator = Speculator(Materializer(reducer))
+        speculator.submit(make_chain(0, "1"))
+        wait_for(lambda: speculator.materializer.inflight)
+
+        chain = make_chain(1, "2")
+        speculator.submit(chain)
+        speculator.submit(chain)
+        self.assertEqual(speculator.queue.qsize(), 1)
+
+        reducer.gate.set()
+        speculator.stop()
+        self.assertEqual(reducer.applied, 2)
+        self.assertFalse(speculator.worker.is_alive())
+
+
+class GatedScore(Score):
+    """
+    Score that blocks in apply() until <gate> is set
+    """
+    def __init__(self):
+        super().__init__()
+        self.gate = Event()
+
+    def apply(self, state, action):
+        self.gate.wait()
+        return super().apply(state, action)
+
+class TestSpeculation(unittest.TestCase):
+
+    def setUp(self):
+        self.reducer = GatedScore()
+
+    def tearDown(self):
+        self.cohort.speculator.stop()
+
+    def make_network(self, **kwargs):
+        # pid 1 leaves offers RECEIVED until the test responds
+        self.network = make_network(2, silent={1}, **kwargs)
+        self.cohort = self.network[1]
+        self.cohort.materializer = Materializer(self.reducer)
+        self.cohort.speculator = Speculator(self.cohort.materializer)
+
+    def test_commit_installs_speculated_state(self):
+        self.make_network()
+        chain = make_chain(0, "1", "2")
+        self.network[0].offer(chain)
+        self.reducer.gate.set()
+        wait_for(lambda: self.reducer.applied == 2)
+
+        offer = self.cohort._Trader__get_offer(chain)
+        self.assertEqual(offer.state, Offer.State.RECEIVED)
+        self.cohort.accept(offer)
+        self.assertEqual(self.cohort.materializer.state, {0: 3})
+        self.assertEqual(self.reducer.applied, 2)
+
+    def test_commit_waits_for_speculation_in_flight(self):
+        self.make_network()
+        chain = make_chain(0, "1", "2")
+        self.network[0].offer(chain)
+        wait_for(lambda: self.cohort.materializer.inflight)
+
+        self.reducer.gate.set()
+        self.cohort.accept(self.cohort._Trader__get_offer(chain))
+        self.assertEqual(self.cohort.materializer.state, {0: 3})
+        self.assertEqual(self.reducer.applied, 2)
+
+    def test_aborted_speculation_discarded(self):
+        self.make_network(response_timeout=0.2)
+        self.reducer.gate.set()
+        self.network[0].offer(make_chain(0, "1"))
+        wait_for(lambda: self.reducer.applied == 1)
+
+        # the leader gives up on the silent cohort
+        wait_for(lambda: self.cohort.aborts)
+        self.assertEqual(self.cohort.materializer.cache, {})
+        self.assertEqual(self.cohort.materializer.state, {})
+
+if __name__ == "__main__":
+    unittest.main()
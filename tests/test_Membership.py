@@ -0,0 +1,29 @@
+import unittest
+from ruban import Membership
+from ruban.Offer import Action, Chain
+
+
+class TestMembership(unittest.TestCase):
+
+    def test_changes_parsed(self):
+        self.assertEqual(Membership.parse(Membership.join_chain(0, 3, "127.0.0.1:8000")),
+                         [(Membership.JOIN, 3, "127.0.0.1:8000")])
+        self.assertEqual(Membership.parse(Membership.leave_chain(1, 1)),
+                         [(Membership.LEAVE, 1, None)])
+
+    def test_content_does_not_make_a_chain_internal(self):
+        chain = Chain(0, [Action(0, f"{Membership.PREFIX}{Membership.LEAVE} 1")])
+        self.assertFalse(Membership.is_membership(chain))
+        self.assertNotEqual(hash(chain), hash(Membership.leave_chain(0, 1)))
+
+    def test_malformed_changes_rejected(self):
+        for content in ("join 3", "leave x", "leave -1", "promote 1", "leave 1 2"):
+            chain = Membership.MembershipChain(0, [Action(0, Membership.PREFIX + content)])
+            with self.assertRaises(ValueError):
+                Membership.parse(chain)
+        with self.assertRaises(ValueError):
+            Membership.parse(Membership.MembershipChain(0, [Action(0, "MOVE 1")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
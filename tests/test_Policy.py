@@ -0,0 +1,73 @@
+import unittest
+from ruban.Policy import PolicyEngine, Policy, Verdict, Decision, AutoAccept, AutoCounter, AutoReject, Defer
+from ruban.Offer import Action, Offer
+from tests.util import make_network, make_chain
+
+def counter_once(pid):
+    # add a move of our own unless the chain already has one
+    def suffix(offer):
+        if any(action.owner == pid for action in offer.chain.actions):
+            return None
+        return [Action(pid, f"MOVE {pid}")]
+    return suffix
+
+class TestPolicy(unittest.TestCase):
+
+    def test_policy_responds_instead_of_application(self):
+        network = make_network(3, silent={1, 2})
+        for trader in network:
+            trader.policies = PolicyEngine([AutoAccept()])
+        network[0].offer(make_chain(0, "MOVE 0"))
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+
+    def test_counter_round_trip(self):
+        network = make_network(3, silent={0, 1, 2})
+        for trader in network:
+            trader.policies = PolicyEngine([AutoCounter(counter_once(trader.pid)), AutoAccept()])
+        network[0].policies = PolicyEngine([AutoAccept()])
+
+        network[0].offer(make_chain(0, "MOVE 0"))
+        # pids 1 and 2 both counter; the leader takes 1's, which 2 counters again
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+            self.assertEqual([action.content for action in trader.game[0].actions],
+                             ["MOVE 0", "MOVE 1", "MOVE 2"])
+
+    def test_accept_without_counter_deferred(self):
+        network = make_network(2, silent={0, 1})
+        network[1].policies = PolicyEngine([AutoCounter(counter_once(1))])
+        # names no counter to accept
+        network[0].policies = PolicyEngine([Policy("careless", lambda offer: Verdict(Decision.ACCEPT))])
+        deciding = []
+        network[0].respond = deciding.append
+
+        network[0].offer(make_chain(0, "MOVE 0"))
+        self.assertEqual([offer.state for offer in deciding], [Offer.State.DECIDING])
+        self.assertEqual(network[0].game, [])
+
+    def test_deferred_to_application(self):
+        network = make_network(2)
+        engine = PolicyEngine([AutoReject(lambda chain: len(chain.actions) > 5),
+                               Defer(lambda chain: True)])
+        network[1].policies = engine
+        network[0].offer(make_chain(0, "MOVE 0"))
+        # LocalTrader.respond() accepted it
+        self.assertEqual(len(network[1].game), 1)
+
+        metrics = engine.metrics()
+        self.assertEqual(metrics["auto-reject"]["evaluated"], 1)
+        self.assertEqual(metrics["auto-reject"]["decided"], 0)
+        self.assertEqual(metrics["defer"]["decided"], 1)
+        self.assertGreater(metrics["defer"]["max_us"], 0)
+
+    def test_duplicate_names_rejected(self):
+        with self.assertRaises(ValueError):
+            PolicyEngine([AutoReject(lambda chain: True), AutoReject(lambda chain: False)])
+        engine = PolicyEngine([AutoReject(lambda chain: True),
+                               AutoReject(lambda chain: False, name="never")])
+        self.assertEqual(set(engine.metrics()), {"auto-reject", "never"})
+
+
+if __name__ == "__main__":
+    unittest.main()
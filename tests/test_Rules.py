@@ -0,0 +1,64 @@
+import unittest
+from ruban.Rules import Rule, RuleSet
+from ruban.Trader import OfferAborted
+from ruban.Offer import Action
+from tests.util import make_network, make_chain
+
+RULES = [
+    Rule(r"MOVE (?P<square>\d+)", square=range(9)),
+    Rule(r"SAY (?P<text>.+)", owners={0}, text=lambda text: len(text) < 10),
+    Rule(r"PASS|SKIP"),
+]
+
+class TestRules(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet(RULES)
+
+    def test_actions_checked_against_rules(self):
+        allowed = [Action(0, "MOVE 3"), Action(0, "SAY hi"), Action(1, "PASS"), Action(1, "SKIP")]
+        denied = [Action(0, "MOVE 9"), Action(0, "MOVE x"), Action(1, "SAY hi"),
+                  Action(0, "SAY a long speech"), Action(0, "JUMP 1"), Action(0, "MOVE 3 4")]
+        for action in allowed:
+            self.assertTrue(self.rules.allows(action), action)
+        for action in denied:
+            self.assertFalse(self.rules.allows(action), action)
+
+    def test_results_cached_by_action_digest(self):
+        self.rules.allows(Action(0, "MOVE 3"))
+        self.rules.allows(Action(0, "MOVE 3"))
+        self.assertEqual(self.rules.stats, { "hits": 1, "misses": 1 })
+
+    def test_counter_validates_only_suffix(self):
+        chain = make_chain(0, *(f"MOVE {i % 9}" for i in range(100)))
+        self.rules.actions.clear()
+        self.assertTrue(self.rules.validate(chain))
+
+        counter = chain.counter([Action(1, "MOVE 1"), Action(1, "MOVE 10")])
+        misses = self.rules.stats["misses"]
+        self.assertEqual(self.rules.first_invalid(counter, base=chain), 101)
+        self.assertEqual(self.rules.stats["misses"] - misses, 2)
+
+    def test_unknown_group_rejected(self):
+        with self.assertRaises(ValueError):
+            RuleSet([Rule(r"MOVE (?P<square>\d+)", row=range(3))])
+
+    def test_cohort_rejects_illegal_chain(self):
+        network = make_network(3)
+        for trader in network:
+            trader.rules = RuleSet(RULES)
+        network[0].offer(make_chain(0, "MOVE 4"))
+        future = network[0].offer(make_chain(0, "MOVE 40"))
+        for trader in network:
+            self.assertEqual([chain.actions[0].content for chain in trader.game], ["MOVE 4"])
+
+        # the cohorts' rejection aborts the round
+        with self.assertRaises(OfferAborted) as aborted:
+            future.result(0)
+        self.assertEqual(aborted.exception.reason, OfferAborted.REFUSED)
+        for trader in network:
+            self.assertFalse(trader._Trader__has_offer(make_chain(0, "MOVE 40")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,395 @@
+import unittest
+import socket
+import struct
+from functools import partial
+from threading import Event
+from time import monotonic
+from ruban.SelectorPeer import SelectorPeer, frame
+from ruban.Trader import Backpressure, OfferAborted
+from ruban.Offer import Action, Chain
+from tests import util
+
+ADDRESS = "127.0.0.1"
+NUM_PARTICIPANTS = 3
+# real sockets and threads take longer than the in-process network
+TIMEOUT = 30
+wait_for = partial(util.wait_for, timeout=TIMEOUT)
+
+class AcceptingPeer(SelectorPeer):
+    """
+    Accepts every offer and records committed chains
+    """
+    def __init__(self, port, is_host, **kwargs):
+        super().__init__(ADDRESS, port, is_host, **kwargs)
+        self.game = []
+        self.got_commit = Event()
+
+    def respond(self, offer):
+        self.accept(offer)
+
+    def committed(self, chain):
+        self.game.append(chain)
+        self.got_commit.set()
+
+    def aborted(self, chain):
+        pass
+
+def bootstrap(num_participants, peer_class=AcceptingPeer, **kwargs):
+    host = peer_class(0, True, **kwargs)
+    host.setup()
+    host_conn_info = host.get_conn_info(host)
+    guests = []
+    for _ in range(num_participants - 1):
+        guest = peer_class(0, False, **kwargs)
+        guest.setup(host_conn_info)
+        guests.append(guest)
+
+    wait_for(lambda: host.state == SelectorPeer.State.ACCEPTING_GUESTS)
+    wait_for(lambda: len(host.participants) == num_participants)
+    host.host_begin_round_robin()
+
+    peers = [host] + guests
+    wait_for(lambda: all(peer.is_ready() for peer in peers))
+    # guests get pids in the order they joined
+    return sorted(peers, key=lambda peer: peer.get_own_pid())
+
+class TestSelectorPeer(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = bootstrap(NUM_PARTICIPANTS)
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def test_mesh(self):
+        for peer in self.peers:
+            self.assertEqual(sorted(peer.get_participants()),
+                             list(range(NUM_PARTICIPANTS)))
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+    def test_offer_committed(self):
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+        host = self.peers[0]
+        host.offer(Chain(host.get_own_pid(), [Action(0, "MOVE 1")]))
+
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+            self.assertEqual(peer.game[0].actions[0].content, "MOVE 1")
+
+    def test_bad_frames_close_only_their_connection(self):
+        host = self.peers[0]
+        for payload in (frame(b"\xff\xfe"), frame(b"no port"),
+                        struct.pack("!I", 1 << 31)):
+            address, port = host.get_conn_info(host).split(":")
+            sock = socket.create_connection((address, int(port)))
+            sock.sendall(payload)
+            sock.settimeout(TIMEOUT)
+            self.assertEqual(sock.recv(1), b"")
+            sock.close()
+        self.assertTrue(host.io_thread.is_alive())
+
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+        host.offer(Chain(0, [Action(0, "MOVE 1")])).result(TIMEOUT)
+
+    def test_lost_connection_is_suspected(self):
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+        self.peers[2].stop()
+        wait_for(lambda: 2 in self.peers[0].suspected)
+        wait_for(lambda: 2 in self.peers[1].suspected)
+
+    def test_session_resumed_after_drop(self):
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+        # pid 1 dialed pid 2; drop that link and propose while it is down
+        link = self.peers[1].routes[2]
+        link.sock.shutdown(socket.SHUT_RDWR)
+        self.peers[1].offer(Chain(1, [Action(1, "MOVE 2")]))
+
+        wait_for(lambda: self.peers[1].routes[2] not in (None, link))
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+            self.assertEqual(peer.game[0].actions[0].content, "MOVE 2")
+        self.assertTrue(self.peers[1].sessions[2].live)
+
+    def test_join_and_leave(self):
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+        joiner = AcceptingPeer(0, False)
+        joiner.join(self.peers[1].get_conn_info(self.peers[1]))
+        wait_for(joiner.is_ready)
+        self.peers.append(joiner)
+
+        self.assertEqual(joiner.get_own_pid(), NUM_PARTICIPANTS)
+        for peer in self.peers:
+            wait_for(lambda: len(peer.get_participants()) == NUM_PARTICIPANTS + 1)
+            self.assertEqual(peer.get_epoch(), 1)
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS)
+        self.assertEqual(sorted(self.peers[0].get_participants(0)), list(range(NUM_PARTICIPANTS)))
+        # membership chains are not shown to the application
+        self.assertEqual(self.peers[0].game, [])
+
+        joiner.offer(Chain(joiner.get_own_pid(), [Action(joiner.get_own_pid(), "MOVE 3")]))
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+
+        joiner.leave()
+        for peer in self.peers[:-1]:
+            wait_for(lambda: len(peer.get_participants()) == NUM_PARTICIPANTS)
+            self.assertEqual(peer.get_epoch(), 2)
+        wait_for(lambda: not joiner.is_ready())
+
+    def test_healthy_peer_not_removed(self):
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+        # nobody else suspects pid 2
+        with self.assertRaises(OfferAborted) as aborted:
+            self.peers[1].remove(2).result(TIMEOUT)
+        self.assertEqual(aborted.exception.reason, OfferAborted.REFUSED)
+        for peer in self.peers:
+            self.assertEqual(len(peer.get_participants()), NUM_PARTICIPANTS)
+
+
+class LazyPeer(AcceptingPeer):
+    IDLE_TIMEOUT = 0.5
+
+class QuietPeer(AcceptingPeer):
+    HEARTBEAT_INTERVAL = None
+
+class TestWithoutHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = bootstrap(NUM_PARTICIPANTS, QuietPeer)
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def test_messages_acked(self):
+        leader = self.peers[0]
+        for i in range(3):
+            leader.offer(Chain(0, [Action(0, f"MOVE {i}")])).result(TIMEOUT)
+        # acknowledged without PING/PONG, so nothing is kept for retransmission
+        for peer in self.peers:
+            for session in peer.sessions.values():
+                wait_for(lambda: not session.unacked)
+
+
+class TestLazyConnections(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = bootstrap(NUM_PARTICIPANTS, LazyPeer, lazy=True)
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def test_connect_on_demand_and_evict(self):
+        # guests only connected to the host
+        self.assertIsNone(self.peers[1].__route__(2))
+
+        proposer = self.peers[1]
+        proposer.offer(Chain(1, [Action(1, "MOVE 1")]))
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+        self.assertIsNotNone(proposer.__route__(2))
+
+        wait_for(lambda: not any(peer.__connected_pids__() for peer in self.peers))
+
+        for peer in self.peers:
+            peer.got_commit.clear()
+        proposer.offer(Chain(1, [Action(1, "MOVE 2")]))
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+            self.assertEqual(peer.game[-1].actions[0].content, "MOVE 2")
+
+
+class TestHostlessBootstrap(unittest.TestCase):
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def test_chain_of_seeds(self):
+        # each peer only knows the one started before it
+        num_participants = 5
+        self.peers = [AcceptingPeer(0, False) for _ in range(num_participants)]
+        seed = []
+        for peer in self.peers:
+            peer.setup_gossip(seed, num_participants)
+            seed = [peer.get_conn_info(peer)]
+
+        wait_for(lambda: all(peer.is_ready() for peer in self.peers))
+        conn_infos = sorted(peer.get_conn_info(peer) for peer in self.peers)
+        for peer in self.peers:
+            self.assertEqual(peer.participants, conn_infos)
+            self.assertEqual(peer.get_own_pid(), conn_infos.index(peer.get_conn_info(peer)))
+
+        proposer = self.peers[-1]
+        proposer.offer(Chain(proposer.get_own_pid(), [Action(proposer.get_own_pid(), "MOVE 1")]))
+        for peer in self.peers:
+            self.assertTrue(peer.got_commit.wait(TIMEOUT))
+
+
+class SlowPeer(AcceptingPeer):
+    """
+    Stops handling messages while <gate> is cleared
+    """
+    SEND_WINDOW = 4
+    SEND_QUEUE_LIMIT = 8
+    BACKPRESSURE_TIMEOUT = 0.3
+
+    def __init__(self, port, is_host, **kwargs):
+        super().__init__(port, is_host, **kwargs)
+        self.gate = Event()
+        self.gate.set()
+
+    def respond(self, offer):
+        self.gate.wait()
+        super().respond(offer)
+
+class OfferingPeer(SlowPeer):
+    """
+    Makes an offer of its own from respond() while <reoffer> is set
+    """
+    def __init__(self, port, is_host, **kwargs):
+        super().__init__(port, is_host, **kwargs)
+        self.reoffer = False
+        self.reoffered = []  # (exception, seconds taken)
+
+    def respond(self, offer):
+        if self.reoffer:
+            start = monotonic()
+            try:
+                self.offer(Chain(self.get_own_pid(), [Action(self.get_own_pid(), "MOVE again")]))
+                self.reoffered.append((None, monotonic() - start))
+            except Backpressure as e:
+                self.reoffered.append((e, monotonic() - start))
+        super().respond(offer)
+
+class TestBackpressure(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = bootstrap(NUM_PARTICIPANTS, OfferingPeer)
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.gate.set()
+            peer.stop()
+
+    def test_leader_throttled_by_slow_cohort(self):
+        leader, slow = self.peers[0], self.peers[1]
+        slow.gate.clear()
+
+        futures = []
+        with self.assertRaises(Backpressure):
+            for i in range(50):
+                futures.append(leader.offer(Chain(0, [Action(0, f"MOVE {i}")])))
+        # a window of 4 in flight and 8 queued
+        self.assertLess(len(futures), 20)
+        self.assertLessEqual(len(leader.sessions[1].queued), SlowPeer.SEND_QUEUE_LIMIT)
+
+        slow.gate.set()
+        for future in futures:
+            future.result(TIMEOUT)
+        leader.offer(Chain(0, [Action(0, "MOVE 50")])).result(TIMEOUT)
+        wait_for(lambda: len(slow.game) == len(futures) + 1)
+
+    def test_offer_from_callback_fails_fast(self):
+        leader, slow = self.peers[0], self.peers[1]
+        slow.gate.clear()
+        futures = []
+        with self.assertRaises(Backpressure):
+            for i in range(50):
+                futures.append(leader.offer(Chain(0, [Action(0, f"MOVE {i}")])))
+
+        # respond() runs on the thread that would handle the credit
+        leader.reoffer = True
+        self.peers[2].offer(Chain(2, [Action(2, "MOVE 2")]))
+        wait_for(lambda: leader.reoffered)
+        error, elapsed = leader.reoffered[0]
+        self.assertIsInstance(error, Backpressure)
+        self.assertLess(elapsed, SlowPeer.BACKPRESSURE_TIMEOUT)
+        slow.gate.set()
+
+
+class LimitedPeer(AcceptingPeer):
+    PROPOSE_RATE = 0.0
+    PROPOSE_BURST = 3
+
+class TestFloodProtection(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = bootstrap(NUM_PARTICIPANTS, LimitedPeer)
+        for peer in self.peers:
+            wait_for(lambda: len(peer.connections) == NUM_PARTICIPANTS - 1)
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+
+    def test_flood_dropped_unread(self):
+        flooder, cohort, honest = self.peers
+        futures = [flooder.offer(Chain(0, [Action(0, f"MOVE {i}")])) for i in range(10)]
+        wait_for(lambda: cohort.limiter.dropped.get(0) == 7)
+        # the flooder is told, and does not wait on its dropped offers
+        refused = [future for future in futures[3:] if future.exception(TIMEOUT)]
+        self.assertEqual(len(refused), 7)
+        # dropped messages still count as received
+        wait_for(lambda: cohort.sessions[0].received == flooder.sessions[1].sent)
+
+        honest.offer(Chain(2, [Action(2, "MOVE 1")])).result(TIMEOUT)
+        wait_for(lambda: len(cohort.game) == 4)
+
+
+class RecordingPeer(AcceptingPeer):
+    """
+    Records raw payloads instead of decoding protocol messages
+    """
+    def __init__(self, **kwargs):
+        super().__init__(0, False, **kwargs)
+        self.received = []
+
+    def on_receive(self, sender, message):
+        self.received.append(message)
+
+class TestWriteCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = RecordingPeer()
+        self.sender = RecordingPeer(flush_deadline=0.05)
+        self.receiver.listen_for_connections(lambda connection: None)
+
+    def tearDown(self):
+        self.sender.stop()
+        self.receiver.stop()
+
+    def test_burst_is_coalesced(self):
+        connection = self.sender.connect(self.receiver.get_conn_info(self.receiver))
+        self.assertIsNotNone(connection)
+        self.assertEqual(connection.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+
+        messages = [f"COMMIT {i}" for i in range(100)]
+        for message in messages:
+            self.sender.send(connection, message)
+
+        wait_for(lambda: len(self.receiver.received) == len(messages))
+        self.assertEqual(self.receiver.received, messages)
+        self.assertLess(self.sender.stats["sendmsg"], 10)
+        self.assertLess(self.sender.stats["wakeups"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,437 @@
+import unittest
+import asyncio
+from time import sleep
+from threading import Thread, Event
+from ruban.Trader import Trader, OfferAborted
+from ruban.Offer import Action, Offer, Message
+from ruban import Dissemination
+from ruban import Sync
+from ruban.CommitLog import CommitLog
+from tempfile import TemporaryDirectory
+from tests.util import TIMEOUT, LocalTrader, Network, make_network, make_chain, wait_for
+
+class TestTrader(unittest.TestCase):
+
+    def test_all_ok_commits(self):
+        network = make_network(4)
+        network[0].offer(make_chain(0, "MOVE 1"))
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+
+class TestResponseDeadline(unittest.TestCase):
+
+    def test_missing_response_aborts(self):
+        network = make_network(3, silent={2}, response_timeout=0.05)
+        network[0].offer(make_chain(0, "MOVE 1"))
+
+        # callbacks of timers run off the timer thread
+        wait_for(lambda: all(trader.aborts for trader in network))
+        for trader in network:
+            self.assertEqual(trader.game, [])
+            self.assertEqual(len(trader.aborts), 1)
+
+    def test_missing_response_excluded(self):
+        network = make_network(3, silent={2}, response_timeout=0.05,
+                               on_missing=Trader.Missing.EXCLUDE)
+        network[0].offer(make_chain(0, "MOVE 1"))
+
+        wait_for(lambda: all(trader.game for trader in network))
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+
+    def test_no_deadline_when_all_respond(self):
+        network = make_network(3, response_timeout=0.05)
+        network[0].offer(make_chain(0, "MOVE 1"))
+        # resolved during the broadcast; no timer is left behind
+        self.assertIsNone(network[0]._Trader__get_offer(make_chain(0, "MOVE 1")).deadline)
+        sleep(0.1)
+        self.assertEqual(len(network[0].game), 1)
+        self.assertEqual(network[0].aborts, [])
+
+    def test_suspected_cohort_not_waited_for(self):
+        network = make_network(3, silent={2}, on_missing=Trader.Missing.EXCLUDE)
+        network[0].offer(make_chain(0, "MOVE 1"))
+        self.assertEqual(network[0].game, [])
+
+        network[0].suspect(2)
+        self.assertEqual(len(network[0].game), 1)
+        self.assertEqual(network[0].aborts, [])
+
+    def test_callbacks_do_not_hold_up_timers(self):
+        network = make_network(2, silent={1}, response_timeout=0.05)
+        release = Event()
+        network[0].aborted = lambda chain: release.wait(TIMEOUT)
+        future = network[0].offer(make_chain(0, "MOVE 1"))
+
+        # aborted() blocks, yet other timers still fire
+        fired = Event()
+        network[0].timers.schedule(0.2, fired.set)
+        self.assertTrue(fired.wait(1))
+        release.set()
+        with self.assertRaises(OfferAborted):
+            future.result(TIMEOUT)
+
+class TestCommitLog(unittest.TestCase):
+
+    def test_committed_and_aborted_are_logged(self):
+        with TemporaryDirectory() as path:
+            network = make_network(3, silent={2}, response_timeout=0.05)
+            network[1].commit_log = CommitLog(path)
+            network[2].silent = False
+            network[0].offer(make_chain(0, "MOVE 1"))
+            network[2].silent = True
+            network[0].offer(make_chain(0, "MOVE 2"))
+            wait_for(lambda: network[1].aborts)
+            network[1].commit_log.close()
+
+            recovered = CommitLog(path).recover()
+            self.assertEqual([chain.actions[0].content for chain in recovered.history], ["MOVE 1"])
+            self.assertEqual(recovered.pending, {})
+            self.assertEqual(recovered.tombstones, {make_chain(0, "MOVE 2").digest()})
+
+    def test_leader_logs_commit_before_broadcast(self):
+        with TemporaryDirectory() as path:
+            network = make_network(2)
+            leader = network[0]
+            leader.commit_log = CommitLog(path)
+            logged = []
+            send_to_pid = leader.send_to_pid
+            def send_and_check(pid, message):
+                if message.type == Message.Type.COMMIT:
+                    logged.append([record.kind for record in leader.commit_log.replay()])
+                send_to_pid(pid, message)
+            leader.send_to_pid = send_and_check
+
+            leader.offer(make_chain(0, "MOVE 1"))
+            self.assertEqual(logged, [[CommitLog.Kind.COMMIT]])
+            leader.commit_log.close()
+
+    def test_committed_once_durable_and_unlocked(self):
+        with TemporaryDirectory() as path:
+            network = make_network(2)
+            cohort = network[1]
+            cohort.commit_log = CommitLog(path)
+            seen = []
+            def committed(chain):
+                # another thread may take the lock meanwhile
+                lock = cohort._Trader__lock
+                free = []
+                def take():
+                    free.append(lock.acquire(blocking=False))
+                    if free[0]:
+                        lock.release()
+                thread = Thread(target=take)
+                thread.start()
+                thread.join()
+                seen.append((free[0], cohort.commit_log.durable_seq))
+            cohort.committed = committed
+            # the OK is delivered from outside the cohort's lock
+            sent = []
+            cohort.send_to_pid = lambda pid, message: sent.append(message)
+
+            future = network[0].offer(make_chain(0, "MOVE 1"))
+            network[0]._Trader__recv(sent.pop())
+            future.result(TIMEOUT)
+            self.assertEqual(seen, [(True, 1)])
+            cohort.commit_log.close()
+
+    def test_offers_not_synced_without_group_commit(self):
+        with TemporaryDirectory() as path:
+            network = make_network(3)
+            for trader in network:
+                trader.commit_log = CommitLog(f"{path}/{trader.pid}",
+                                              durability=CommitLog.Durability.OS)
+            synced = []
+            for trader in network:
+                trader.commit_log.sync = synced.append
+            for i in range(3):
+                network[0].offer(make_chain(0, f"MOVE {i}")).result(TIMEOUT)
+            self.assertEqual(synced, [])
+            for trader in network:
+                self.assertEqual(len(list(trader.commit_log.replay())), 3)
+
+class TestDissemination(unittest.TestCase):
+
+    def test_tree_covers_everyone_once(self):
+        participants = list(range(10))
+        for root in participants:
+            reached = [root]
+            for pid in reached:
+                reached.extend(Dissemination.children(participants, root, pid, 3))
+            self.assertEqual(sorted(reached), participants)
+            for pid in participants:
+                parent = Dissemination.parent(participants, root, pid, 3)
+                if pid == root:
+                    self.assertIsNone(parent)
+                else:
+                    self.assertIn(pid, Dissemination.children(participants, root, parent, 3))
+
+    def test_leader_sends_to_fanout(self):
+        network = make_network(15, fanout=2)
+        network[3].offer(make_chain(3, "MOVE 1"))
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+        # PROPOSE and COMMIT to two children each
+        self.assertEqual(network[3].sent, 4)
+
+    def test_duplicate_relay_dropped(self):
+        network = make_network(4, fanout=2)
+        network[0].offer(make_chain(0, "MOVE 1"))
+        sent = network[1].sent
+        # the leader's COMMIT arrives again
+        commit = network[0]._Trader__get_offer(make_chain(0, "MOVE 1")).get_message(0)
+        network[1]._Trader__recv(commit)
+        self.assertEqual(len(network[1].game), 1)
+        self.assertEqual(network[1].sent, sent)
+
+    def test_identical_chain_offered_again(self):
+        for network in (make_network(3), make_network(4, fanout=2)):
+            for _ in range(2):
+                network[0].offer(make_chain(0, "PASS")).result(TIMEOUT)
+            for trader in network:
+                self.assertEqual(len(trader.game), 2)
+
+    def test_oks_aggregated(self):
+        network = make_network(15, fanout=2, aggregate=True)
+        chain = make_chain(3, "MOVE 1")
+        network[3].offer(chain)
+        for trader in network:
+            self.assertEqual(len(trader.game), 1)
+        # one AGGREGATE from each child
+        self.assertEqual(network[3].received, 2)
+        self.assertEqual(len(network[3]._Trader__get_offer(chain).chain.OKs), 14)
+
+    def test_interior_node_forwards_partial_aggregate(self):
+        # pid 5 never responds; its parent 2 forwards 6's OK without it
+        network = make_network(7, silent={5}, fanout=2, aggregate=True,
+                               response_timeout=0.2, on_missing=Trader.Missing.EXCLUDE)
+        chain = make_chain(0, "MOVE 1")
+        network[0].offer(chain)
+
+        wait_for(lambda: network[0].game)
+        self.assertEqual(network[0]._Trader__get_offer(chain).missing, [5])
+
+class TestFutures(unittest.TestCase):
+
+    def test_future_resolves_to_committed_chain(self):
+        network = make_network(3)
+        chain = make_chain(0, "MOVE 1")
+        future = network[0].offer(chain)
+        self.assertIs(future.result(TIMEOUT), network[0].game[0])
+
+    def test_future_fails_on_abort(self):
+        network = make_network(3, silent={2}, response_timeout=0.05)
+        future = network[0].offer(make_chain(0, "MOVE 1"))
+        with self.assertRaises(OfferAborted) as aborted:
+            future.result(TIMEOUT)
+        self.assertEqual(aborted.exception.reason, OfferAborted.DEADLINE)
+
+    def test_future_fails_when_propose_refused(self):
+        network = make_network(3)
+        # a full send queue to pid 2
+        network[0].send_to_pid = lambda pid, message: (
+            False if pid == 2 and message.type == Message.Type.PROPOSE
+            else LocalTrader.send_to_pid(network[0], pid, message))
+        future = network[0].offer(make_chain(0, "MOVE 1"))
+        with self.assertRaises(OfferAborted) as aborted:
+            future.result(TIMEOUT)
+        self.assertEqual(aborted.exception.reason, OfferAborted.BACKPRESSURE)
+        self.assertEqual(network[1].game, [])
+
+    def test_future_follows_accepted_counter(self):
+        network = make_network(2, silent={1})
+        leader, cohort = network
+        chain = make_chain(0, "MOVE 1")
+        future = leader.offer(chain)
+
+        counter = chain.counter([Action(1, "MOVE 2")])
+        cohort.reject(chain, counter)
+        leader.accept(leader._Trader__get_offer(chain).counters[1])
+        self.assertFalse(future.done())
+        cohort.accept(cohort._Trader__get_offer(counter))
+        self.assertEqual(future.result(TIMEOUT).digest(), counter.digest())
+
+    def test_offers_awaited_concurrently(self):
+        network = make_network(3, silent={1}, response_timeout=0.2,
+                               on_missing=Trader.Missing.EXCLUDE)
+
+        # the silent cohort refuses offers beyond MAX_IN_FLIGHT
+        count = Trader.MAX_IN_FLIGHT
+
+        async def play():
+            return await asyncio.gather(*(network[0].offer_async(make_chain(0, f"MOVE {i}"))
+                                          for i in range(count)))
+
+        committed = asyncio.run(play())
+        self.assertEqual([chain.actions[0].content for chain in committed],
+                         [f"MOVE {i}" for i in range(count)])
+
+    def test_waiting_for_capacity_does_not_block_the_loop(self):
+        network = make_network(2)
+        network[0].wait_for_capacity = lambda timeout: sleep(0.2) or True
+
+        async def play():
+            ticks = []
+            async def tick():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(0.01)
+            ticker = asyncio.ensure_future(tick())
+            await network[0].offer_async(make_chain(0, "MOVE 1"))
+            ticker.cancel()
+            return len(ticks)
+
+        self.assertGreater(asyncio.run(play()), 5)
+        self.assertEqual(len(network[1].game), 1)
+
+class LimitedTrader(LocalTrader):
+    MAX_CHAIN_ACTIONS = 3
+    MAX_IN_FLIGHT = 2
+
+class TestFloodProtection(unittest.TestCase):
+
+    def make_network(self):
+        # pid 2 never answers, so offers stay in flight
+        network = Network()
+        for pid in range(3):
+            LimitedTrader(network, silent=pid == 2)
+        return network
+
+    def test_offers_in_flight_capped(self):
+        network = self.make_network()
+        futures = [network[0].offer(make_chain(0, f"MOVE {i}")) for i in range(5)]
+        self.assertEqual(len(network[1]._Trader__offers), LimitedTrader.MAX_IN_FLIGHT)
+        # the leader hears about the refused ones
+        for future in futures[LimitedTrader.MAX_IN_FLIGHT:]:
+            self.assertEqual(future.exception(TIMEOUT).reason, OfferAborted.REFUSED)
+
+        # other leaders are not affected
+        network[2].offer(make_chain(2, "MOVE 1"))
+        self.assertEqual(len(network[1]._Trader__offers), LimitedTrader.MAX_IN_FLIGHT + 1)
+
+    def test_counter_of_other_leader_not_exempt(self):
+        network = self.make_network()
+        for i in range(2):
+            network[0].offer(make_chain(0, f"MOVE {i}"))
+        network[1]._Trader__recv(Message(2, Message.Type.PROPOSE, make_chain(2, "MOVE 2")))
+        network[1]._Trader__recv(Message(2, Message.Type.PROPOSE, make_chain(2, "MOVE 3")))
+        # claims to counter an offer of pid 0
+        spoofed = make_chain(0, "MOVE 0").counter([Action(0, "MOVE 1")])
+        spoofed.owner = 2
+        network[1]._Trader__recv(Message(2, Message.Type.PROPOSE, spoofed))
+        owners = [offer.chain.owner for offer in network[1]._Trader__offers.values()]
+        self.assertEqual(owners.count(2), LimitedTrader.MAX_IN_FLIGHT)
+        self.assertEqual(owners.count(0), 2)
+
+    def test_answered_offers_expire(self):
+        network = self.make_network()
+        for trader in network:
+            trader.OFFER_TTL = 0.1
+        # pid 1 answers, but the round waits on pid 2 and never ends
+        future = network[0].offer(make_chain(0, "MOVE 1"))
+        wait_for(lambda: network[1].aborts)
+        self.assertEqual(len(network[1].aborts), 1)
+        self.assertEqual(network[1]._Trader__offers, {})
+
+        # the leader is told and ends the round for everyone
+        self.assertEqual(future.exception(TIMEOUT).reason, OfferAborted.REFUSED)
+        self.assertEqual(network[2]._Trader__offers, {})
+
+    def test_unanswered_offers_do_not_expire(self):
+        network = self.make_network()
+        for trader in network:
+            trader.OFFER_TTL = 0.05
+        # pid 2 leaves it to the application, which takes its time
+        network[2]._Trader__recv(Message(0, Message.Type.PROPOSE, make_chain(0, "MOVE 1")))
+        sleep(0.2)
+        offer = network[2]._Trader__get_offer(make_chain(0, "MOVE 1"))
+        self.assertEqual(offer.state, Offer.State.RECEIVED)
+        self.assertEqual(network[2].aborts, [])
+
+    def test_long_chain_dropped(self):
+        network = self.make_network()
+        network[0].offer(make_chain(0, *(f"MOVE {i}" for i in range(4))))
+        self.assertEqual(len(network[1]._Trader__offers), 0)
+
+
+class TestCatchUp(unittest.TestCase):
+
+    def test_lagging_peer_catches_up(self):
+        network = make_network(3, on_missing=Trader.Missing.EXCLUDE)
+        network.down.add(2)
+        for trader in network[:2]:
+            trader.suspect(2)
+        for i in range(600):
+            network[0].offer(make_chain(0, f"MOVE {i}"))
+        self.assertEqual(network[2].game, [])
+
+        network.down.clear()
+        received = network[2].received
+        network[0].unsuspect(2)
+        self.assertEqual([chain.digest() for chain in network[2].game],
+                         [chain.digest() for chain in network[0].game])
+        # a SUMMARY (answered with our own) and three batches of 256
+        self.assertEqual(network[2].received - received, 4)
+
+        network[1].unsuspect(2)
+        network[1].offer(make_chain(1, "MOVE 600"))
+        for trader in network:
+            self.assertEqual(len(trader.game), 601)
+
+    def test_repeated_chains_caught_up(self):
+        network = make_network(3, on_missing=Trader.Missing.EXCLUDE)
+        network[0].offer(make_chain(0, "PASS"))
+        network.down.add(2)
+        for trader in network[:2]:
+            trader.suspect(2)
+        for content in ("PASS", "PASS", "MOVE 1", "PASS"):
+            network[0].offer(make_chain(0, content))
+        self.assertEqual(len(network[2].game), 1)
+
+        network.down.clear()
+        network[0].unsuspect(2)
+        self.assertEqual([chain.digest() for chain in network[2].game],
+                         [chain.digest() for chain in network[0].game])
+        self.assertEqual(len(network[2].game), 5)
+
+    def test_common_prefix_of_divergent_ledgers(self):
+        chains = [make_chain(0, f"MOVE {i}") for i in range(100)]
+        ahead = Sync.Ledger(chains)
+        behind = Sync.Ledger(chains[:60] + [make_chain(1, "MOVE X")])
+        self.assertEqual(ahead.common(behind.summary()), 60)
+        self.assertLessEqual(len(behind.summary()), 8)
+        batches = list(ahead.batches(60, size=16))
+        self.assertEqual([first for first, _, _, _ in batches], [61, 77, 93])
+        self.assertEqual([done for _, _, done, _ in batches], [False, False, True])
+
+        # the batches fold from our checkpoint into the claimed digests
+        verifier = Sync.Verifier(behind.summary())
+        for first, chains, _, digest in batches:
+            self.assertTrue(verifier.verify(first, chains, digest))
+        self.assertFalse(Sync.Verifier(behind.summary()).verify(*batches[1][:2], batches[1][3]))
+
+    def test_forged_commit_not_committed(self):
+        network = make_network(3)
+        forged = make_chain(0, "MOVE forged")
+        # pid 0 never proposed or committed it
+        network[1]._Trader__recv(Message(2, Message.Type.COMMIT, forged))
+        self.assertEqual(network[1].game, [])
+
+    def test_forged_batch_dropped(self):
+        network = make_network(3)
+        network[0].offer(make_chain(0, "MOVE 1"))
+        forged = make_chain(2, "MOVE forged")
+        # unasked for
+        network[1]._Trader__recv(Message(2, Message.Type.BATCH, None,
+                                (2, [forged], True, network[1].ledger.rolling(1))))
+        self.assertEqual(len(network[1].game), 1)
+
+        # asked for, but not extending our summary
+        network[1]._Trader__catch_ups[2] = Sync.Verifier(network[1].ledger.summary())
+        network[1]._Trader__recv(Message(2, Message.Type.BATCH, None,
+                                (2, [forged], True, network[1].ledger.rolling(1))))
+        self.assertEqual(len(network[1].game), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
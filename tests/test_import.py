@@ -0,0 +1,49 @@
+import unittest
+import subprocess
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# generous upper bound for importing the core; catches accidental backend
+# imports (p2pnetwork alone costs more than this on most machines)
+MAX_CORE_IMPORT_US = 100_000
+
+def importtime(statement):
+    """
+    Run <statement> in a fresh interpreter with -X importtime and
+    return { module: cumulative microseconds }
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+class TestImportTime(unittest.TestCase):
+
+    def test_core_does_not_import_backends(self):
+        modules = importtime("import ruban")
+        self.assertIn("ruban", modules)
+        self.assertNotIn("ruban.Peer", modules)
+        self.assertNotIn("p2pnetwork", modules)
+        self.assertLess(modules["ruban"], MAX_CORE_IMPORT_US)
+
+    def test_backend_imported_on_access(self):
+        try:
+            import p2pnetwork
+        except ImportError:
+            self.skipTest("p2pnetwork is not installed")
+
+        modules = importtime("import ruban; ruban.Peer")
+        self.assertIn("p2pnetwork.node", modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
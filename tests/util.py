@@ -0,0 +1,69 @@
+from time import sleep, monotonic
+from ruban.Trader import Trader
+from ruban.Offer import Action, Chain, Offer
+
+# helpers shared by the tests: a synchronous in-process network of Traders
+
+TIMEOUT = 5
+
+def wait_for(predicate, timeout=TIMEOUT):
+    deadline = monotonic() + timeout
+    while not predicate():
+        if monotonic() > deadline:
+            raise TimeoutError("condition not met in time")
+        sleep(0.01)
+
+class LocalTrader(Trader):
+    """
+    Trader wired to other LocalTraders in the same process;
+    messages are delivered synchronously
+    """
+    def __init__(self, network, silent=False, **kwargs):
+        super().__init__(**kwargs)
+        self.network = network
+        self.pid = len(network)
+        self.silent = silent
+        self.game = []
+        self.aborts = []
+        self.sent = 0
+        self.received = 0
+        # pids whose messages are dropped, shared by the network
+        self.down = network.down if hasattr(network, "down") else set()
+        network.append(self)
+
+    def respond(self, offer):
+        if offer.state == Offer.State.RECEIVED and not self.silent:
+            self.accept(offer)
+
+    def committed(self, chain):
+        self.game.append(chain)
+
+    def aborted(self, chain):
+        self.aborts.append(chain)
+
+    def send_to_pid(self, pid, message):
+        if pid in self.down or self.pid in self.down:
+            return
+        self.sent += 1
+        self.network[pid].received += 1
+        self.network[pid]._Trader__recv(message)
+
+    def get_participants(self, epoch=None):
+        return list(range(len(self.network)))
+
+    def get_own_pid(self):
+        return self.pid
+
+class Network(list):
+    def __init__(self):
+        super().__init__()
+        self.down = set()
+
+def make_network(num_participants, silent=(), **kwargs):
+    network = Network()
+    for pid in range(num_participants):
+        LocalTrader(network, silent=pid in silent, **kwargs)
+    return network
+
+def make_chain(owner, *contents):
+    return Chain(owner, [Action(owner, content) for content in contents])